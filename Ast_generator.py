@@ -1,23 +1,171 @@
-from solcx import compile_source, install_solc
+import asyncio
 import json
+import os
+import re
+import shutil
+import subprocess
 
-# 安装指定版本的solc
-install_solc('0.8.26')
+from utilities.ast_cache import AstCache, get_default_cache
+
+# transient 状态变量 (Local2Global 的 transient 模式) 需要 0.8.28
+SOLC_VERSION = '0.8.28'
+# standard-json 输入中使用的源文件名
+SOURCE_NAME = 'contract.sol'
+
+# 进程内缓存的solc路径和版本, 只在第一次真正编译时解析
+_solc_binary = None
+_solc_version = None
+_configured_solc_binary = None
+
+
+def set_solc_binary(path):
+    """指定solc可执行文件(例如离线构建机上的路径), 空值表示恢复自动查找"""
+    global _configured_solc_binary, _solc_binary, _solc_version
+    if (path or None) == _configured_solc_binary:
+        return
+    _configured_solc_binary = path or None
+    _solc_binary = None
+    _solc_version = None
+
+
+def _read_solc_version(binary):
+    """读取solc --version输出中的版本号"""
+    try:
+        result = subprocess.run([binary, "--version"], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"Version:\s*(\d+\.\d+\.\d+)", result.stdout)
+    return match.group(1) if match else None
+
+
+def _resolve_solc_binary():
+    """
+    按优先级解析solc, 尽量不联网:
+    1. set_solc_binary() 或环境变量 SOLC_BINARY 指定的路径
+    2. solcx 已经安装好的 SOLC_VERSION
+    3. PATH 中版本匹配的 solc
+    4. 最后才用 solcx 下载安装 (SOLOBF_SOLC_OFFLINE=1 时禁止)
+    """
+    configured = _configured_solc_binary or os.environ.get("SOLC_BINARY")
+    if configured:
+        if not os.path.isfile(configured):
+            raise FileNotFoundError(f"Configured solc binary does not exist: {configured}")
+        return configured, _read_solc_version(configured) or SOLC_VERSION
+
+    try:
+        import solcx
+    except ImportError:
+        solcx = None
+
+    if solcx is not None:
+        try:
+            installed = [str(v) for v in solcx.get_installed_solc_versions()]
+        except Exception:
+            installed = []
+        if SOLC_VERSION in installed:
+            return str(solcx.get_executable(SOLC_VERSION)), SOLC_VERSION
+
+    path_solc = shutil.which("solc")
+    if path_solc and _read_solc_version(path_solc) == SOLC_VERSION:
+        return path_solc, SOLC_VERSION
+
+    if solcx is None or os.environ.get("SOLOBF_SOLC_OFFLINE") == "1":
+        raise RuntimeError(
+            f"solc {SOLC_VERSION} not found. Set SOLC_BINARY (or solcPath in the configuration) "
+            f"to an installed solc, or install py-solc-x and allow it to download the compiler.")
+
+    solcx.install_solc(SOLC_VERSION)
+    return str(solcx.get_executable(SOLC_VERSION)), SOLC_VERSION
+
+
+def get_solc_binary():
+    """返回solc路径, 每个进程只解析一次"""
+    global _solc_binary, _solc_version
+    if _solc_binary is None:
+        _solc_binary, _solc_version = _resolve_solc_binary()
+    return _solc_binary
+
+
+def get_solc_version():
+    get_solc_binary()
+    return _solc_version
 
 
 def generate_ast_from_source(solidity_code):
     """从Solidity源代码生成AST"""
-    compiled_sol = compile_source(
-        solidity_code,
-        output_values=['ast'],
-        solc_version='0.8.26'
-    )
+    return compile_ast(solidity_code)
+
+
+def build_standard_json_input(solidity_code, output_selection=None):
+    """构造solc standard-json输入, 默认只请求AST"""
+    if output_selection is None:
+        output_selection = {"*": {"": ["ast"]}}
+    return {
+        "language": "Solidity",
+        "sources": {SOURCE_NAME: {"content": solidity_code}},
+        "settings": {"outputSelection": output_selection},
+    }
+
+
+def _cache_key(input_json):
+    return AstCache.make_key(input_json["sources"][SOURCE_NAME]["content"], get_solc_version(),
+                             input_json.get("settings", {}))
+
+
+def _parse_solc_output(stdout, stderr):
+    """解析solc --standard-json的输出, 编译错误时抛出异常"""
+    if not stdout.strip():
+        raise RuntimeError(f"solc --standard-json failed:\n{stderr}")
+    output = json.loads(stdout)
+    errors = [e for e in output.get("errors", []) if e.get("severity") == "error"]
+    if errors:
+        raise RuntimeError("solc compilation failed:\n" + "\n".join(
+            e.get("formattedMessage", e.get("message", "")) for e in errors))
+    return output
+
+
+def compile_standard_json(input_json, use_cache=True):
+    """通过stdin把standard-json交给solc, 编译错误时抛出异常; 相同源码+版本+设置直接命中缓存"""
+    cache = get_default_cache() if use_cache else None
+    if cache is not None:
+        key = _cache_key(input_json)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    result = subprocess.run([get_solc_binary(), "--standard-json"], input=json.dumps(input_json),
+                            capture_output=True, text=True)
+    output = _parse_solc_output(result.stdout, result.stderr)
+
+    if cache is not None:
+        cache.put(key, output)
+    return output
+
+
+async def compile_standard_json_async(input_json, use_cache=True):
+    """compile_standard_json的asyncio版本: 等待solc子进程时事件循环可以继续调度其他编译和任务"""
+    cache = get_default_cache() if use_cache else None
+    if cache is not None:
+        key = _cache_key(input_json)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    process = await asyncio.create_subprocess_exec(
+        get_solc_binary(), "--standard-json",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate(json.dumps(input_json).encode("utf-8"))
+    output = _parse_solc_output(stdout.decode("utf-8"), stderr.decode("utf-8", errors="replace"))
+
+    if cache is not None:
+        cache.put(key, output)
+    return output
 
-    # 获取第一个合约的AST
-    contract_id, contract_interface = compiled_sol.popitem()
-    ast = contract_interface['ast']
 
-    return ast
+def compile_ast(solidity_code):
+    """在内存中编译Solidity源代码并直接返回AST, 不读写任何中间文件"""
+    output = compile_standard_json(build_standard_json_input(solidity_code))
+    return output["sources"][SOURCE_NAME]["ast"]
 
 
 def generate_ast_from_file(file_path):
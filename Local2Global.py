@@ -2,11 +2,24 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
 from noTouchPure import noTouchPure
+from utilities.ast_index import AstIndex, LOOP_NODE_TYPES
+from utilities.edit_buffer import EditBuffer, OffsetMap
 import random
 import copy
 import re
 
+# transient state variables (EIP-1153) are accepted by solc from this version on
+TRANSIENT_MIN_VERSION = (0, 8, 28)
+
+# EIP-2929 / EIP-2200 / EIP-1153 costs behind the per-variable gas report
+STACK_ACCESS_GAS = 3
+COLD_SLOAD_GAS = 2100
+WARM_ACCESS_GAS = 100
+SSTORE_SET_GAS = 20000
+TRANSIENT_ACCESS_GAS = 100
+
 
 class LocalToGlobalConverter:
     """
@@ -15,38 +28,42 @@ class LocalToGlobalConverter:
     Output: solidity_source_code, global_variables
     """
 
-    def __init__(self, solidity_source_code, ast_json):
+    def __init__(self, solidity_source_code, ast_json, ast_index=None, transient=False,
+                 skip_loop_writes=False, skip_reference_types=False, hot_functions=()):
         """
         Step 1: Initial Smart Contract Source Code
+        transient: declare the promoted variables "transient" (EIP-1153, solc >= 0.8.28), the local
+            declaration stays behind as an assignment (or "delete") so every call starts from a fresh value
+        skip_loop_writes: keep locals that are written inside a loop local
+        skip_reference_types: keep arrays, structs, strings and bytes local
+        hot_functions: names of profiled hot functions (utilities.call_profile), their locals stay local
         """
         self.source_code = solidity_source_code
         self.ast = ast_json
+        # one traversal of the AST shared by every lookup below and by noTouchPure
+        self.index = ast_index if ast_index is not None else AstIndex(ast_json)
         self.corpus = self.load_corpus()
-        self.ntp = noTouchPure(self.ast)
+        self.ntp = noTouchPure(self.ast, self.index)
+        # original position -> position after renaming
+        self.rename_map = OffsetMap([])
+        # original position -> position in the converted source, lets later passes reuse this AST
+        self.offset_map = OffsetMap([])
+        self.transient = transient
+        self.skip_loop_writes = skip_loop_writes
+        self.skip_reference_types = skip_reference_types
+        self.hot_functions = frozenset(hot_functions)
+        # one entry per promoted variable, see estimate_gas_delta
+        self.gas_report = []
 
     def load_corpus(self):
         """Load variable naming corpus from configuration"""
-        with open("Corpus.txt", "r", encoding="utf-8") as f:
+        corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Corpus.txt")
+        with open(corpus_path, "r", encoding="utf-8") as f:
             return json.loads(f.read())
 
     def find_ast_node(self, key, value, probability=1.0):
-        """BFS traversal to find AST nodes with specific key-value pair"""
-        queue = [self.ast]
-
-        results = []
-
-        while queue:
-            node = queue.pop()
-            for k, v in node.items():
-                if k == key and v == value and random.random() < probability:
-                    results.append(node)
-                elif isinstance(v, dict):
-                    queue.append(v)
-                elif isinstance(v, list):
-                    for item in v:
-                        if isinstance(item, dict):
-                            queue.append(item)
-        return results
+        """Find AST nodes with specific key-value pair (served from the AST index)"""
+        return [node for node in self.index.find(key, value) if random.random() < probability]
 
     def find_local_variables(self, probability=1.0):
         """
@@ -92,7 +109,8 @@ class LocalToGlobalConverter:
                 if not name:
                     continue
 
-                start_pos, end_pos = self.src_to_position(var["src"])
+                # rename only the identifier, not the whole "type name" declaration span
+                start_pos, end_pos = self.src_to_position(var.get("nameLocation", var["src"]))
                 var_id = var["id"]
                 variable_info.append([name, start_pos, end_pos, var_id])
 
@@ -131,76 +149,36 @@ class LocalToGlobalConverter:
 
     def find_variable_references(self, variable_info):
         """Find all identifier nodes that reference this variable"""
-        identifiers = self.find_ast_node("name", "Identifier", 1.0)
         references = []
 
-        for identifier in identifiers:
-            if identifier.get["referencedDeclaration"] == variable_info[3]:
-                start_pos, end_pos = self.src_to_position(identifier["src"])
-                references.append([variable_info[0], start_pos, end_pos, variable_info[3]])
+        for identifier in self.index.references_to(variable_info[3], "Identifier"):
+            start_pos, end_pos = self.src_to_position(identifier["src"])
+            references.append([variable_info[0], start_pos, end_pos, variable_info[3]])
 
         return references
 
     def replace_in_source(self, original_content, replacement_list):
-        """Replace variable names in source code"""
-        if not replacement_list:
-            return original_content
-
-        # Collect all positions that need replacement
-        positions = []
+        """Replace variable names in source code in one pass, recording the offset map"""
+        edits = EditBuffer(original_content)
         for replacement in replacement_list:
             if replacement[1] != 0 and replacement[2] != 0:
-                positions.extend([replacement[1], replacement[2]])
+                edits.replace(replacement[1], replacement[2], replacement[0])
 
-        positions.sort()
+        self.rename_map = edits.offset_map()
+        return edits.apply()
 
-        result = ""
-        current_pos = 0
-        pos_index = 0
-
-        while pos_index < len(positions):
-            if pos_index % 2 == 0:
-                # Add content before replacement
-                result += original_content[current_pos:positions[pos_index]]
-                current_pos = positions[pos_index]
-                pos_index += 1
-            else:
-                # Add replacement
-                replacement_text = self.get_replacement_text(replacement_list,
-                                                             positions[pos_index - 1],
-                                                             positions[pos_index])
-                result += replacement_text
-                current_pos = positions[pos_index]
-                pos_index += 1
-
-        result += original_content[current_pos:]
-        return result
-
-    def get_replacement_text(self, replacement_list, start_pos, end_pos):
-        """Get the replacement text for specific position"""
-        for item in replacement_list:
-            if item[1] == start_pos and item[2] == end_pos:
-                return item[0]
-        return ""
-    
+    def renamed_span(self, node):
+        """Position of an AST node in the renamed source"""
+        start_pos, end_pos = self.src_to_position(node["src"])
+        return self.rename_map.map_span(start_pos, end_pos)
 
     def find_decl_statement_for_var(self, var):
-        var_id = var["id"]
-        queue = [self.ast]
-        while queue:
-            node = queue.pop()
-            if isinstance(node, dict):
-                if node.get("nodeType") == "VariableDeclarationStatement":
-                    for decl in node.get("declarations", []):
-                        if decl and decl.get("id") == var_id:
-                            return node
-                for v in node.values():
-                    if isinstance(v, dict) or isinstance(v, list):
-                        queue.append(v)
-            elif isinstance(node, list):
-                for item in node:
-                    if isinstance(item, dict) or isinstance(item, list):
-                        queue.append(item)
+        stmt = self.index.parent(var)
+        if stmt is None or stmt.get("nodeType") != "VariableDeclarationStatement":
+            return None
+        for decl in stmt.get("declarations", []):
+            if decl and decl.get("id") == var["id"]:
+                return stmt
         return None
 
 
@@ -217,6 +195,15 @@ class LocalToGlobalConverter:
             stmt = self.find_decl_statement_for_var(var)
             if stmt is None:
                 continue
+            # tuple declarations "(a, b) = f()" cannot become state variable declarations
+            if len(stmt.get("declarations", [])) != 1:
+                continue
+            if (self.skip_reference_types or self.transient) and not self.is_value_type(var):
+                continue
+            if self.skip_loop_writes and self.is_written_in_loop(var, stmt):
+                continue
+            if self.in_hot_function(var):
+                continue
 
             filtered.append(var)
             self.var_to_stmt[var["id"]] = stmt
@@ -225,53 +212,157 @@ class LocalToGlobalConverter:
 
 
 
+    def in_hot_function(self, node):
+        function = self.index.enclosing_function(node)
+        return function is not None and function.get("name") in self.hot_functions
+
+    @staticmethod
+    def is_value_type(var):
+        """Elementary value types, enums, contracts and user defined value types; no arrays, structs, strings, bytes"""
+        type_id = var.get("typeDescriptions", {}).get("typeIdentifier", "")
+        return bool(type_id) and not type_id.endswith("_ptr") and \
+            not type_id.startswith(("t_mapping", "t_function", "t_string", "t_bytes_", "t_array", "t_struct"))
+
+    def is_write(self, identifier):
+        """True if the identifier is assigned, incremented, decremented or deleted (also through a[i], s.x, tuples)"""
+        node = identifier
+        parent = self.index.parent(node)
+        while parent is not None and (
+                parent.get("nodeType") == "TupleExpression"
+                or (parent.get("nodeType") == "IndexAccess" and parent.get("baseExpression") is node)
+                or (parent.get("nodeType") == "MemberAccess" and parent.get("expression") is node)):
+            node, parent = parent, self.index.parent(parent)
+        if parent is None:
+            return False
+        if parent.get("nodeType") == "Assignment":
+            return parent.get("leftHandSide") is node
+        return parent.get("nodeType") == "UnaryOperation" and parent.get("operator") in ("++", "--", "delete")
+
+    def in_loop(self, node):
+        return self.index.has_ancestor_of_type(node, LOOP_NODE_TYPES)
+
+    def is_written_in_loop(self, var, stmt):
+        """The declaration itself runs once per iteration inside a loop, or some write sits in a loop"""
+        if self.in_loop(stmt):
+            return True
+        return any(self.in_loop(ref) and self.is_write(ref)
+                   for ref in self.index.references_to(var["id"], "Identifier"))
+
+    def estimate_gas_delta(self, var):
+        """
+        Expected extra gas of the first call after promoting var, against the stack slot it was.
+        Every reference is counted once, so references inside loops are per iteration.
+        Storage: a cold first access, warm ones after it and, if the variable is written,
+        one zero-to-nonzero SSTORE into the never written slot, taken to be the cold access
+        (2100 + 20000 gas). Later calls overwrite a nonzero slot for 2900 instead.
+        """
+        refs = self.index.references_to(var["id"], "Identifier")
+        writes = sum(1 for ref in refs if self.is_write(ref))
+        reads = len(refs) - writes
+        if self.transient:
+            # the declaration became an assignment or "delete"
+            writes += 1
+        accesses = reads + writes
+
+        if not accesses:
+            delta = 0
+        elif self.transient:
+            delta = (TRANSIENT_ACCESS_GAS - STACK_ACCESS_GAS) * accesses
+        else:
+            delta = COLD_SLOAD_GAS + WARM_ACCESS_GAS * (accesses - 1) - STACK_ACCESS_GAS * accesses
+            if writes:
+                delta += SSTORE_SET_GAS
+
+        return {
+            "name": var["name"],
+            "location": "transient" if self.transient else "storage",
+            "reads": reads,
+            "writes": writes,
+            "inLoop": any(self.in_loop(ref) for ref in refs),
+            "gasDelta": delta,
+        }
+
+    def format_gas_report(self):
+        lines = ["Promoted locals, estimated extra gas of the first call (loop references per iteration):"]
+        for entry in self.gas_report:
+            loop = ", in a loop" if entry["inLoop"] else ""
+            lines.append(f"\t{entry['name']} -> {entry['location']}: {entry['reads']} reads, "
+                         f"{entry['writes']} writes{loop}, {entry['gasDelta']:+d} gas")
+        return "\n".join(lines)
+
     def create_global_declarations(self, variables):
-        declarations = ""
+        """
+        Collect the pieces of the declarations to hoist, grouped by the contract each
+        local lives in. A piece is a span of the renamed source, copied verbatim, or literal text.
+        """
+        declarations = {}
 
         for var in variables:
             stmt = self.var_to_stmt.get(var["id"])
-            if stmt is None:
-                start_pos, end_pos = self.src_to_position(var["src"])
+            if self.transient and var.get("typeName"):
+                # "T transient name": transient variables cannot have an initializer
+                pieces = [self.renamed_span(var["typeName"]), " transient ",
+                          self.rename_map.map_span(*self.src_to_position(var.get("nameLocation", var["src"])))]
             else:
-                start_pos, end_pos = self.src_to_position(stmt["src"])
-
-            declaration = self.source_code[start_pos:end_pos]
-            declarations += "\t" + declaration + ";\n"
+                pieces = [self.renamed_span(var if stmt is None else stmt)]
+            contract = self.index.enclosing_contract(var)
+            contract_id = contract["id"] if contract else None
+            declarations.setdefault(contract_id, []).append(pieces)
 
         return declarations
 
 
-    def remove_local_declarations(self, content, variables):
-        modified_content = content
-
+    def remove_local_declarations(self, edits, variables):
+        """
+        Blank out the local declaration statements (and their semicolon).
+        For transient variables only the type is blanked, "T x = v;" stays as "x = v;",
+        and "T x;" becomes "delete x;", so every call still starts from a fresh value
+        """
         for var in variables:
             stmt = self.var_to_stmt.get(var["id"])
             if stmt is None:
                 continue
 
-            start_pos, end_pos = self.src_to_position(stmt["src"])
-
-            spaces = " " * (end_pos - start_pos)
-            modified_content = modified_content[:start_pos] + spaces + modified_content[end_pos+1:]
-
-        return modified_content
+            start_pos, end_pos = self.renamed_span(stmt)
 
+            if self.transient:
+                name_start, name_end = self.rename_map.map_span(
+                    *self.src_to_position(var.get("nameLocation", var["src"])))
+                if stmt.get("initialValue") is not None:
+                    edits.replace(start_pos, name_start, " " * (name_start - start_pos))
+                else:
+                    statement = "delete " + edits.text[name_start:name_end]
+                    edits.replace(start_pos, end_pos, statement.ljust(end_pos - start_pos))
+                continue
 
-    def insert_global_declarations(self, content, declarations):
-        """Insert global declarations at the beginning of contract"""
-        contract_nodes = self.find_ast_node("nodeType", "ContractDefinition", 1.0)
-        if not contract_nodes:
+            spaces = " " * (end_pos - start_pos)
+            edits.replace(start_pos, end_pos + 1, spaces)
 
-            return content
 
-        contract_start, contract_end = self.src_to_position(contract_nodes[0]["src"])
+    def insert_global_declarations(self, edits, declarations):
+        """Insert each contract's declarations after its opening brace"""
+        content = edits.text
+        for contract in self.find_ast_node("nodeType", "ContractDefinition", 1.0):
+            if contract["id"] not in declarations:
+                continue
 
-        # Insert declarations after the contract opening brace
-        brace_pos = content.find('{', contract_start, contract_end)
-        if brace_pos != -1:
-            return content[:brace_pos + 1] + "\n" + declarations + content[brace_pos + 1:]
+            contract_start, contract_end = self.renamed_span(contract)
 
-        return content
+            # Insert declarations after the contract opening brace
+            brace_pos = content.find('{', contract_start, contract_end)
+            if brace_pos == -1:
+                continue
+            edits.insert(brace_pos + 1, "\n")
+            for pieces in declarations[contract["id"]]:
+                edits.insert(brace_pos + 1, "\t")
+                for piece in pieces:
+                    if isinstance(piece, str):
+                        edits.insert(brace_pos + 1, piece)
+                    else:
+                        # verbatim copies, so positions inside them stay mappable
+                        start_pos, end_pos = piece
+                        edits.insert(brace_pos + 1, content[start_pos:end_pos], origin=start_pos)
+                edits.insert(brace_pos + 1, ";\n")
 
     def convert_local_to_global(self, conversion_probability=1):
         """
@@ -296,6 +387,7 @@ class LocalToGlobalConverter:
 
         # Reset content after renaming
         self.source_code = renamed_content
+        self.offset_map = self.rename_map
 
         # Filter convertible variables
         convertible_vars = self.filter_convertible_variables(processed_vars)
@@ -306,14 +398,21 @@ class LocalToGlobalConverter:
         # Create global declarations
         global_declarations = self.create_global_declarations(convertible_vars)
 
-        print(global_declarations)
+        print("".join("\t" + "".join(piece if isinstance(piece, str) else self.source_code[piece[0]:piece[1]]
+                              for piece in pieces) + ";\n"
+                      for declarations in global_declarations.values()
+                      for pieces in declarations))
 
+        self.gas_report = [self.estimate_gas_delta(var) for var in convertible_vars]
+        print(self.format_gas_report())
 
-        # Remove local declarations
-        content_without_locals = self.remove_local_declarations(self.source_code, convertible_vars)
 
-        # Insert global declarations
-        final_content = self.insert_global_declarations(content_without_locals, global_declarations)
+        # Remove local declarations and insert global declarations, both against the renamed source
+        edits = EditBuffer(self.source_code)
+        self.remove_local_declarations(edits, convertible_vars)
+        self.insert_global_declarations(edits, global_declarations)
+        final_content = edits.apply()
+        self.offset_map = self.rename_map.then(edits.offset_map())
 
         return final_content, convertible_vars
 
@@ -1,38 +1,60 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from random import randint
 from random import random
 import json
 
+from utilities.ast_index import AstIndex
+from utilities.bool_corpus import load_bool_corpus
+from utilities.edit_buffer import EditBuffer, OffsetMap
+
 class SplitBooleanVariables:
-    def __init__(self, sol_content, ast_json):
+    def __init__(self, sol_content, ast_json, ast_index=None, position_map=None, gas_budget=None, function_gas_budget=None,
+                 hot_functions=()):
         """
         初始化布尔变量分割器
 
         Args:
             sol_content: Solidity 源代码
             ast_json: AST 抽象语法树 JSON
+            ast_index: 可选, 已经建立好的 AstIndex (与其他 pass 共用)
+            position_map: 可选, AST 对应源码位置 -> sol_content 位置 (AST 来自之前的 pass 时使用, 避免重新编译)
+            gas_budget: 可选, 每个字面量的子句在运行时最多花费的 gas (None 表示不限制)
+            function_gas_budget: 可选, 同一个函数内所有子句在运行时最多花费的 gas (None 表示不限制)
+            hot_functions: 可选, 热点函数名 (见 utilities.call_profile), 其中的字面量保持不变
         """
         self.sol_content = sol_content
         self.ast_json = ast_json
-        self.bool_expressions_pool = self._load_bool_expressions()
-
-    def _load_bool_expressions(self):
-        """加载布尔表达式语料库"""
-        try:
-            with open("bool_corpus.json", "r", encoding="utf-8") as f:
-                corpus = json.load(f)
-                return corpus.get("boolExpressions", [])
-        except:
-            # 默认布尔表达式池
-            return [
-                {"text": "msg.sender != address(0)"},
-                {"text": "block.timestamp > 0"},
-                {"text": "address(this).balance >= 0"},
-                {"text": "bytes4(keccak256('test()')) == 0x12345678"},
-                {"text": "tx.origin == msg.sender"}
-            ]
+        self.ast_index = ast_index if ast_index is not None else AstIndex(ast_json)
+        self.position_map = position_map if position_map is not None else OffsetMap([])
+        # 原始位置 -> 分割后位置, 供后续 pass 继续使用原始 AST 的位置
+        self.offset_map = OffsetMap([])
+        # 带 gas 标注的布尔语料库, 每个进程只加载校验一次
+        self.corpus = load_bool_corpus()
+        self.gas_budget = gas_budget
+        self.function_gas_budget = function_gas_budget
+        self.hot_functions = frozenset(hot_functions)
+        # 函数节点 id -> 该函数内被求值的子句已花费的 gas
+        self.function_gas = {}
+        self.evaluated_gas = 0
+
+    def _boolean_literals(self):
+        """AST 中所有布尔字面量及其在 sol_content 中的位置 (无法映射时位置为 None)"""
+        literals = []
+        for node in self.ast_index.of_type("Literal"):
+            if node.get("typeDescriptions", {}).get("typeString") == "bool":
+                src_parts = node["src"].split(":")
+                start_pos = int(src_parts[0])
+                span = self.position_map.map_span(start_pos, start_pos + int(src_parts[1]))
+                literals.append([node.get("value", "false"), span, self.ast_index.enclosing_function(node)])
+        return literals
+
+    def positions_valid(self):
+        """每个布尔字面量都能映射到 sol_content 中且文本一致时, 才能沿用旧的 AST"""
+        for value, span, _ in self._boolean_literals():
+            if span is None or self.sol_content[span[0]:span[1]] != value:
+                return False
+        return True
 
     def find_boolean_constants(self, probability=0.8):
         """
@@ -42,97 +64,67 @@ class SplitBooleanVariables:
             probability: 选择概率阈值
 
         Returns:
-            List of [value, start_pos, end_pos]
+            List of [value, start_pos, end_pos, 所在函数的 AST 节点 (不在函数内时为 None)]
         """
         boolean_constants = []
 
-        def traverse_node(node):
-            """递归遍历 AST 节点"""
-            if isinstance(node, dict):
-
-                # 检查是否为布尔字面量
-                if node.get("nodeType") == "Literal" and node.get("typeDescriptions", {}).get("typeString") == "bool":
-
-                    if random() < probability:
-                        src_parts = node["src"].split(":")
-                        start_pos = int(src_parts[0])
-                        end_pos = start_pos + int(src_parts[1])
-                        value = node.get("value", "false")
-                        boolean_constants.append([value, start_pos, end_pos])
-
-                # 递归遍历子节点
-                for key, value in node.items():
-                    if isinstance(value, (dict, list)):
-                        traverse_node(value)
-            elif isinstance(node, list):
-                for item in node:
-                    traverse_node(item)
-
-        traverse_node(self.ast_json)
+        # 从 AST 索引中直接取出所有布尔字面量, 位置经过 position_map 换算到当前代码
+        for value, span, function in self._boolean_literals():
+            if function is not None and function.get("name") in self.hot_functions:
+                continue
+            if span is not None and random() < probability:
+                boolean_constants.append([value, span[0], span[1], function])
+
         return boolean_constants
 
-    def split_boolean_expression(self, original_value):
+    @staticmethod
+    def _pure_only(function):
+        """
+        只能使用纯字面量子句的位置: 不在函数内 (状态变量和常量的初始值), 修饰器 (可能修饰 pure 函数)
+        和 pure 函数
         """
-        分割布尔表达式
+        if function is None or function.get("nodeType") != "FunctionDefinition":
+            return True
+        return function.get("stateMutability") == "pure"
+
+    def _remaining_budget(self, function):
+        """当前字面量的子句还能花费的 gas, None 表示不限制"""
+        budgets = []
+        if self.gas_budget is not None:
+            budgets.append(self.gas_budget)
+        if function is not None and self.function_gas_budget is not None:
+            budgets.append(self.function_gas_budget - self.function_gas.get(id(function), 0))
+        return min(budgets) if budgets else None
+
+    def split_boolean_expression(self, original_value, function=None):
+        """
+        分割布尔表达式: true 变成 (子句 || true), false 变成 (子句 && false), 结果与子句的值无关
+
+        放在字面量前面的子句会先被求值, 只有在 gas 预算内的子句才这样放;
+        其余子句放在字面量后面, 被短路跳过, 运行时不花 gas
 
         Args:
             original_value: 原始布尔值 ('true' 或 'false')
+            function: 字面量所在函数 / 修饰器的 AST 节点, 不在函数内时为 None
 
         Returns:
-            分割后的表达式字符串
+            (插入到字面量前面的文本, 插入到字面量后面的文本)
         """
-        if original_value.lower() == "true":
-            # 对于 true，使用 || 运算符
-            return self._generate_or_expression()
-        else:
-            # 对于 false，使用 && 运算符
-            return self._generate_and_expression()
-
-    def _generate_or_expression(self):
-        """生成 OR 连接的表达式"""
-        choice = randint(0, 1)
-        if choice == 0 and self.bool_expressions_pool:
-            # 使用布尔表达式
-            bool_exp = self.bool_expressions_pool[randint(0, len(self.bool_expressions_pool) - 1)]
-            return f" || ({bool_exp['text']})"
-        else:
-            # 使用算术表达式比较
-            return self._generate_arithmetic_comparison()
-
-    def _generate_and_expression(self):
-        """生成 AND 连接的表达式"""
-        choice = randint(0, 1)
-        if choice == 0 and self.bool_expressions_pool:
-            # 使用布尔表达式
-            bool_exp = self.bool_expressions_pool[randint(0, len(self.bool_expressions_pool) - 1)]
-            return f" && ({bool_exp['text']})"
-        else:
-            # 使用算术表达式比较
-            return self._generate_arithmetic_comparison()
-
-    def _generate_arithmetic_comparison(self):
-        """生成算术比较表达式"""
-        operators = ["==", "!=", ">", "<", ">=", "<="]
-        operator = operators[randint(0, len(operators) - 1)]
-
-        # 生成两个随机表达式
-        exp1 = self._generate_random_expression()
-        exp2 = self._generate_random_expression()
-
-        return f" && ({exp1} {operator} {exp2})" if random() > 0.5 else f" || ({exp1} {operator} {exp2})"
-
-    def _generate_random_expression(self):
-        """生成随机表达式"""
-        expressions = [
-            "block.number",
-            "block.timestamp",
-            "msg.value",
-            "address(this).balance",
-            "tx.gasprice",
-            str(randint(1, 1000)),
-            "uint256(keccak256(abi.encode(block.timestamp)))"
-        ]
-        return expressions[randint(0, len(expressions) - 1)]
+        # 对于 true 使用 || 运算符, 对于 false 使用 && 运算符
+        operator = "||" if original_value.lower() == "true" else "&&"
+        pure_only = self._pure_only(function)
+
+        if random() < 0.5:
+            clause = self.corpus.choose(self._remaining_budget(function), pure_only)
+            if clause is not None:
+                text, gas = clause
+                self.evaluated_gas += gas
+                if function is not None:
+                    self.function_gas[id(function)] = self.function_gas.get(id(function), 0) + gas
+                return f"(({text}) {operator} ", ")"
+
+        text, _ = self.corpus.choose(pure_only=pure_only)
+        return "(", f" {operator} ({text}))"
 
     def apply_boolean_splitting(self, probability=0.8):
         """
@@ -150,16 +142,17 @@ class SplitBooleanVariables:
         if not boolean_constants:
             return self.sol_content
 
-        # 2. 按照位置排序（从后往前，避免位置偏移）
-        boolean_constants.sort(key=lambda x: x[1], reverse=True)
+        # 2. 每个字面量两边插入一个分割子句, 所有位置都基于原始代码, 一次性拼接
+        edits = EditBuffer(self.sol_content)
+        for value, start_pos, end_pos, function in boolean_constants:
+            prefix, suffix = self.split_boolean_expression(value, function)
+            edits.insert(start_pos, prefix)
+            edits.insert(end_pos, suffix)
+        print(f"布尔分割: {len(boolean_constants)} 个字面量, 运行时被求值的子句估计 {self.evaluated_gas} gas")
 
         # 3. 应用分割
-        modified_content = self.sol_content
-        for value, start_pos, end_pos in boolean_constants:
-            original_text = modified_content[start_pos:end_pos]
-            suffix = self.split_boolean_expression(value)
-            new_expression = original_text + suffix
-            modified_content = modified_content[:start_pos] + new_expression + modified_content[end_pos:]
+        modified_content = edits.apply()
+        self.offset_map = edits.offset_map()
 
         return modified_content
 
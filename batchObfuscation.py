@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import Ast_generator
+import obfuscationPipeline
+from utilities import gas_harness
+from utilities.ast_cache import combine_stats, get_default_cache
+
+DEFAULT_SUFFIX = "_obfu"
+STATUS_FILE_NAME = "obfuscation_status.jsonl"
+# concurrent solc subprocesses of the pipelined scheduler
+DEFAULT_SOLC_JOBS = 4
+
+
+def load_config_file(config_path: str) -> dict:
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_solidity_files(input_dir: str, suffix: str = DEFAULT_SUFFIX, exclude_dir: str = None):
+    """Walk input_dir and return every .sol file that is not already an obfuscation output"""
+    exclude_dir = os.path.abspath(exclude_dir) if exclude_dir else None
+    sol_files = []
+    for root, dirs, files in os.walk(input_dir):
+        if exclude_dir:
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != exclude_dir]
+        for filename in files:
+            name, ext = os.path.splitext(filename)
+            if ext != ".sol" or name.endswith(suffix):
+                continue
+            sol_files.append(os.path.join(root, filename))
+    sol_files.sort()
+    return sol_files
+
+
+def output_path_for(input_path: str, input_dir: str, output_dir: str, suffix: str = DEFAULT_SUFFIX) -> str:
+    """Mirror the input tree under output_dir, adding the suffix to the file name"""
+    relative = os.path.relpath(input_path, input_dir)
+    name, ext = os.path.splitext(relative)
+    return os.path.join(output_dir, f"{name}{suffix}{ext}")
+
+
+def _worker_init(quiet: bool):
+    # forked workers inherit the parent's random state, reseed so files don't share choices
+    random.seed()
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+
+
+def _new_record(input_path: str, output_path: str) -> dict:
+    return {
+        "input": input_path,
+        "output": output_path,
+        "status": "ok",
+        "error": None,
+        "seconds": 0.0,
+        "inputBytes": 0,
+        "outputBytes": 0,
+    }
+
+
+def obfuscate_file(input_path: str, output_path: str, config_dict: dict) -> dict:
+    """Obfuscate one file and return its status record"""
+    record = _new_record(input_path, output_path)
+    started = time.perf_counter()
+    # the cache counters live in this worker process, the record carries this file's share to the parent
+    cache = get_default_cache()
+    before = cache.counters() if cache is not None else None
+    try:
+        with open(input_path, "r", encoding="utf-8") as f:
+            sol_content = f.read()
+        record["inputBytes"] = len(sol_content.encode("utf-8"))
+
+        rename_map = {}
+        sol_content = obfuscationPipeline.run_pipeline(sol_content, config_dict, rename_map=rename_map)
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(sol_content)
+        gas_harness.save_rename_map(output_path, rename_map)
+        record["outputBytes"] = len(sol_content.encode("utf-8"))
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - started, 6)
+    if cache is not None:
+        record["astCache"] = {name: value - before[name] for name, value in cache.counters().items()}
+    return record
+
+
+def obfuscate_directory(input_dir: str, output_dir: str, config_dict: dict, workers: int = None,
+                        status_path: str = None, suffix: str = DEFAULT_SUFFIX, quiet: bool = True):
+    """
+    Obfuscate every .sol file under input_dir across a process pool.
+    One JSON record per file is appended to status_path as soon as the file finishes.
+    Returns the list of records.
+    """
+    input_dir = os.path.abspath(input_dir)
+    output_dir = os.path.abspath(output_dir)
+    if status_path is None:
+        status_path = os.path.join(output_dir, STATUS_FILE_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+
+    sol_files = find_solidity_files(input_dir, suffix, exclude_dir=output_dir)
+    records = []
+
+    with open(status_path, "w", encoding="utf-8") as status_file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_worker_init, initargs=(quiet,)) as pool:
+        futures = {}
+        for path in sol_files:
+            output_path = output_path_for(path, input_dir, output_dir, suffix)
+            futures[pool.submit(obfuscate_file, path, output_path, config_dict)] = (path, output_path)
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                # the worker died (e.g. BrokenProcessPool); record the file and keep collecting the others
+                record = _new_record(*futures[future])
+                record["status"] = "error"
+                record["error"] = f"{type(e).__name__}: {e}"
+            records.append(record)
+            status_file.write(json.dumps(record) + "\n")
+            status_file.flush()
+
+    return records
+
+
+async def _prefetch(input_path: str, config_dict: dict) -> float:
+    """Compile what run_pipeline will compile first for input_path into the AST cache, returns the seconds spent"""
+    started = time.perf_counter()
+    try:
+        with open(input_path, "r", encoding="utf-8") as f:
+            sol_content = f.read()
+        for input_json in obfuscationPipeline.solc_inputs(sol_content, config_dict):
+            await Ast_generator.compile_standard_json_async(input_json)
+    except Exception:
+        # the worker runs into the same problem and records it with the file
+        pass
+    return round(time.perf_counter() - started, 6)
+
+
+async def _run_stages(jobs: list, config_dict: dict, pool, workers: int, solc_jobs: int, queue_size: int,
+                      on_record) -> list:
+    """
+    Three stages joined by bounded queues: a feeder, solc_jobs compile tasks awaiting solc subprocesses,
+    and workers transform tasks each keeping one file busy in the process pool. A full queue blocks the
+    stage before it, so solc runs at most 2 * queue_size + solc_jobs files ahead of the Python passes.
+    A file whose task the pool cannot run gets an error record like any other failure.
+    """
+    loop = asyncio.get_running_loop()
+    to_compile = asyncio.Queue(maxsize=queue_size)
+    to_transform = asyncio.Queue(maxsize=queue_size)
+    # without a cache the compiled results could not be reused, the compile stage only forwards files
+    prefetch = Ast_generator.get_default_cache() is not None
+    records = []
+
+    async def compile_stage():
+        while True:
+            job = await to_compile.get()
+            if job is None:
+                return
+            input_path, output_path = job
+            seconds = await _prefetch(input_path, config_dict) if prefetch else 0.0
+            await to_transform.put((input_path, output_path, seconds))
+
+    async def transform_stage():
+        while True:
+            job = await to_transform.get()
+            if job is None:
+                return
+            input_path, output_path, seconds = job
+            try:
+                record = await loop.run_in_executor(pool, obfuscate_file, input_path, output_path, config_dict)
+            except Exception as e:
+                # the pool itself failed (e.g. BrokenProcessPool); keep draining the queue,
+                # a stage that stopped here would leave the compile stage blocked on a full queue
+                record = _new_record(input_path, output_path)
+                record["status"] = "error"
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["prefetchSeconds"] = seconds
+            records.append(record)
+            on_record(record)
+
+    compilers = [asyncio.create_task(compile_stage()) for _ in range(solc_jobs)]
+    transformers = [asyncio.create_task(transform_stage()) for _ in range(workers)]
+    for job in jobs:
+        await to_compile.put(job)
+    for _ in compilers:
+        await to_compile.put(None)
+    await asyncio.gather(*compilers)
+    for _ in transformers:
+        await to_transform.put(None)
+    await asyncio.gather(*transformers)
+    return records
+
+
+def obfuscate_directory_pipelined(input_dir: str, output_dir: str, config_dict: dict, workers: int = None,
+                                  status_path: str = None, suffix: str = DEFAULT_SUFFIX, quiet: bool = True,
+                                  solc_jobs: int = DEFAULT_SOLC_JOBS, queue_size: int = None):
+    """
+    Like obfuscate_directory, but overlaps solc with the Python passes: while the process pool
+    transforms earlier files, solc subprocesses already compile the sources of upcoming ones
+    (the compiles listed by obfuscationPipeline.solc_inputs) into the shared AST cache, where
+    the workers find them. Throughput tends to the slower of the two stages instead of their sum.
+    queue_size bounds each queue between the stages (default: twice the number of workers).
+    """
+    input_dir = os.path.abspath(input_dir)
+    output_dir = os.path.abspath(output_dir)
+    if status_path is None:
+        status_path = os.path.join(output_dir, STATUS_FILE_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    jobs = [(path, output_path_for(path, input_dir, output_dir, suffix))
+            for path in find_solidity_files(input_dir, suffix, exclude_dir=output_dir)]
+    # the compile stage runs in this process, the workers configure solc themselves in run_pipeline
+    Ast_generator.set_solc_binary(config_dict.get("solcPath"))
+
+    # workers are started on demand; forked ones would inherit the stdin pipes of running solc
+    # processes, which then never see end of input, so they are spawned fresh instead
+    with open(status_path, "w", encoding="utf-8") as status_file, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_worker_init, initargs=(quiet,)) as pool:
+        def on_record(record):
+            status_file.write(json.dumps(record) + "\n")
+            status_file.flush()
+
+        return asyncio.run(_run_stages(jobs, config_dict, pool, workers, max(1, solc_jobs),
+                                       queue_size or 2 * workers, on_record))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless batch obfuscation of a directory of Solidity files")
+    parser.add_argument("input_dir", help="directory that is searched recursively for .sol files")
+    parser.add_argument("output_dir", help="directory that receives the obfuscated files")
+    parser.add_argument("--config", default="Configuration.json", help="configuration file (same format as the GUI)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--status", default=None, help=f"JSONL status file (default: <output_dir>/{STATUS_FILE_NAME})")
+    parser.add_argument("--suffix", default=DEFAULT_SUFFIX, help="suffix added to output file names")
+    parser.add_argument("--solc", default=None, help="path of the solc binary (default: solcPath from the config, then auto-detect)")
+    parser.add_argument("--verbose", action="store_true", help="keep the per-pass output of the workers")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="compile upcoming files with concurrent solc processes while the workers transform earlier ones")
+    parser.add_argument("--solc-jobs", type=int, default=DEFAULT_SOLC_JOBS,
+                        help=f"concurrent solc processes with --pipelined (default: {DEFAULT_SOLC_JOBS})")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="files buffered between the stages with --pipelined (default: twice the workers)")
+    args = parser.parse_args(argv)
+
+    config_dict = load_config_file(args.config)
+    if args.solc:
+        config_dict["solcPath"] = args.solc
+
+    started = time.perf_counter()
+    if args.pipelined:
+        records = obfuscate_directory_pipelined(args.input_dir, args.output_dir, config_dict, args.workers,
+                                                args.status, args.suffix, not args.verbose, args.solc_jobs,
+                                                args.queue_size)
+    else:
+        records = obfuscate_directory(args.input_dir, args.output_dir, config_dict, args.workers,
+                                      args.status, args.suffix, quiet=not args.verbose)
+    elapsed = time.perf_counter() - started
+
+    failed = [r for r in records if r["status"] != "ok"]
+    print(f"Obfuscated {len(records) - len(failed)}/{len(records)} files in {elapsed:.2f}s")
+    cache = get_default_cache()
+    if cache is not None:
+        # the workers' lookups, plus the prefetch compiles made in this process with --pipelined
+        stats = combine_stats([r["astCache"] for r in records if "astCache" in r] + [cache.counters()])
+        print(f"  AST cache: {stats['hits']}/{stats['hits'] + stats['misses']} hits ({stats['hitRate']:.0%}), "
+              f"{stats['evictions']} evictions")
+    if args.pipelined:
+        print(f"  solc prefetch {sum(r['prefetchSeconds'] for r in records):.2f}s, "
+              f"passes {sum(r['seconds'] for r in records):.2f}s (summed over files)")
+    for record in failed:
+        print(f"  FAILED {record['input']}: {record['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
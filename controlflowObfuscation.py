@@ -1,98 +1,124 @@
-from typing import List
+from typing import List, Tuple
 import re
 import random
 
+from utilities.call_profile import function_body_context
+from utilities.edit_buffer import EditBuffer
+from utilities.flattening import DEFAULT_MAX_BLOCKS, ControlFlowFlattener
+from utilities.lexer import tokenize, IDENTIFIER, PUNCT, WHITESPACE
+from utilities.opaque_predicates import DEFAULT_TIER, choose_predicate, pure_only_context
+from utilities.observer import notify
+
 class controlflowConfig:
     instruction_insert_config: bool
     instruction_replace_config: bool
     insert_opaque_predicate_config: bool
     shuffle_code_blocks_config: bool
+    opaque_predicate_tier: str
+    precompute_opaque_predicates: bool
+    flatten_control_flow_config: bool
+    flatten_functions: tuple
+    flatten_max_blocks: int
     
-    def __init__(self, _instruction_insert, _instruction_replace, _insert_opaque_predicate, _shuffle_code_blocks):
+    def __init__(self, _instruction_insert, _instruction_replace, _insert_opaque_predicate, _shuffle_code_blocks,
+                 _opaque_predicate_tier=DEFAULT_TIER, _precompute_opaque_predicates=False,
+                 _flatten_control_flow=False, _flatten_functions=(), _flatten_max_blocks=DEFAULT_MAX_BLOCKS):
         self.instruction_insert_config = _instruction_insert
         self.instruction_replace_config = _instruction_replace
         self.insert_opaque_predicate_config = _insert_opaque_predicate
         self.shuffle_code_blocks_config = _shuffle_code_blocks
+        # cost tier of the opaqueTrue() helper, see utilities.opaque_predicates
+        self.opaque_predicate_tier = _opaque_predicate_tier
+        # seed opaqueTrue() from immutables evaluated once at deploy time
+        self.precompute_opaque_predicates = _precompute_opaque_predicates
+        # functions to flatten (all when empty) and the most blocks a flattened function may have
+        self.flatten_control_flow_config = _flatten_control_flow
+        self.flatten_functions = tuple(_flatten_functions)
+        self.flatten_max_blocks = _flatten_max_blocks
 
 class controlflowObfuscation:
     """ Pipeline:
         remove_comments -> insert_opaque_true_helper -> insert_opaque_true_in_if
-        -> shuffle_code_blocks -> minify_code
+        -> flatten_control_flow -> shuffle_code_blocks -> minify_code
     """
 
     def __init__(self, code: str):
         # store original Solidity source
         self.code = code
 
-    def run(self, config: controlflowConfig) -> str:
+    def run(self, config: controlflowConfig, observer=None, budget=None, hot_functions=None) -> str:
+        # observer(step, before, after) is told about every enabled step and may return replacement code
+        # budget (utilities.size_budget.SizeBudget) thins out opaque predicates near the size limit
+        # hot_functions (names, see utilities.call_profile) are left alone by every step with a runtime cost
         code = self.code
         #code = self.remove_comments(code) # duplicated function in layout obfuscator
         if config.instruction_insert_config:
-            code = self.instruction_insert(code)
+            code = notify(observer, "instructionInsert", code, self.instruction_insert(code, hot_functions))
         if config.instruction_replace_config:
-            code = self.instruction_replace(code)
+            code = notify(observer, "instructionReplace", code, self.instruction_replace(code, hot_functions))
         if config.insert_opaque_predicate_config:
-            code = self.insert_opaque_true_helper(code)
-            code = self.insert_opaque_true_in_if(code)
+            code = notify(observer, "insertOpaquePredicate", code,
+                          self.insert_opaque_true_in_if(
+                              self.insert_opaque_true_helper(code, budget, config.opaque_predicate_tier,
+                                                             config.precompute_opaque_predicates), budget,
+                              hot_functions))
+        if config.flatten_control_flow_config:
+            code = notify(observer, "flattenControlFlow", code,
+                          self.flatten_control_flow(code, config.flatten_functions, config.flatten_max_blocks,
+                                                    budget, hot_functions))
         if config.shuffle_code_blocks_config:
-            code = self.shuffle_code_blocks(code)
+            code = notify(observer, "shuffleCodeBlock", code, self.shuffle_code_blocks(code))
         #code = self.minify_code(code) # moved to layout obfuscator
         return code
         
+    #  Control-flow flattening
+    @staticmethod
+    def flatten_control_flow(code: str, functions=(), max_blocks: int = DEFAULT_MAX_BLOCKS, budget=None,
+                             hot_functions=None) -> str:
+        # runs after the opaque predicates so that the dispatcher's comparisons are not wrapped in them
+        # the flattener leaves the opaque predicate helpers alone: they run on every guarded branch
+        flattener = ControlFlowFlattener(max_blocks)
+        code = flattener.flatten(code, functions, tuple(hot_functions or ()), budget.allow if budget is not None else None)
+        skipped = ", ".join(f"{name} ({reason})" for name, reason in flattener.skipped.items())
+        print(f"Control-flow flattening: {', '.join(flattener.flattened) or 'no functions'} flattened"
+              + (f"; skipped {skipped}" if skipped else ""))
+        return code
+
 	#  duplicated function in layout obfuscator
     #  Comment remove
     @staticmethod
     def remove_comments(code: str) -> str:
-        result_chars: List[str] = []
-        i = 0
-        n = len(code)
-        while i < n:
-            c = code[i]
-            nxt = code[i + 1] if i + 1 < n else ""
-
-            # Line comment
-            if c == "/" and nxt == "/":
-                i += 2
-                # Skip until end of line
-                while i < n and code[i] not in "\n\r":
-                    i += 1
-                # The newline itself we keep (as a separator)
-                if i < n:
-                    result_chars.append(code[i])
-                    i += 1
-                continue
+        # line breaks after // comments are kept as separators
+        return tokenize(code).strip_comments()
+    
+    @staticmethod
+    def _sub_outside_hot(pattern: str, replacement: str, code: str, hot_functions=None) -> str:
+        """re.sub that leaves matches inside the bodies of hot functions untouched"""
+        if not hot_functions:
+            return re.sub(pattern, replacement, code)
+        tokens = tokenize(code)
+        in_hot = function_body_context(tokens, hot_functions)
 
-            # Block comment
-            if c == "/" and nxt == "*":
-                i += 2
-                while i < n - 1:
-                    if code[i] == "*" and code[i + 1] == "/":
-                        i += 2
-                        break
-                    i += 1
-                continue
+        def _replace(m: re.Match) -> str:
+            return m.group(0) if in_hot(tokens.index_at(m.start())) else m.expand(replacement)
 
-            # Otherwise keep char
-            result_chars.append(c)
-            i += 1
+        return re.sub(pattern, _replace, code)
 
-        return "".join(result_chars)
-    
-    @staticmethod
-    def instruction_insert(code: str) -> str:
+    @classmethod
+    def instruction_insert(cls, code: str, hot_functions=None) -> str:
         # Match variable assignments like: variable = value;
         # - ([\w.]+): Matches variable names (e.g., `variable`, `obj.property`)
         # - \s*=\s*: Matches the equals sign with optional spaces around it
         # - (\b-?\d+\.*\d+\b);: Matches positive or negative integers or decimals
         insertPattern = r'([\w.]+)\s*=\s*(\b-?\d+\.*\d+\b);'
-        code = re.sub(insertPattern, r'\1 = \2 ^ 1 ^ 1;', code)
+        code = cls._sub_outside_hot(insertPattern, r'\1 = \2 ^ 1 ^ 1;', code, hot_functions)
         return code
     
-    @staticmethod
-    def instruction_replace(code: str) -> str:
+    @classmethod
+    def instruction_replace(cls, code: str, hot_functions=None) -> str:
 		# a exclusive_or b ==> (a and not b) or (b and not a)
         replace_pattern = r'([\w.]+)\s*\^\s*([\w.]+)'
-        code = re.sub(replace_pattern, r'(\1 & ~\2) | (\2 & ~\1)', code)
+        code = cls._sub_outside_hot(replace_pattern, r'(\1 & ~\2) | (\2 & ~\1)', code, hot_functions)
         return code
 
     #  Opaque true helper insertion
@@ -100,21 +126,38 @@ class controlflowObfuscation:
     def _has_opaque_true_helper(code: str) -> bool:
         return "function opaqueTrue(" in code
 
-    def insert_opaque_true_helper(self, code: str) -> str:
+    @staticmethod
+    def _if_conditions(tokens) -> List[Tuple[int, int, int]]:
+        """(if index, "(" index, ")" index) of every if statement; "if" in comments or strings is never an IDENTIFIER"""
+        conditions = []
+        for i, kind in enumerate(tokens.kinds):
+            if kind != IDENTIFIER or not tokens.is_identifier(i, "if"):
+                continue
+            open_paren = tokens.next_code(i)
+            if open_paren == -1 or not tokens.is_punct(open_paren, "("):
+                continue
+            close_paren = tokens.match[open_paren]
+            if close_paren != -1:
+                conditions.append((i, open_paren, close_paren))
+        return conditions
+
+    def insert_opaque_true_helper(self, code: str, budget=None, tier: str = DEFAULT_TIER, precompute: bool = False) -> str:
         if self._has_opaque_true_helper(code):
             return code
 
         pattern = re.compile(r"(contract\s+[A-Za-z_]\w*\s*[^{]*\{)", flags=re.MULTILINE)
 
-        helper = """
-    function opaqueTrue() private pure returns (bool) {
-        uint256 x = 123456789;
-        for (uint256 i = 0; i < 7; i++) {
-            x = uint256(keccak256(abi.encodePacked(x, i)));
-        }
-        return ((x % 2 == 0) || (x % 2 == 1));
-    }
-"""
+        predicate = choose_predicate(tier, precomputed=precompute)
+        helper = predicate.render("opaqueTrue")
+        if not predicate.is_pure:
+            # ifs in pure functions, modifiers and constructors call a pure helper of the same tier instead
+            tokens = tokenize(code)
+            pure_only = pure_only_context(tokens)
+            if any(pure_only(i) for i, _, _ in self._if_conditions(tokens)):
+                helper += choose_predicate(tier, pure_only=True).render("opaqueTruePure")
+
+        if budget is not None and not budget.allow(helper):
+            return code
 
         def _insert_helper(m: re.Match) -> str:
             # m.group(1) already includes the "{"
@@ -123,108 +166,68 @@ class controlflowObfuscation:
         new_code, count = pattern.subn(_insert_helper, code, count=1)
         return new_code if count > 0 else code
 
-    def insert_opaque_true_in_if(self, code: str) -> str:
-        if_pattern = re.compile(r"\bif\b", flags=re.MULTILINE)
-
-        result: List[str] = []
-        last_index = 0
-        n = len(code)
-
-        for m in if_pattern.finditer(code):
-            start_if = m.start()
-
-            result.append(code[last_index:start_if])
+    def insert_opaque_true_in_if(self, code: str, budget=None, hot_functions=None) -> str:
+        if budget is not None and not self._has_opaque_true_helper(code):
+            # the helper itself did not fit, so no call to it may be inserted either
+            return code
+        tokens = tokenize(code)
+        edits = EditBuffer(code)
 
-            i = start_if
-            result.append("if")
-            i += 2  
+        pure_only = pure_only_context(tokens) if "function opaqueTruePure(" in code else None
+        in_hot = function_body_context(tokens, hot_functions) if hot_functions else None
 
-            while i < n and code[i].isspace():
-                result.append(code[i])
-                i += 1
-
-            if i >= n or code[i] != "(":
-                result.append(code[start_if + 2:i])
-                last_index = i
+        for i, open_paren, close_paren in self._if_conditions(tokens):
+            if in_hot is not None and in_hot(i):
                 continue
-
-            start_paren = i
-            depth = 0
-            j = i
-            while j < n:
-                if code[j] == "(":
-                    depth += 1
-                elif code[j] == ")":
-                    depth -= 1
-                    if depth == 0:
-                        break
-                j += 1
-
-            if j >= n:
-                result.append(code[start_if:j])
-                last_index = j
+            helper = "opaqueTruePure" if pure_only is not None and pure_only(i) else "opaqueTrue"
+            if budget is not None and not budget.allow(f") && {helper}())"):
                 continue
 
-            condition = code[start_paren + 1: j]
-            new_cond = f"(({condition}) && opaqueTrue())"
+            # (condition) -> (((condition) && opaqueTrue()))
+            edits.insert(tokens.ends[open_paren], "((")
+            edits.insert(tokens.starts[close_paren], f") && {helper}())")
 
-            result.append("(")
-            result.append(new_cond)
-            result.append(")")
-
-            last_index = j + 1
-
-        result.append(code[last_index:])
-        return "".join(result)
+        return edits.apply()
 
     #  Shuffle code blocks 
     @staticmethod
     def _find_matching_brace(text: str, open_index: int) -> int:
         assert text[open_index] == "{"
-        depth = 0
-        n = len(text)
-        for i in range(open_index, n):
-            if text[i] == "{":
-                depth += 1
-            elif text[i] == "}":
-                depth -= 1
-                if depth == 0:
-                    return i
-        raise ValueError("No matching brace found")
+        close_index = tokenize(text).matching_position(open_index)
+        if close_index == -1:
+            raise ValueError("No matching brace found")
+        return close_index
 
     @staticmethod
     def _split_top_level_blocks(body: str) -> List[str]:
+        """Split a contract body into top-level members: "...;" statements and "... { ... }" blocks"""
+        tokens = tokenize(body)
+        kinds = tokens.kinds
         blocks: List[str] = []
         i = 0
-        n = len(body)
+        n = len(tokens)
         while i < n:
             # Skip whitespace
-            while i < n and body[i].isspace():
+            while i < n and kinds[i] == WHITESPACE:
                 i += 1
             if i >= n:
                 break
 
-            start = i
-            brace_depth = 0
-            first_brace_pos = -1
-
+            start = tokens.starts[i]
             while i < n:
-                c = body[i]
-                if c == "{":
-                    brace_depth += 1
-                    if first_brace_pos == -1:
-                        first_brace_pos = i
-                elif c == "}":
-                    brace_depth -= 1
-                    if brace_depth == 0 and first_brace_pos != -1:
+                if kinds[i] == PUNCT:
+                    c = body[tokens.starts[i]]
+                    if c == "{":
+                        # the member ends at the brace matching its first one
+                        close = tokens.match[i]
+                        i = n if close == -1 else close + 1
+                        break
+                    if c == ";":
                         i += 1
                         break
-                elif c == ";" and brace_depth == 0 and first_brace_pos == -1:
-                    i += 1
-                    break
                 i += 1
 
-            end = i
+            end = tokens.starts[i] if i < n else len(body)
             block = body[start:end]
             if block.strip():
                 blocks.append(block)
@@ -232,16 +235,18 @@ class controlflowObfuscation:
         return blocks
 
     def shuffle_code_blocks(self, code: str) -> str:
-        m_contract = re.search(r"\bcontract\b", code)
-        if not m_contract:
+        tokens = tokenize(code)
+        contract_token = tokens.find_identifier("contract")
+        if contract_token == -1:
             return code
 
-        contract_idx = m_contract.start()
+        contract_idx = tokens.starts[contract_token]
 
         header = code[:contract_idx]
-        brace_open = code.find("{", contract_idx)
-        if brace_open == -1:
+        brace_token = tokens.find_punct("{", contract_token)
+        if brace_token == -1:
             return code
+        brace_open = tokens.starts[brace_token]
 
         contract_header = code[contract_idx: brace_open + 1]
         brace_close = self._find_matching_brace(code, brace_open)
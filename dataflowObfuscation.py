@@ -1,8 +1,23 @@
 import random
 import re
 from SplitBoolean import SplitBooleanVariables
-from Local2Global import LocalToGlobalConverter
+from Local2Global import LocalToGlobalConverter, TRANSIENT_MIN_VERSION
 from Ast_generator import *
+from utilities.ast_index import AstIndex
+from utilities.call_profile import function_body_context
+from utilities.edit_buffer import EditBuffer, OffsetMap, compose_offset_maps
+from utilities.lexer import tokenize, IDENTIFIER, NUMBER
+from utilities.observer import notify
+from utilities.pragma import minimum_version, parse_version
+
+# 带单位的字面量 (1 ether, 2 days) 只能是字面量, 不能替换成表达式
+UNIT_SUFFIXES = {"wei", "gwei", "ether", "finney", "szabo", "seconds", "minutes", "hours", "days", "weeks", "years"}
+# 声明里紧挨在变量名前面的词 (类型或数据位置), 用来找出遮蔽状态变量的局部变量和参数
+DECLARATION_TYPE = re.compile(r"u?int\d*|bool|address|string|bytes\d*|memory|storage|calldata|payable")
+# 存储槽的字节数
+SLOT_BYTES = 32
+# 常量池中每个 uint256 字被切成等宽的槽, 常量放进能容纳它的最窄的槽
+POOL_LANE_BITS = (32, 64, 128, 256)
 
 class dataflowConfig:
     scalar_to_struct_config: bool
@@ -10,26 +25,52 @@ class dataflowConfig:
     constants_to_dynamic_arrays_config: bool
     split_boolean_expressions_config: bool
     constants_to_arithmetic_config: bool
+    promote_to_transient_config: bool
+    promote_loop_writes_config: bool
+    boolean_clause_gas_budget: int
+    boolean_clause_function_gas_budget: int
     
-    def __init__(self, _scalar_to_struct, _promote_local_to_global, _constants_to_dynamic_arrays, _split_boolean_expressions, _constants_to_arithmetic):
+    def __init__(self, _scalar_to_struct, _promote_local_to_global, _constants_to_dynamic_arrays, _split_boolean_expressions, _constants_to_arithmetic,
+                 _promote_to_transient=False, _promote_loop_writes=False,
+                 _boolean_clause_gas_budget=None, _boolean_clause_function_gas_budget=None):
         self.scalar_to_struct_config = _scalar_to_struct
         self.promote_local_to_global_config = _promote_local_to_global
         self.constants_to_dynamic_arrays_config = _constants_to_dynamic_arrays
         self.split_boolean_expressions_config = _split_boolean_expressions
         self.constants_to_arithmetic_config = _constants_to_arithmetic
+        # 省 gas 的提升模式: 提升为 transient 变量 (pragma 不支持时退回 storage), 跳过引用类型
+        # 和在循环里被写的变量 (除非 promote_loop_writes)
+        self.promote_to_transient_config = _promote_to_transient
+        self.promote_loop_writes_config = _promote_loop_writes
+        # 拆分布尔表达式时, 每个字面量 / 每个函数在运行时被求值的子句最多花费的 gas (None 表示不限制)
+        self.boolean_clause_gas_budget = _boolean_clause_gas_budget
+        self.boolean_clause_function_gas_budget = _boolean_clause_function_gas_budget
 
 class dataflowObfuscation:
     """
     增强版数据流混淆器
     """
     
-    def __init__(self, code):
+    def __init__(self, code, pragma_statement=""):
         self.code = code
+        # 流水线会先去掉 pragma, 这里只用它判断可用的语言特性
+        self.pragma_statement = pragma_statement
         self.temp_variable_counter = 0
         self.global_variables = set()
         self.struct_counter = 0
+        # 常量池: 字名 -> (槽位宽, {移位: 常量}); constant_mappings: 常量 -> (字名, 移位, 槽位宽)
         self.dynamic_arrays = {}
         self.constant_mappings = {}
+        self._open_pool_words = {}
+        # 最近一次编译得到的 AST, 以及 "该 AST 的源码位置 -> 当前代码位置" 的映射
+        # 映射为 None 表示中间有 pass 无法描述自己的修改, 需要重新编译
+        self.ast_data = None
+        self.ast_index = None
+        self.position_map = None
+        # 文本 pass 用 EditBuffer 修改代码时留下的位置映射
+        self.last_offset_map = None
+        # 热点函数名 (见 utilities.call_profile), 其中的代码不做有运行时开销的变换
+        self.hot_functions = frozenset()
         
     def generate_temp_name(self):
         """生成临时变量名"""
@@ -145,22 +186,86 @@ class dataflowObfuscation:
         
     #     return '\n'.join(result_lines)
 
+    def _compile(self, code):
+        """编译当前代码, 之后的位置映射从这份 AST 开始累积"""
+        self.ast_data = compile_ast(code)
+        self.ast_index = AstIndex(self.ast_data)
+        self.position_map = OffsetMap([])
+
+    def _advance_positions(self, old_code, new_code, offset_map=None):
+        """把一个 pass 的位置映射接到累积映射后面; 没有映射的修改会让旧 AST 失效"""
+        if new_code == old_code:
+            return
+        self.position_map = compose_offset_maps(self.position_map, offset_map) if offset_map is not None else None
+
+    def _run_text_pass(self, method, code):
+        """运行一个基于文本的 pass, 并把它留下的位置映射接到累积映射上"""
+        self.last_offset_map = None
+        new_code = method(code)
+        self._advance_positions(code, new_code, self.last_offset_map)
+        return new_code
+
+    def _rewrite_integer_literals(self, code, replace, edits):
+        """
+        对每个十进制整数字面量只调用一次 replace(value), 返回 None 表示保持原样
+        基于词法分析的 token 流, 一次线性扫描: pragma 语句, 内联汇编, 字符串, 注释,
+        十六进制/小数/科学计数法/带下划线的字面量以及带单位的字面量都会被跳过
+        """
+        tokens = tokenize(code)
+        code_indices = tokens.code_indices()
+        in_pragma = False
+        # 内联汇编 (Yul) 里没有 Solidity 表达式, 跳到汇编块的右花括号
+        assembly_end = -1
+        in_hot = function_body_context(tokens, self.hot_functions) if self.hot_functions else None
+
+        for k, i in enumerate(code_indices):
+            kind = tokens.kinds[i]
+            if in_pragma:
+                in_pragma = not tokens.is_punct(i, ";")
+                continue
+            if i <= assembly_end:
+                continue
+            if kind == IDENTIFIER and tokens.is_identifier(i, "pragma"):
+                in_pragma = True
+                continue
+            if kind == IDENTIFIER and tokens.is_identifier(i, "assembly"):
+                brace = tokens.find_punct("{", i)
+                assembly_end = tokens.match[brace] if brace != -1 else len(tokens.kinds)
+                continue
+            if kind != NUMBER or in_hot is not None and in_hot(i):
+                continue
+
+            text = tokens.token_text(i)
+            if not text.isdigit():
+                continue
+            if k + 1 < len(code_indices):
+                following = code_indices[k + 1]
+                if tokens.kinds[following] == IDENTIFIER and tokens.token_text(following) in UNIT_SUFFIXES:
+                    continue
+
+            replacement = replace(int(text))
+            if replacement is not None:
+                edits.replace(tokens.starts[i], tokens.ends[i], replacement)
+
     # using ast to convert local to global 
-    def promote_local_to_global(self, code):
-        with open("contract.sol", "w", encoding="utf-8") as f:
-            f.write(code)
-        ast = generate_ast_from_file("contract.sol")
-        with open("contract_ast.json", "w") as f:
-            json.dump(ast, f, indent=2)
-        with open("contract.sol", "r", encoding="utf-8") as f:
-            solidity_code = f.read()
-        with open("contract_ast.json", "r",encoding="utf-8") as f:
-            ast_data = json.load(f) 
+    def promote_local_to_global(self, code, gas_aware=False, promote_loop_writes=False):
+        self._compile(code)
+        transient = False
+        if gas_aware:
+            if minimum_version(self.pragma_statement) < TRANSIENT_MIN_VERSION:
+                print("pragma 允许低于 0.8.28 的编译器, 不能使用 transient 变量, 提升为 storage 变量")
+            elif parse_version(get_solc_version()) < TRANSIENT_MIN_VERSION:
+                # solcPath / SOLC_BINARY 指定的编译器可能比 SOLC_VERSION 旧, 后面的 pass 还要用它编译
+                print(f"solc {get_solc_version()} 不支持 transient 变量, 提升为 storage 变量")
+            else:
+                transient = True
     # Initialize converter
-        converter = LocalToGlobalConverter(solidity_code, ast_data)
+        converter = LocalToGlobalConverter(code, self.ast_data, self.ast_index, transient,
+                                           gas_aware and not promote_loop_writes, gas_aware, self.hot_functions)
 
     # Convert local variables to global (80% probability)
         obfuscated_code, global_vars = converter.convert_local_to_global(1)
+        self._advance_positions(code, obfuscated_code, converter.offset_map)
         return obfuscated_code
     
     def create_complex_arithmetic(self, value):
@@ -191,123 +296,109 @@ class dataflowObfuscation:
     
     def constants_to_dynamic_arrays(self, code):
         """
-        将常量替换为动态数组访问，确保函数只添加一次
+        将常量替换为常量池访问，确保常量池和访问函数只添加一次
         """
         # 如果已经添加过动态函数，只进行常量替换
         if hasattr(self, '_dynamic_function_added') and self._dynamic_function_added:
             return self._process_existing_constants(code)
         
         # 第一次调用，进行完整处理
-        def replace_constant(match):
+        def replace_constant(value):
             """
-            替换数字常量为动态数组访问
+            替换数字常量为常量池访问
             """
-            # 检查是否在pragma语句中，避免修改版本号
-            line_up_to_match = code[:match.start()]
-            if 'pragma solidity' in line_up_to_match.split('\n')[-1]:
-                return match.group()
-            
-            value = int(match.group())
-            
-            # 为每个值创建唯一的数组和索引
+            if value.bit_length() > 256:
+                return None
             if value not in self.constant_mappings:
-                array_name = f"dataArray_{len(self.constant_mappings)}"
-                index = random.randint(0, 100)
-                self.constant_mappings[value] = (array_name, index)
-                self.dynamic_arrays[array_name] = value
-            
-            array_name, index = self.constant_mappings[value]
-            return f'getDynamicValue("{array_name}", {index})'
+                self._pool_constant(value)
+            return self._pool_access(value)
         
-        # 替换所有数字常量
-        code = re.sub(r'\b\d+\b', replace_constant, code)
+        # 替换所有数字常量, 所有修改都基于同一份原始代码
+        edits = EditBuffer(code)
+        self._rewrite_integer_literals(code, replace_constant, edits)
         
         # 如果有动态数组需要处理，且是第一次调用，添加函数
         if self.dynamic_arrays and not hasattr(self, '_dynamic_function_added'):
             dynamic_function = self._generate_dynamic_function()
             
-            # 找到合约的最后一个花括号（合约结束位置）
-            # 确保只在合约级别添加一次函数
-            brace_count = 0
-            last_brace_pos = -1
-            in_string = False
-            string_char = None
-            
-            for i, char in enumerate(code):
-                # 处理字符串，避免将字符串内的花括号计入
-                if not in_string and char in ('"', "'"):
-                    in_string = True
-                    string_char = char
-                elif in_string and char == string_char:
-                    in_string = False
-                    string_char = None
-                elif in_string:
-                    continue
-                
-                # 统计花括号
-                if not in_string:
-                    if char == '{':
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                        if brace_count == 0:  # 找到合约结束的花括号
-                            last_brace_pos = i
+            # 找到最后一个顶层花括号（合约结束位置）, 字符串和注释里的花括号不会被计入
+            tokens = tokenize(code)
+            blocks = tokens.top_level_blocks()
             
             # 在合约结束前插入函数（只在合约级别添加一次）
-            if last_brace_pos != -1:
-                code = code[:last_brace_pos] + dynamic_function + '\n' + code[last_brace_pos:]
+            if blocks:
+                edits.insert(tokens.starts[blocks[-1][1]], dynamic_function + '\n')
             
             # 设置标志位，标记函数已添加
             self._dynamic_function_added = True
         
-        return code
+        self.last_offset_map = edits.offset_map()
+        return edits.apply()
 
     def _process_existing_constants(self, code):
         """
         只处理常量替换，不添加函数（用于后续调用）
         """
-        def replace_constant(match):
+        def replace_constant(value):
             """
             替换已映射的常量，新常量保持原样
             """
-            # 检查是否在pragma语句中
-            line_up_to_match = code[:match.start()]
-            if 'pragma solidity' in line_up_to_match.split('\n')[-1]:
-                return match.group()
-            
-            value = int(match.group())
-            
             # 只替换已经映射过的常量
             if value in self.constant_mappings:
-                array_name, index = self.constant_mappings[value]
-                return f'getDynamicValue("{array_name}", {index})'
+                return self._pool_access(value)
             
             # 新出现的常量保持原样
-            return match.group()
+            return None
         
-        return re.sub(r'\b\d+\b', replace_constant, code)
+        edits = EditBuffer(code)
+        self._rewrite_integer_literals(code, replace_constant, edits)
+        self.last_offset_map = edits.offset_map()
+        return edits.apply()
+
+    def _pool_constant(self, value):
+        """
+        把常量放进常量池: 同一位宽的常量共用一个字, 字满了才开新字, 字内的槽随机选
+        """
+        bits = next(b for b in POOL_LANE_BITS if value.bit_length() <= b)
+        word = self._open_pool_words.get(bits)
+        if word is None or len(self.dynamic_arrays[word][1]) == 256 // bits:
+            word = f"dataPool_{len(self.dynamic_arrays)}"
+            self.dynamic_arrays[word] = (bits, {})
+            self._open_pool_words[bits] = word
+        lanes = self.dynamic_arrays[word][1]
+        shift = random.choice([shift for shift in range(0, 256, bits) if shift not in lanes])
+        lanes[shift] = value
+        self.constant_mappings[value] = (word, shift, bits)
+
+    def _pool_access(self, value):
+        word, shift, bits = self.constant_mappings[value]
+        return f'getDynamicValue({word}, {shift}, {bits})'
 
     def _generate_dynamic_function(self):
         """
-        生成动态数组访问函数（优化版本）
+        生成常量池和访问函数
+        每个字是编译期常量 (PUSH32 嵌在代码里), 调用处直接给出字名, 移位和位宽,
+        所以一次访问只有异或, 移位和掩码, 没有 SLOAD 和哈希
+        开销与常量池大小无关是按操作码估计的, 实测用 python -m utilities.gas_harness --constant-pool-benchmark
         """
         if not self.dynamic_arrays:
             return ""
         
-        # 构建函数基础结构
-        dynamic_function = '''
-        function getDynamicValue(string memory arrayName, uint index) private pure returns (uint) {
-            bytes32 arrayHash = keccak256(abi.encodePacked(arrayName));'''
-        
-        # 添加条件判断
-        conditions = []
-        for i, (name, value) in enumerate(self.dynamic_arrays.items()):
-            condition = f'    if (arrayHash == keccak256(abi.encodePacked("{name}"))) return {value};'
-            conditions.append(condition)
-        
-        # 合并所有条件
-        dynamic_function += '\n' + '\n'.join(conditions)
-        dynamic_function += '\n    return 0;\n}'
+        # 所有字都和同一个随机密钥异或, 空槽填随机数, 读代码的人看不出常量
+        key = random.getrandbits(256)
+        lines = [f'\n    uint256 private constant dataPoolKey = 0x{key:064x};']
+        for name, (bits, lanes) in self.dynamic_arrays.items():
+            word = 0
+            for shift in range(0, 256, bits):
+                word |= lanes.get(shift, random.getrandbits(bits)) << shift
+            lines.append(f'    uint256 private constant {name} = 0x{word ^ key:064x};')
+        
+        dynamic_function = '\n'.join(lines)
+        dynamic_function += '''
+
+    function getDynamicValue(uint256 word, uint256 shift, uint256 bits) private pure returns (uint256) {
+        return ((word ^ dataPoolKey) >> shift) & (type(uint256).max >> (256 - bits));
+    }'''
         
         return dynamic_function
     
@@ -489,93 +580,196 @@ class dataflowObfuscation:
         
     #     return code
 
-    def split_boolean_expressions(self, code):
-        with open("contract_b.sol", "w", encoding="utf-8") as f:
-            f.write(code)
-        ast = generate_ast_from_file("contract_b.sol")
-        with open("contract_b_ast.json", "w") as f:
-            json.dump(ast, f, indent=2)
-        with open("contract_b.sol", "r", encoding="utf-8") as f:
-            solidity_code = f.read()
-
-    # 读取 AST 文件（假设已经生成）
-        with open("contract_b_ast.json", "r", encoding="utf-8") as f:
-            ast_data = json.load(f)
-
-    # 创建分割器实例
-        splitter = SplitBooleanVariables(solidity_code, ast_data)
+    def split_boolean_expressions(self, code, gas_budget=None, function_gas_budget=None):
+    # 之前的 pass 都给出了位置映射时, 直接沿用旧的 AST, 否则重新编译
+        splitter = None
+        if self.position_map is not None:
+            splitter = SplitBooleanVariables(code, self.ast_data, self.ast_index, self.position_map,
+                                             gas_budget, function_gas_budget, self.hot_functions)
+            if not splitter.positions_valid():
+                splitter = None
+        if splitter is None:
+            self._compile(code)
+            splitter = SplitBooleanVariables(code, self.ast_data, self.ast_index,
+                                             gas_budget=gas_budget, function_gas_budget=function_gas_budget,
+                                             hot_functions=self.hot_functions)
 
     # 应用布尔变量分割
         obfuscated_code = splitter.apply_boolean_splitting(probability=1)
+        self._advance_positions(code, obfuscated_code, splitter.offset_map)
         return obfuscated_code
     
+    @staticmethod
+    def _type_bytes(var_type):
+        """值类型占用的字节数; string 和未标宽度的 uint/int 占满一个槽"""
+        if var_type == "bool":
+            return 1
+        if var_type == "address":
+            return 20
+        bits = re.fullmatch(r'u?int(\d+)', var_type)
+        return int(bits.group(1)) // 8 if bits else SLOT_BYTES
+
+    @classmethod
+    def _count_slots(cls, fields):
+        """按 Solidity 的规则依次放置字段 (放不下当前槽就开新槽), 返回占用的槽数"""
+        slots = 0
+        used = SLOT_BYTES
+        for var_type, _ in fields:
+            size = cls._type_bytes(var_type)
+            if used + size > SLOT_BYTES:
+                slots += 1
+                used = size
+            else:
+                used += size
+        return slots
+
+    @classmethod
+    def _pack_struct_fields(cls, fields):
+        """
+        首次适应递减 (first-fit decreasing) 把字段装进 32 字节的槽, 再随机打乱槽的顺序和槽内字段的顺序,
+        布局看起来是随机的, 槽数却不会比源码顺序多
+        """
+        fields = list(fields)
+        # 打乱的是副本, 下面的比较和回退都针对源码顺序
+        shuffled = random.sample(fields, len(fields))
+        bins = []
+        for field in sorted(shuffled, key=lambda field: cls._type_bytes(field[0]), reverse=True):
+            size = cls._type_bytes(field[0])
+            for packed in bins:
+                if packed[0] + size <= SLOT_BYTES:
+                    packed[0] += size
+                    packed[1].append(field)
+                    break
+            else:
+                bins.append([size, [field]])
+        
+        random.shuffle(bins)
+        packed_fields = []
+        for _, members in bins:
+            random.shuffle(members)
+            packed_fields.extend(members)
+        
+        if cls._count_slots(packed_fields) > cls._count_slots(fields):
+            return fields
+        return packed_fields
+
     def scalar_to_struct(self, code):
         """
         将标量变量封装为结构体
+        只处理第一个合约里的状态变量 (花括号深度为 1 的声明), 一次扫描完成所有替换
         """
+        tokens = tokenize(code)
+        blocks = tokens.top_level_blocks()
+        if not blocks:
+            return code
+        contract_open, contract_close = blocks[0]
+        depths = tokens.brace_depths()
+        
         # 识别状态变量
-        state_var_pattern = r'(\b(uint|int|bool|address|string)\d*\s+)(public|private|internal)?\s*(\w+)\s*;'
-        matches = list(re.finditer(state_var_pattern, code))
+        state_var_pattern = re.compile(r'(\b(uint|int|bool|address|string)\d*\s+)(public|private|internal)?\s*(\w+)\s*;')
+        matches = []
+        declaration_tokens = set()
+        for match in state_var_pattern.finditer(code, tokens.ends[contract_open], tokens.starts[contract_close]):
+            type_token = tokens.index_at(match.start())
+            name_token = tokens.index_at(match.start(4))
+            # 跳过注释/字符串里的匹配以及函数内的局部变量
+            if tokens.kinds[type_token] != IDENTIFIER or depths[type_token] != 1:
+                continue
+            matches.append(match)
+            declaration_tokens.add(name_token)
+        
+        # 被局部变量或参数遮蔽的状态变量保持原样, 否则局部声明会变成 "uint256 dataStruct.x"
+        shadowed = set()
+        code_indices = tokens.code_indices()
+        for previous, i in zip(code_indices, code_indices[1:]):
+            if contract_open < i < contract_close and tokens.kinds[i] == IDENTIFIER and i not in declaration_tokens \
+                    and tokens.kinds[previous] == IDENTIFIER and DECLARATION_TYPE.fullmatch(tokens.token_text(previous)):
+                shadowed.add(tokens.token_text(i))
+        matches = [match for match in matches if match.group(4) not in shadowed]
+        declaration_tokens = {tokens.index_at(match.start(4)) for match in matches}
         
         if not matches:
             return code
         
-        # 创建结构体
+        # 创建结构体, 字段顺序按存储槽打包
         struct_name = self.generate_struct_name()
         struct_declaration = f"    struct {struct_name} {{\n"
         
-        for match in matches:
-            var_type = match.group(1).strip()
-            var_name = match.group(4)
+        fields = [(match.group(1).strip(), match.group(4)) for match in matches]
+        packed_fields = self._pack_struct_fields(fields)
+        print(f"{struct_name} 存储槽: {self._count_slots(fields)} -> {self._count_slots(packed_fields)}")
+        for var_type, var_name in packed_fields:
             struct_declaration += f"        {var_type} {var_name};\n"
         
         struct_declaration += "    }\n"
         struct_declaration += f"    {struct_name} private dataStruct;\n"
         
-        # 替换变量访问
-        for match in matches:
-            var_name = match.group(4)
-            code = code.replace(f" {var_name};", f" _deprecated_{var_name};")  # 注释原变量
-            code = re.sub(r'\b' + var_name + r'\b', f"dataStruct.{var_name}", code)
+        # 替换变量访问: 原声明改名为 _deprecated_x, 其余使用改为 dataStruct.x (成员访问 a.x 不变)
+        var_names = {match.group(4) for match in matches}
+        edits = EditBuffer(code)
+        previous_code_token = -1
+        for i in range(contract_open + 1, contract_close):
+            if not tokens.is_code(i):
+                continue
+            if tokens.kinds[i] == IDENTIFIER:
+                name = tokens.token_text(i)
+                if name in var_names:
+                    if i in declaration_tokens:
+                        edits.replace(tokens.starts[i], tokens.ends[i], f"_deprecated_{name}")
+                    elif previous_code_token == -1 or not tokens.is_punct(previous_code_token, "."):
+                        edits.replace(tokens.starts[i], tokens.ends[i], f"dataStruct.{name}")
+            previous_code_token = i
         
         # 插入结构体声明
-        contract_start = code.find('{')
-        if contract_start != -1:
-            code = code[:contract_start+1] + '\n' + struct_declaration + code[contract_start+1:]
+        edits.insert(tokens.ends[contract_open], '\n' + struct_declaration)
         
+        self.last_offset_map = edits.offset_map()
+        return edits.apply()
+
+    def _observe(self, observer, step, before, after):
+        """通知 observer; 如果它改写了结果 (例如否决这一步), 旧的 AST 位置映射就不再可靠"""
+        code = notify(observer, step, before, after)
+        if code != after:
+            self.position_map = None
         return code
-    
-    def obfuscate(self, config: dataflowConfig):
+
+    def obfuscate(self, config: dataflowConfig, observer=None, hot_functions=None):
         """
         应用所有混淆技术
+        observer(step, before, after) 在每个启用的子步骤之后被调用, 可以返回替换后的代码
+        hot_functions: 热点函数名, 提升局部变量, 常量替换和布尔分割都会跳过这些函数
         """
         print("开始数据流混淆...")
         code = self.code
+        self.hot_functions = frozenset(hot_functions or ())
         
         # 1. 局部变量提升为全局变量
         if config.promote_local_to_global_config:
             print("提升局部变量为全局变量...")
-            code = self.promote_local_to_global(code)
+            code = self._observe(observer, "promoteLocalToGlobal", code,
+                                 self.promote_local_to_global(code, config.promote_to_transient_config,
+                                                              config.promote_loop_writes_config))
 
         # 2. 标量变量转为结构体
         if config.scalar_to_struct_config:
             print("将标量变量转为结构体...")
-            code = self.scalar_to_struct(code)
+            code = self._observe(observer, "scalarToStruct", code, self._run_text_pass(self.scalar_to_struct, code))
         
         # 3. 常量转换为动态数据
         if config.constants_to_dynamic_arrays_config:
             print("将常量转为动态数据...")
-            code = self.constants_to_dynamic_arrays(code)
+            code = self._observe(observer, "constantsToDynamicArrays", code, self._run_text_pass(self.constants_to_dynamic_arrays, code))
         
         # 4. 拆分布尔表达式
         if config.split_boolean_expressions_config:
             print("拆分布尔表达式...")
-            code = self.split_boolean_expressions(code)
+            code = self._observe(observer, "splitBooleanExpressions", code, self.split_boolean_expressions(
+                code, config.boolean_clause_gas_budget, config.boolean_clause_function_gas_budget))
         
         # 5. 常量转换为算术表达式（原有的）
         if config.constants_to_arithmetic_config:
             print("常量转换为算术表达式...")
-            code = self.constants_to_arithmetic(code)
+            code = self._observe(observer, "constantsToArithmetic", code, self._run_text_pass(self.constants_to_arithmetic, code))
         
         print("数据流混淆完成!")
         return code
@@ -584,14 +778,12 @@ class dataflowObfuscation:
         """
         将常量转换为复杂算术表达式
         """
-        def replace_with_arithmetic(match):
-            line_up_to_match = code[:match.start()]
-            if 'pragma solidity' in line_up_to_match.split('\n')[-1]:
-                return match.group()
-            
-            value = int(match.group())
+        def replace_with_arithmetic(value):
             if abs(value) < 100:  # 只处理较小的数值
                 return self.create_complex_arithmetic(value)
-            return match.group()
+            return None
         
-        return re.sub(r'\b\d+\b', replace_with_arithmetic, code)
+        edits = EditBuffer(code)
+        self._rewrite_integer_literals(code, replace_with_arithmetic, edits)
+        self.last_offset_map = edits.offset_map()
+        return edits.apply()
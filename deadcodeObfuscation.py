@@ -1,15 +1,32 @@
 import re
 import random
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+from utilities.lexer import tokenize, IDENTIFIER, PUNCT
+from utilities.observer import notify
+from utilities.opaque_predicates import is_predicate_helper, pure_only_context
+from utilities.size_budget import DEFAULT_BYTES_PER_TOKEN, code_weight
+
+# shared dead routines emitted once per contract in outlining mode
+DEFAULT_DEAD_ROUTINES = 3
 
 
 class deadcodeConfig:
     insert_deadcode_helper_config: bool
     insert_bogus_blocks_config: bool
+    precompute_opaque_predicates: bool
+    outline_deadcode_config: bool
+    dead_routines: int
 
-    def __init__(self, insert_helper: bool = True, insert_blocks: bool = True):
+    def __init__(self, insert_helper: bool = True, insert_blocks: bool = True, precompute: bool = False,
+                 outline: bool = False, dead_routines: int = DEFAULT_DEAD_ROUTINES):
         self.insert_deadcode_helper_config = insert_helper
         self.insert_bogus_blocks_config = insert_blocks
+        # evaluate the hash chain of __dcOpaqueFalse() once at deploy time into an immutable
+        self.precompute_opaque_predicates = precompute
+        # guarded calls to a few shared __dcRoutine functions instead of a dead loop pasted into every function
+        self.outline_deadcode_config = outline
+        self.dead_routines = dead_routines
 
 
 class deadcodeObfuscation:
@@ -17,7 +34,10 @@ class deadcodeObfuscation:
     def __init__(self, solContent: str):
         self.solContent = solContent
 
-    def run(self, config: Optional[deadcodeConfig] = None) -> str:
+    def run(self, config: Optional[deadcodeConfig] = None, observer=None, budget=None, hot_functions=None) -> str:
+        # observer(step, before, after) is told about every enabled step and may return replacement code
+        # budget (utilities.size_budget.SizeBudget) thins out bogus blocks near the size limit
+        # hot_functions (names, see utilities.call_profile) get no bogus block, cold functions get more
         code = self.solContent
 
         # default config if none
@@ -25,19 +45,24 @@ class deadcodeObfuscation:
             config = deadcodeConfig(True, True)
 
         if config.insert_deadcode_helper_config:
-            code = self._insert_deadcode_helper(code)
+            code = notify(observer, "insertDeadcodeHelper", code,
+                          self._insert_deadcode_helper(code, budget, config.precompute_opaque_predicates))
 
         if config.insert_bogus_blocks_config:
-            code = self._insert_bogus_blocks_into_functions(code)
+            routines = config.dead_routines if config.outline_deadcode_config else 0
+            code = notify(observer, "insertBogusBlocks", code,
+                          self._insert_bogus_blocks_into_functions(code, budget, hot_functions, routines))
 
         return code
 
 
     @staticmethod
     def _find_first_contract_index(code: str) -> int:
-        return code.find("contract ")
+        tokens = tokenize(code)
+        contract_token = tokens.find_identifier("contract")
+        return tokens.starts[contract_token] if contract_token != -1 else -1
 
-    def _insert_deadcode_helper(self, code: str) -> str:
+    def _insert_deadcode_helper(self, code: str, budget=None, precompute: bool = False) -> str:
         if "function __dcOpaqueFalse()" in code:
             return code
 
@@ -45,9 +70,11 @@ class deadcodeObfuscation:
         if contract_idx == -1:
             return code
 
-        brace_open = code.find("{", contract_idx)
-        if brace_open == -1:
+        tokens = tokenize(code)
+        brace_token = tokens.find_punct("{", tokens.index_at(contract_idx))
+        if brace_token == -1:
             return code
+        brace_open = tokens.starts[brace_token]
 
 #         helper = """
 #     function __dcOpaqueFalse() private pure returns (bool) {
@@ -71,45 +98,126 @@ class deadcodeObfuscation:
         return (evenCheck == 0 && oddCheck == 1);
     }
 """
+        if precompute:
+            helper = self._precomputed_helper(code)
+        if budget is not None and not budget.allow(helper):
+            return code
 
         return code[: brace_open + 1] + helper + code[brace_open + 1 :]
 
     @staticmethod
-    def _function_matches(code: str) -> List[re.Match]:
-        pattern = re.compile(
-            r"""
-            \b(
-                function\s+([A-Za-z_][A-Za-z0-9_]*) |   
-                constructor\s* |                        
-                fallback\s*\( |                       
-                receive\s*\(                           
-            )
-            [^{;]*                                    
-            \{                                          
-            """,
-            re.VERBOSE,
-        )
-        return list(pattern.finditer(code))
+    def _precomputed_helper(code: str) -> str:
+        """
+        __dcOpaqueFalse() comparing against an immutable that holds the hash chain, evaluated once
+        at deploy time. Bodies that may not read immutables call the original as __dcOpaqueFalsePure().
+        """
+        helper = """
+    uint256 private immutable __dcOpaqueFalseAcc = __dcOpaqueFalseChain();
+
+    function __dcOpaqueFalseChain() private pure returns (uint256 acc) {
+        uint256 seed = 0x12345678;
+        for (uint256 i = 0; i < 5; i++) {
+            seed = uint256(keccak256(abi.encodePacked(seed, i)));
+            acc ^= (seed & ((1 << (i + 1)) - 1));
+        }
+    }
+
+    function __dcOpaqueFalse() private view returns (bool) {
+        return (__dcOpaqueFalseAcc % 2 == 0 && __dcOpaqueFalseAcc % 2 == 1);
+    }
+"""
+        tokens = tokenize(code)
+        pure_only = pure_only_context(tokens)
+        if any(pure_only(tokens.index_at(brace_pos)) for _, brace_pos in deadcodeObfuscation._function_matches(code)):
+            helper += """
+    function __dcOpaqueFalsePure() private pure returns (bool) {
+        uint256 seed = 0x12345678;
+        uint256 acc = 0;
+
+        for (uint256 i = 0; i < 5; i++) {
+            seed = uint256(keccak256(abi.encodePacked(seed, i)));
+            acc ^= (seed & ((1 << (i + 1)) - 1));
+        }
+
+        return (acc % 2 == 0 && acc % 2 == 1);
+    }
+"""
+        return helper
+
+    @staticmethod
+    def _function_matches(code: str) -> List[Tuple[Optional[str], int]]:
+        """
+        (function name or None, position of the body's "{") for every function,
+        constructor, fallback and receive that has a body
+        """
+        tokens = tokenize(code)
+        code_indices = tokens.code_indices()
+        matches: List[Tuple[Optional[str], int]] = []
+
+        for k, i in enumerate(code_indices):
+            if tokens.kinds[i] != IDENTIFIER:
+                continue
+            word = tokens.token_text(i)
+            following = code_indices[k + 1] if k + 1 < len(code_indices) else -1
+
+            if word == "function":
+                if following == -1 or tokens.kinds[following] != IDENTIFIER:
+                    continue   # function types such as "function (uint) external"
+                func_name = tokens.token_text(following)
+            elif word == "constructor":
+                func_name = None
+            elif word in ("fallback", "receive"):
+                if following == -1 or not tokens.is_punct(following, "("):
+                    continue
+                func_name = None
+            else:
+                continue
 
-    def _insert_bogus_blocks_into_functions(self, code: str) -> str:
+            # the header runs up to the body's "{", or to ";" for a declaration without body
+            for m in range(k + 1, len(code_indices)):
+                j = code_indices[m]
+                if tokens.kinds[j] == PUNCT and code[tokens.starts[j]] in "{;":
+                    if code[tokens.starts[j]] == "{":
+                        matches.append((func_name, tokens.starts[j]))
+                    break
+
+        return matches
+
+    def _insert_bogus_blocks_into_functions(self, code: str, budget=None, hot_functions=None, routines: int = 0) -> str:
+        """
+        Guard a dead block with the opaque helper at the top of randomly chosen function bodies.
+        With routines > 0 the blocks are outlined: that many shared __dcRoutine functions are
+        emitted once and every chosen body gets a guarded call to one of them instead, unless
+        the routines plus the calls are estimated to be no smaller than the inline blocks.
+        """
+        if budget is not None and "function __dcOpaqueFalse()" not in code:
+            # the helper did not fit the size budget, blocks calling it would not compile
+            return code
         matches = self._function_matches(code)
         if not matches:
             return code
 
+        pure_only = None
+        if "function __dcOpaqueFalsePure()" in code:
+            tokens = tokenize(code)
+            pure_only = pure_only_context(tokens)
+
         # Choose a global probability p between 0.4 and 0.6
         p = random.uniform(0.4, 0.6)
-
-        parts: List[str] = []
-        last_index = 0
-
-        for m in matches:
-            brace_pos = code.find("{", m.start())
-            if brace_pos == -1:
+        if hot_functions:
+            # the blocks hot functions would have received are spread over the cold ones
+            candidates = [name for name, _ in matches if not self._is_generated(name)]
+            cold = [name for name in candidates if name not in hot_functions]
+            p = min(1.0, p * len(candidates) / len(cold)) if cold else 0.0
+
+        # (body "{" position, indentation, variant, helper) of every chosen function
+        sites = []
+        for func_name, brace_pos in matches:
+            # the helpers and the routines themselves, and the opaque predicate helpers of the
+            # controlflow pass: every guarded if calls them, a dead block there would run each time
+            if self._is_generated(func_name):
                 continue
-
-            func_name = m.group(2) if len(m.groups()) >= 2 else None
-
-            if func_name and func_name.startswith("__dcOpaqueFalse"):
+            if hot_functions and func_name in hot_functions:
                 continue
 
             # randomize
@@ -128,19 +236,146 @@ class deadcodeObfuscation:
             base_indent = leading_ws_match.group(0) if leading_ws_match else ""
             body_indent = base_indent + "    "
 
-            variant = random.randint(0, 2)
-            injection = self._build_dead_block(body_indent, variant=variant)
+            helper = "__dcOpaqueFalse"
+            if pure_only is not None and pure_only(tokens.index_at(brace_pos)):
+                helper = "__dcOpaqueFalsePure"
+            sites.append((brace_pos, body_indent, random.randint(0, 2), helper))
+
+        blocks = [self._build_dead_block(body_indent, variant=variant, helper=helper)
+                  for _, body_indent, variant, helper in sites]
+        injections = blocks
+        routine_names: List[str] = []
+        routine_text = ""
+        if routines and sites:
+            routine_names = [f"__dcRoutine{k}" for k in range(min(routines, len(sites)))]
+            routine_text = "".join(self._build_dead_routine(name, k % 3) for k, name in enumerate(routine_names))
+            calls = [self._build_dead_call(body_indent, random.choice(routine_names), helper)
+                     for _, body_indent, _, helper in sites]
+            inline_weight = sum(code_weight(block, cached=False) for block in blocks)
+            outlined_weight = code_weight(routine_text, cached=False) + sum(code_weight(call, cached=False) for call in calls)
+            if outlined_weight >= inline_weight:
+                # too few call sites to pay for the routines, the inline blocks are smaller
+                print(f"Dead code outlining: {len(sites)} call sites do not pay for {len(routine_names)} routines "
+                      f"(estimate), inlining the blocks")
+                routine_names = []
+            elif budget is not None and not budget.allow(routine_text):
+                # the routines do not fit the size budget, the inline blocks still may
+                print(f"Dead code outlining: {len(routine_names)} routines do not fit the size budget, "
+                      f"inlining the blocks")
+                routine_names = []
+            else:
+                injections = calls
+
+        parts: List[str] = []
+        last_index = 0
+        injected = inline_weight = outlined_weight = 0
+
+        for (brace_pos, _, _, _), block, injection in zip(sites, blocks, injections):
+            if budget is not None and not budget.allow(injection):
+                continue
+            if routine_names:
+                inline_weight += code_weight(block, cached=False)
+                outlined_weight += code_weight(injection, cached=False)
 
             parts.append(code[last_index : brace_pos + 1])
             parts.append(injection)
             last_index = brace_pos + 1
+            injected += 1
 
         # Append remaining tail
         parts.append(code[last_index:])
-        return "".join(parts)
+        code = "".join(parts)
+
+        if routine_names and not injected and budget is not None:
+            # no call site fit, the routines reserved above are not inserted either
+            budget.release(routine_text)
+        if routine_names and injected:
+            code = self._insert_after_first_contract_brace(code, routine_text)
+            outlined_weight += code_weight(routine_text, cached=False)
+            bytes_per_token = budget.bytes_per_token if budget is not None else DEFAULT_BYTES_PER_TOKEN
+            saved = (inline_weight - outlined_weight) * bytes_per_token
+            print(f"Dead code outlining: {injected} call sites share {len(routine_names)} routines, "
+                  f"about {abs(saved):.0f} runtime bytes {'smaller' if saved >= 0 else 'larger'} "
+                  f"than inline blocks (estimate)")
+        return code
+
+    @staticmethod
+    def _is_generated(name: Optional[str]) -> bool:
+        return bool(name) and (name.startswith("__dc") or is_predicate_helper(name))
+
+    def _insert_after_first_contract_brace(self, code: str, text: str) -> str:
+        contract_idx = self._find_first_contract_index(code)
+        if contract_idx == -1:
+            return code
+        tokens = tokenize(code)
+        brace_token = tokens.find_punct("{", tokens.index_at(contract_idx))
+        if brace_token == -1:
+            return code
+        brace_open = tokens.starts[brace_token]
+        return code[: brace_open + 1] + text + code[brace_open + 1 :]
+
+    @staticmethod
+    def _build_dead_call(body_indent: str, routine: str, helper: str = "__dcOpaqueFalse") -> str:
+        """Guarded call to a shared dead routine, with arguments of its own so no two call sites look alike"""
+        return (
+            f"\n{body_indent}if ({helper}()) {{\n"
+            f"{body_indent}    {routine}({random.randint(1, 0xFFFF)}, {random.randint(2, 9)});\n"
+            f"{body_indent}}}\n"
+        )
+
+    @staticmethod
+    def _build_dead_routine(name: str, variant: int = 0) -> str:
+        """
+        Private pure routine with the shape of one of the inline variants, seeded and bounded by
+        its arguments; the constants are drawn per routine so every contract gets different ones
+        """
+        k1, k2, k3 = (hex(random.randint(0x1000, 0xFFFF)) for _ in range(3))
+        m = random.randint(3, 31)
+        if variant == 0:
+            body = (
+                f"        uint256 __dc_dummy = __dc_seed;\n"
+                f"        for (uint256 __dc_i = 0; __dc_i < __dc_rounds; __dc_i++) {{\n"
+                f"            __dc_dummy ^= (__dc_i * {m} + {random.randint(1, 9)});\n"
+                f"            if ((__dc_dummy & 1) == 0) {{\n"
+                f"                __dc_dummy = (__dc_dummy >> 1) ^ {k1};\n"
+                f"            }} else {{\n"
+                f"                __dc_dummy = (__dc_dummy << 1) ^ {k2};\n"
+                f"            }}\n"
+                f"        }}\n"
+                f"        require(__dc_dummy != {k3}, \"dc_a\");\n"
+            )
+        elif variant == 1:
+            body = (
+                f"        uint256 __dc_acc = __dc_seed;\n"
+                f"        for (uint256 __dc_i = 0; __dc_i < __dc_rounds; __dc_i++) {{\n"
+                f"            __dc_acc = (__dc_acc * {m} + __dc_i) % {k3};\n"
+                f"            if ((__dc_acc & 3) == 1) {{\n"
+                f"                __dc_acc ^= {k1};\n"
+                f"            }} else {{\n"
+                f"                __dc_acc ^= {k2};\n"
+                f"            }}\n"
+                f"        }}\n"
+                f"        require(__dc_acc != 0xDEADBEEF, \"dc_b\");\n"
+            )
+        else:
+            body = (
+                f"        uint256 __dc_x = __dc_seed;\n"
+                f"        uint256 __dc_y = 1;\n"
+                f"        for (uint256 __dc_k = 0; __dc_k < __dc_rounds; __dc_k++) {{\n"
+                f"            __dc_x = (__dc_x + __dc_y) ^ (__dc_k * {m});\n"
+                f"            __dc_y = (__dc_y * 5 % {k3}) ^ (__dc_x >> 1);\n"
+                f"            if ((__dc_x & 7) == 3) {{\n"
+                f"                __dc_y ^= {k1};\n"
+                f"            }}\n"
+                f"        }}\n"
+                f"        if (__dc_x == {k2}) {{\n"
+                f"            revert(\"dc_c\");\n"
+                f"        }}\n"
+            )
+        return f"\n    function {name}(uint256 __dc_seed, uint256 __dc_rounds) private pure {{\n{body}    }}\n"
 
     @staticmethod
-    def _build_dead_block(body_indent: str, variant: int = 0) -> str:
+    def _build_dead_block(body_indent: str, variant: int = 0, helper: str = "__dcOpaqueFalse") -> str:
         bi = body_indent
         bi2 = body_indent + "    "
         bi3 = body_indent + "        "
@@ -148,7 +383,7 @@ class deadcodeObfuscation:
         if variant == 0:
             # Variant A
             return (
-                f"\n{bi}if (__dcOpaqueFalse()) {{\n"
+                f"\n{bi}if ({helper}()) {{\n"
                 f"{bi2}uint256 __dc_dummy = 0;\n"
                 f"{bi2}for (uint256 __dc_i = 0; __dc_i < 5; __dc_i++) {{\n"
                 f"{bi3}__dc_dummy ^= (__dc_i * 7 + 3);\n"
@@ -165,7 +400,7 @@ class deadcodeObfuscation:
         if variant == 1:
             # Variant B
             return (
-                f"\n{bi}if (__dcOpaqueFalse()) {{\n"
+                f"\n{bi}if ({helper}()) {{\n"
                 f"{bi2}uint256 __dc_acc = 1;\n"
                 f"{bi2}for (uint256 __dc_i = 0; __dc_i < 3; __dc_i++) {{\n"
                 f"{bi3}for (uint256 __dc_j = 0; __dc_j < 2; __dc_j++) {{\n"
@@ -185,7 +420,7 @@ class deadcodeObfuscation:
 
         # Variant C
         return (
-            f"\n{bi}if (__dcOpaqueFalse()) {{\n"
+            f"\n{bi}if ({helper}()) {{\n"
             f"{bi2}uint256 __dc_x = 0;\n"
             f"{bi2}uint256 __dc_y = 1;\n"
             f"{bi2}for (uint256 __dc_k = 0; __dc_k < 4; __dc_k++) {{\n"
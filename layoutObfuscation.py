@@ -3,6 +3,15 @@ import random
 import string
 from typing import List
 
+from utilities.lexer import tokenize, COMMENT, IDENTIFIER, WHITESPACE
+from utilities.observer import notify
+from utilities.selector_mining import (DEFAULT_MINING_WORKERS, DEFAULT_ZERO_BYTES, SelectorMiner, external_signatures,
+                                       public_signatures, selector)
+
+# words the collect_* patterns can take for a name, e.g. "memory" in "returns (string memory)"
+KEYWORDS = {"memory", "storage", "calldata", "transient", "payable", "indexed", "public", "private", "internal",
+            "external", "constant", "immutable", "override", "virtual", "pure", "view", "returns", "anonymous"}
+
 def generate_random_name(length=0):
     if length == 0:
         length = random.randrange(8, 16)
@@ -15,14 +24,24 @@ class layoutConfig:
     obfuscate_vectors_config: bool
     obfuscate_functions_config: bool
     minify_code_config: bool
+    mine_selectors_config: bool
+    selector_zero_bytes: int
+    selector_mining_workers: int
     
-    def __init__(self, _remove_comments, _obfuscate_variables, _obfuscate_mappings, _obfuscate_vectors, _obfuscate_functions, _minify_code):
+    def __init__(self, _remove_comments, _obfuscate_variables, _obfuscate_mappings, _obfuscate_vectors, _obfuscate_functions, _minify_code,
+                 _mine_selectors=False, _selector_zero_bytes=DEFAULT_ZERO_BYTES,
+                 _selector_mining_workers=DEFAULT_MINING_WORKERS):
         self.remove_comments_config = _remove_comments
         self.obfuscate_variables_config = _obfuscate_variables
         self.obfuscate_mappings_config = _obfuscate_mappings
         self.obfuscate_vectors_config = _obfuscate_vectors
         self.obfuscate_functions_config = _obfuscate_functions
         self.minify_code_config = _minify_code
+        # rename public / external functions to names with cheap selectors, hot functions dispatched first
+        self.mine_selectors_config = _mine_selectors
+        self.selector_zero_bytes = _selector_zero_bytes
+        # processes searching for selectors, 1 mines in this process (batch runs already use one per file)
+        self.selector_mining_workers = _selector_mining_workers
 
 class layoutObfuscation:
     """Layout Obfuscator"""
@@ -36,26 +55,8 @@ class layoutObfuscation:
         self.function_map = {}
     
     def remove_comments(self, source_code):
-        """Remove all comments from Solidity code"""
-        
-        string_pattern = r'(".*?"|\'.*?\')'
-        strings = []
-        
-        def replace_string(match):
-            strings.append(match.group(0))
-            return f'__STRING_{len(strings)-1}__'
-
-        source_code = re.sub(string_pattern, replace_string, source_code)
-
-        # Remove multi-line comments /* ... */
-        source_code = re.sub(r'/\*.*?\*/', '', source_code, flags=re.DOTALL)
-        # Remove single-line comments //
-        source_code = re.sub(r'//.*', '', source_code)
-
-        for i, string in enumerate(strings):
-            source_code = source_code.replace(f'__STRING_{i}__', string)
-
-        return source_code
+        """Remove all comments from Solidity code (string literals are single tokens, so they are kept intact)"""
+        return tokenize(source_code).strip_comments()
     
     def random_remove_whitespace(self, source_code):
         """Randomly remove spaces, tabs and empty lines"""
@@ -101,146 +102,166 @@ class layoutObfuscation:
 
         return processed_code
     
-    def obfuscate_variables(self, code):
-        """Obfuscate variable names"""
+    def _register_name(self, name_map, name):
+        """Give name a random replacement, unless it is empty, a keyword or already has one in either map"""
+        if not name or name in KEYWORDS or name in self.variable_map or name in self.function_map:
+            return
+        name_map[name] = generate_random_name()
+
+    def collect_variables(self, code):
+        """Find variable names to obfuscate"""
         pattern = r'\b(bool|u?int(8|16|32|64|128|256)?|u?fixed(16x4|32x8|64x10|128x18)|address|string|byte(s[0-9]*)?|enum)\s+(([a-zA-Z_][a-zA-Z0-9_]*)\s+)*(?P<var_name>[a-zA-Z_][a-zA-Z0-9_]*)'
-        matches = re.finditer(pattern, code)
+        for match in re.finditer(pattern, code):
+            self._register_name(self.variable_map, match.group('var_name'))
 
-        for match in matches:
-            var_name = match.group('var_name')
-            if var_name not in self.variable_map:
-                self.variable_map[var_name] = generate_random_name()
-                code = re.sub(rf'(?P<stay>"[^"]*")|(?<!msg\.)(?<!block\.)\b{var_name}\b', lambda x: x.group('stay') if x.group('stay') else self.variable_map[var_name], code)
-
-        return code
-
-    def obfuscate_mappings(self, code):
-        """Obfuscate mapping names, including nested mappings"""
-        code = self.obfuscate_single_mappings(code)
-        code = self.obfuscate_nested_mappings(code)
-        return code
-    
-    def obfuscate_single_mappings(self, code):
-        """Obfuscate mapping names"""
+    def collect_single_mappings(self, code):
+        """Find mapping names to obfuscate"""
         pattern = r'\bmapping\s*\(\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=>\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\)\s+(([a-zA-Z_][a-zA-Z0-9_]*)\s+)*(?P<mapping_name>[a-zA-Z_][a-zA-Z0-9_]*)'
-        matches = re.finditer(pattern, code)
+        for match in re.finditer(pattern, code):
+            self._register_name(self.function_map, match.group('mapping_name'))
 
-        for match in matches:
-            mapping_name = match.group('mapping_name')
-            if mapping_name not in self.function_map:
-                self.function_map[mapping_name] = generate_random_name()
-                code = re.sub(rf'(?P<stay>"[^"]*")|(?<!msg\.)(?<!block\.)\b{mapping_name}\b', lambda x: x.group('stay') if x.group('stay') else self.function_map[mapping_name], code)
-
-        return code
-    
-    def obfuscate_nested_mappings(self, code):
+    def collect_nested_mappings(self, code):
         pattern = r'\bmapping\s*\(\s*[^=>]+\s*=>\s*(mapping\s*\(\s*[^=>]+\s*=>\s*)*[^)]+\s*\)(\s*\))*\s+(([a-zA-Z_][a-zA-Z0-9_]*)\s+)*(?P<nested_mapping_name>[a-zA-Z_][a-zA-Z0-9_]*)'
-        matches = re.finditer(pattern, code)
+        for match in re.finditer(pattern, code):
+            self._register_name(self.variable_map, match.group('nested_mapping_name'))
 
-        for match in matches:
-            mapping_name = match.group('nested_mapping_name')
-            if mapping_name and mapping_name not in self.variable_map:
-                self.variable_map[mapping_name] = generate_random_name()
-                code = re.sub(
-                    rf'(?P<stay>"[^"]*")|(?<!msg\.)(?<!block\.)\b{mapping_name}\b', lambda x: x.group('stay') if x.group('stay') else self.variable_map[mapping_name], code
-                )
-
-        return code
-
-    def obfuscate_vectors(self, code):
-        """Obfuscate array names"""
+    def collect_vectors(self, code):
+        """Find array names to obfuscate"""
         pattern = r'\b(bool|u?int(8|16|32|64|128|256)?|u?fixed(16x4|32x8|64x10|128x18)?|address|string|byte(s[0-9]*)?|enum)(\s*\[\s*\d*\s*\])*\s+(([a-zA-Z_][a-zA-Z0-9_]*)\s+)*(?P<vector_name>[a-zA-Z_][a-zA-Z0-9_]*)'
-        matches = re.finditer(pattern, code)
-
-        for match in matches:
-            vector_name = match.group('vector_name')
-            if vector_name not in self.variable_map:
-                self.variable_map[vector_name] = generate_random_name()
-                code = re.sub(rf'(?P<stay>"[^"]*")|(?<!msg\.)(?<!block\.)\b{vector_name}\b', lambda x: x.group('stay') if x.group('stay') else self.variable_map[vector_name], code)
-
-        return code
+        for match in re.finditer(pattern, code):
+            self._register_name(self.variable_map, match.group('vector_name'))
 
-    def obfuscate_functions(self, code):
-        """Obfuscate names of functions, modifiers, contracts, structs, and events"""
+    def collect_functions(self, code):
+        """Find names of functions, modifiers, contracts, structs, and events to obfuscate"""
         excluded_functions = {'fallback', 'receive'}
 
         pattern = r'(function|modifier|contract|event|struct)\s+(?P<func_name>[a-zA-Z0-9_]*)\s*(\(|\{)'
-        matches = re.finditer(pattern, code)
-
-        for match in matches:
+        for match in re.finditer(pattern, code):
             func_name = match.group('func_name')
-            
-            if func_name in excluded_functions:
+            if func_name not in excluded_functions:
+                self._register_name(self.function_map, func_name)
+
+    def mine_selectors(self, code, zero_bytes=DEFAULT_ZERO_BYTES, hot_functions=(), workers=DEFAULT_MINING_WORKERS):
+        """
+        Replace the random names of public / external functions by mined ones (see
+        utilities.selector_mining): the random name becomes the prefix, a nonce is appended.
+        The mined selectors avoid every other selector of the source under its final name,
+        inherited, overloaded and unrenamed functions and public getters included
+        """
+        signatures = {name: parameters for name, parameters in external_signatures(code).items()
+                      if name in self.function_map}
+        if not signatures:
+            return
+        rename_table = {**self.function_map, **self.variable_map}
+        reserved = {selector(rename_table.get(name, name), parameters)
+                    for name, parameters in public_signatures(code) if name not in signatures}
+        miner = SelectorMiner(zero_bytes, workers, reserved=reserved)
+        self.function_map.update(miner.mine(signatures, self.function_map, hot_functions or ()))
+        print(miner.summary())
+
+    def apply_renames(self, code):
+        """
+        Replace every name of the rename table in one scan over the tokens.
+        String literals are left alone, as are members of msg and block (msg.value, block.number, ...)
+        """
+        rename_table = {**self.function_map, **self.variable_map}
+        if not rename_table:
+            return code
+
+        tokens = tokenize(code)
+        pieces = []
+        cursor = 0
+        for i, kind in enumerate(tokens.kinds):
+            if kind != IDENTIFIER:
                 continue
-            
-            if func_name not in self.function_map:
-                self.function_map[func_name] = generate_random_name()
-                code = re.sub(rf'(?P<stay>"[^"]*")|(?<!msg\.)(?<!block\.)\b{func_name}\b', lambda x: x.group('stay') if x.group('stay') else self.function_map[func_name], code)
+            new_name = rename_table.get(tokens.token_text(i))
+            if new_name is None:
+                continue
+            if i >= 2 and tokens.is_punct(i - 1, ".") and (tokens.is_identifier(i - 2, "msg") or tokens.is_identifier(i - 2, "block")):
+                continue
+            pieces.append(code[cursor:tokens.starts[i]])
+            pieces.append(new_name)
+            cursor = tokens.ends[i]
+        pieces.append(code[cursor:])
+        return "".join(pieces)
 
-        return code
+    def obfuscate_variables(self, code):
+        """Obfuscate variable names"""
+        self.collect_variables(code)
+        return self.apply_renames(code)
 
-    def minify_code(self, code: str) -> str:
-        string_pattern = r'(".*?"|\'.*?\')'
-        strings = []
-        
-        def replace_string(match):
-           strings.append(match.group(0))
-           return f'__STRING_{len(strings)-1}__'
+    def obfuscate_mappings(self, code):
+        """Obfuscate mapping names, including nested mappings"""
+        self.collect_single_mappings(code)
+        self.collect_nested_mappings(code)
+        return self.apply_renames(code)
+
+    def obfuscate_vectors(self, code):
+        """Obfuscate array names"""
+        self.collect_vectors(code)
+        return self.apply_renames(code)
 
-        code_replaced_string = re.sub(string_pattern, replace_string, code)
-        code_replaced_string = re.sub(r'/\*.*?\*/', '', code_replaced_string, flags=re.DOTALL)
+    def obfuscate_functions(self, code):
+        """Obfuscate names of functions, modifiers, contracts, structs, and events"""
+        self.collect_functions(code)
+        return self.apply_renames(code)
 
-        code_replaced_string = "".join(line.strip() for line in code_replaced_string.splitlines())
+    def minify_code(self, code: str) -> str:
+        tokens = tokenize(code)
+        text = tokens.text
 
-        result_chars: List[str] = []
+        result: List[str] = []
         prev_char = ""
         space_pending = False
 
         separators = set("{}();,=:+-*/<>!&|[]")
 
-        for ch in code_replaced_string:
-            if ch.isspace():
+        for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+            # comments are dropped too, a // comment left on the joined line would swallow the rest of the file
+            if kind == WHITESPACE or kind == COMMENT:
                 space_pending = True
                 continue
 
             if space_pending:
-                if (prev_char and prev_char not in separators) and (ch not in separators):
-                    result_chars.append(" ")
-                    prev_char = " "
+                if (prev_char and prev_char not in separators) and (text[start] not in separators):
+                    result.append(" ")
                 space_pending = False
 
-            result_chars.append(ch)
-            prev_char = ch
-
-        result = "".join(result_chars).strip()
-
-        for i, string in enumerate(strings):
-            result = result.replace(f'__STRING_{i}__', string)
+            result.append(text[start:end])
+            prev_char = text[end - 1]
 
-        return result
+        return "".join(result)
     
-    def run(self, config: layoutConfig):
+    def run(self, config: layoutConfig, observer=None, hot_functions=None):
         """
         Apply layout obfuscation
         :param code: Input code
+        :param observer: optional observer(step, before, after), may return replacement code
+        :param hot_functions: function names from the hottest down, dispatched first when mining selectors
         :return: Obfuscated code
         """
         
         try:
             code = self.code
             if config.remove_comments_config:
-                code = self.remove_comments(code)
+                code = notify(observer, "removeComments", code, self.remove_comments(code))
             # code = self.random_remove_whitespace(code) # duplicate function from minify_code
+            # build the whole rename table first, then rename in a single pass
             if config.obfuscate_variables_config:
-                code = self.obfuscate_variables(code)
+                self.collect_variables(code)
             if config.obfuscate_mappings_config:
-                code = self.obfuscate_mappings(code)
+                self.collect_single_mappings(code)
+                self.collect_nested_mappings(code)
             if config.obfuscate_vectors_config:
-                code = self.obfuscate_vectors(code)
+                self.collect_vectors(code)
             if config.obfuscate_functions_config:
-                code = self.obfuscate_functions(code)
+                self.collect_functions(code)
+                if config.mine_selectors_config:
+                    self.mine_selectors(code, config.selector_zero_bytes, hot_functions, config.selector_mining_workers)
+            if self.variable_map or self.function_map:
+                code = notify(observer, "renameIdentifiers", code, self.apply_renames(code))
             if config.minify_code_config:
-                code = self.minify_code(code)
+                code = notify(observer, "minifyCode", code, self.minify_code(code))
             return code
         except Exception as e:
             print(f"Error during obfuscation: {e}")
@@ -1,14 +1,13 @@
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import re
 
 from utilities import config
 from utilities.metrics import calculate_complexity
-import layoutObfuscation
-import dataflowObfuscation
-import controlflowObfuscation
-import deadcodeObfuscation
+from utilities import gas_harness
+import Ast_generator
+import obfuscationPipeline
+from utilities.opaque_predicates import TIER_CHOICES, DEFAULT_TIER
 
 class ObfuscationApp:
     def __init__(self, root: tk.Tk):
@@ -33,15 +32,20 @@ class ObfuscationApp:
         self.controlflow_config_instruction_replace_var = tk.BooleanVar(value=True)
         self.controlflow_config_insert_opaque_predicate_var = tk.BooleanVar(value=True)
         self.controlflow_config_shuffle_code_block_var = tk.BooleanVar(value=True)
+        self.controlflow_config_opaque_predicate_tier_var = tk.StringVar(value=DEFAULT_TIER)
+        self.controlflow_config_flatten_control_flow_var = tk.BooleanVar(value=False)
         # configuration -> deadcode configuration
         self.deadcode_config_insert_deadcode_helper_var = tk.BooleanVar(value=True)
         self.deadcode_config_insert_bogus_blocks_var = tk.BooleanVar(value=True)
+        self.deadcode_config_outline_deadcode_var = tk.BooleanVar(value=False)
         # configuration -> dataflow configuration
         self.dataflow_config_scalar_to_struct_var = tk.BooleanVar(value=True)
         self.dataflow_config_promote_local_to_global_var = tk.BooleanVar(value=True)
         self.dataflow_config_constants_to_dynamic_arrays_var = tk.BooleanVar(value=True)
         self.dataflow_config_split_boolean_expressions_var = tk.BooleanVar(value=True)
         self.dataflow_config_constants_to_arithmetic_var = tk.BooleanVar(value=True)
+        self.dataflow_config_promote_to_transient_var = tk.BooleanVar(value=False)
+        self.dataflow_config_promote_loop_writes_var = tk.BooleanVar(value=False)
         # configuration -> layout configuration
         self.layout_config_remove_comments_var = tk.BooleanVar(value=True)
         self.layout_config_obfuscate_variables_var = tk.BooleanVar(value=True)
@@ -49,6 +53,7 @@ class ObfuscationApp:
         self.layout_config_obfuscate_vectors_var = tk.BooleanVar(value=True)
         self.layout_config_obfuscate_functions_var = tk.BooleanVar(value=True)
         self.layout_config_minify_code_var = tk.BooleanVar(value=True)
+        self.layout_config_mine_selectors_var = tk.BooleanVar(value=False)
 
         # UI
         self._build_ui()
@@ -192,15 +197,24 @@ class ObfuscationApp:
         self.controlflow_config_instruction_replace_var.set(self.config_dict["controlflowConfig"][1]["instructionReplace"])
         self.controlflow_config_insert_opaque_predicate_var.set(self.config_dict["controlflowConfig"][2]["insertOpaquePredicate"])
         self.controlflow_config_shuffle_code_block_var.set(self.config_dict["controlflowConfig"][3]["shuffleCodeBlock"])
+        if len(self.config_dict["controlflowConfig"]) > 4:
+            self.controlflow_config_opaque_predicate_tier_var.set(self.config_dict["controlflowConfig"][4]["opaquePredicateTier"])
+        if len(self.config_dict["controlflowConfig"]) > 5:
+            self.controlflow_config_flatten_control_flow_var.set(self.config_dict["controlflowConfig"][5]["flattenControlFlow"])
         # deadcode config
         self.deadcode_config_insert_deadcode_helper_var.set(self.config_dict["deadcodeConfig"][0]["insertDeadcodeHelper"])
         self.deadcode_config_insert_bogus_blocks_var.set(self.config_dict["deadcodeConfig"][1]["insertBogusBlocks"])
+        if len(self.config_dict["deadcodeConfig"]) > 2:
+            self.deadcode_config_outline_deadcode_var.set(self.config_dict["deadcodeConfig"][2]["outlineDeadcode"])
         # data flow config
         self.dataflow_config_scalar_to_struct_var.set(self.config_dict["dataflowConfig"][0]["scalarToStruct"])
         self.dataflow_config_promote_local_to_global_var.set(self.config_dict["dataflowConfig"][1]["promoteLocalToGlobal"])
         self.dataflow_config_constants_to_dynamic_arrays_var.set(self.config_dict["dataflowConfig"][2]["constantsToDynamicArrays"])
         self.dataflow_config_split_boolean_expressions_var.set(self.config_dict["dataflowConfig"][3]["splitBooleanExpressions"])
         self.dataflow_config_constants_to_arithmetic_var.set(self.config_dict["dataflowConfig"][4]["constantsToArithmetic"])
+        if len(self.config_dict["dataflowConfig"]) > 6:
+            self.dataflow_config_promote_to_transient_var.set(self.config_dict["dataflowConfig"][5]["promoteToTransient"])
+            self.dataflow_config_promote_loop_writes_var.set(self.config_dict["dataflowConfig"][6]["promoteLoopWrites"])
         # layout config
         self.layout_config_remove_comments_var.set(self.config_dict["layoutConfig"][0]["removeComments"])
         self.layout_config_obfuscate_variables_var.set(self.config_dict["layoutConfig"][1]["obfuscateVariables"])
@@ -208,6 +222,8 @@ class ObfuscationApp:
         self.layout_config_obfuscate_vectors_var.set(self.config_dict["layoutConfig"][3]["obfuscateVectors"])
         self.layout_config_obfuscate_functions_var.set(self.config_dict["layoutConfig"][4]["obfuscateFunctions"])
         self.layout_config_minify_code_var.set(self.config_dict["layoutConfig"][5]["minifyCode"])
+        if len(self.config_dict["layoutConfig"]) > 6:
+            self.layout_config_mine_selectors_var.set(self.config_dict["layoutConfig"][6]["mineSelectors"])
 
     def get_config(self) -> dict:
         # file config
@@ -224,15 +240,26 @@ class ObfuscationApp:
         self.config_dict["controlflowConfig"][1]["instructionReplace"] = self.controlflow_config_instruction_replace_var.get()
         self.config_dict["controlflowConfig"][2]["insertOpaquePredicate"] = self.controlflow_config_insert_opaque_predicate_var.get()
         self.config_dict["controlflowConfig"][3]["shuffleCodeBlock"] = self.controlflow_config_shuffle_code_block_var.get()
+        while len(self.config_dict["controlflowConfig"]) < 6:
+            self.config_dict["controlflowConfig"].append({})
+        self.config_dict["controlflowConfig"][4]["opaquePredicateTier"] = self.controlflow_config_opaque_predicate_tier_var.get()
+        self.config_dict["controlflowConfig"][5]["flattenControlFlow"] = self.controlflow_config_flatten_control_flow_var.get()
         # deadcode config
         self.config_dict["deadcodeConfig"][0]["insertDeadcodeHelper"] = self.deadcode_config_insert_deadcode_helper_var.get()
         self.config_dict["deadcodeConfig"][1]["insertBogusBlocks"] = self.deadcode_config_insert_bogus_blocks_var.get()
+        while len(self.config_dict["deadcodeConfig"]) < 3:
+            self.config_dict["deadcodeConfig"].append({})
+        self.config_dict["deadcodeConfig"][2]["outlineDeadcode"] = self.deadcode_config_outline_deadcode_var.get()
         # data flow config
         self.config_dict["dataflowConfig"][0]["scalarToStruct"] = self.dataflow_config_scalar_to_struct_var.get()
         self.config_dict["dataflowConfig"][1]["promoteLocalToGlobal"] = self.dataflow_config_promote_local_to_global_var.get()
         self.config_dict["dataflowConfig"][2]["constantsToDynamicArrays"] = self.dataflow_config_constants_to_dynamic_arrays_var.get()
         self.config_dict["dataflowConfig"][3]["splitBooleanExpressions"] = self.dataflow_config_split_boolean_expressions_var.get()
         self.config_dict["dataflowConfig"][4]["constantsToArithmetic"] = self.dataflow_config_constants_to_arithmetic_var.get()
+        while len(self.config_dict["dataflowConfig"]) < 7:
+            self.config_dict["dataflowConfig"].append({})
+        self.config_dict["dataflowConfig"][5]["promoteToTransient"] = self.dataflow_config_promote_to_transient_var.get()
+        self.config_dict["dataflowConfig"][6]["promoteLoopWrites"] = self.dataflow_config_promote_loop_writes_var.get()
         # layout config
         self.config_dict["layoutConfig"][0]["removeComments"] = self.layout_config_remove_comments_var.get()
         self.config_dict["layoutConfig"][1]["obfuscateVariables"] = self.layout_config_obfuscate_variables_var.get()
@@ -240,12 +267,15 @@ class ObfuscationApp:
         self.config_dict["layoutConfig"][3]["obfuscateVectors"] = self.layout_config_obfuscate_vectors_var.get()
         self.config_dict["layoutConfig"][4]["obfuscateFunctions"] = self.layout_config_obfuscate_functions_var.get()
         self.config_dict["layoutConfig"][5]["minifyCode"] = self.layout_config_minify_code_var.get()
+        while len(self.config_dict["layoutConfig"]) < 7:
+            self.config_dict["layoutConfig"].append({})
+        self.config_dict["layoutConfig"][6]["mineSelectors"] = self.layout_config_mine_selectors_var.get()
 
     # configuration
     def open_config_window(self):
         config_window = tk.Toplevel(self.root)  # Link to the main window
         config_window.title("Configuration Window")
-        config_window.geometry("400x600")  # Set dimensions
+        config_window.geometry("400x775")  # Set dimensions
 
         # control flow label
         lbl_control_flow = tk.Label(config_window, text="control flow configurations:")
@@ -283,6 +313,23 @@ class ObfuscationApp:
         )
         chk_controlflow_shuffle_code_block.grid(row=3, column=0, sticky="w")
 
+        lbl_controlflow_opaque_predicate_tier = tk.Label(control_flow_frame, text="opaque predicate cost tier:")
+        lbl_controlflow_opaque_predicate_tier.grid(row=4, column=0, sticky="w")
+
+        opt_controlflow_opaque_predicate_tier = tk.OptionMenu(
+            control_flow_frame,
+            self.controlflow_config_opaque_predicate_tier_var,
+            *TIER_CHOICES,
+        )
+        opt_controlflow_opaque_predicate_tier.grid(row=4, column=1, sticky="w")
+
+        chk_controlflow_flatten_control_flow = tk.Checkbutton(
+            control_flow_frame,
+            text="flatten control flow",
+            variable=self.controlflow_config_flatten_control_flow_var,
+        )
+        chk_controlflow_flatten_control_flow.grid(row=5, column=0, sticky="w")
+
         # deadcode label
         lbl_dead_code = tk.Label(config_window, text="dead code configurations:")
         lbl_dead_code.grid(row=2, column=0, pady=(10, 0), sticky="nw")
@@ -305,6 +352,13 @@ class ObfuscationApp:
         )
         chk_deadcode_insert_bogus_blocks.grid(row=1, column=0, sticky="w")
 
+        chk_deadcode_outline_deadcode = tk.Checkbutton(
+            deadcode_frame,
+            text="outline bogus blocks into shared routines",
+            variable=self.deadcode_config_outline_deadcode_var,
+        )
+        chk_deadcode_outline_deadcode.grid(row=2, column=0, sticky="w")
+
         # data flow label
         lbl_data_flow = tk.Label(config_window, text="dataflow configurations:")
         lbl_data_flow.grid(row=4, column=0, pady=(10, 0), sticky="nw")
@@ -348,6 +402,20 @@ class ObfuscationApp:
         )
         chk_dataflow_constants_to_arithmetic.grid(row=4, column=0, sticky="w")
 
+        chk_dataflow_promote_to_transient = tk.Checkbutton(
+            dataflow_frame,
+            text="promote to transient storage (gas aware)",
+            variable=self.dataflow_config_promote_to_transient_var,
+        )
+        chk_dataflow_promote_to_transient.grid(row=5, column=0, sticky="w")
+
+        chk_dataflow_promote_loop_writes = tk.Checkbutton(
+            dataflow_frame,
+            text="also promote variables written in loops",
+            variable=self.dataflow_config_promote_loop_writes_var,
+        )
+        chk_dataflow_promote_loop_writes.grid(row=6, column=0, sticky="w")
+
         # layout label
         lbl_layout = tk.Label(config_window, text="layout configurations:")
         lbl_layout.grid(row=6, column=0, pady=(10, 0), sticky="nw")
@@ -398,6 +466,13 @@ class ObfuscationApp:
         )
         chk_layout_minify_code.grid(row=5, column=0, sticky="w")
 
+        chk_layout_mine_selectors = tk.Checkbutton(
+            layout_frame,
+            text="mine cheap selectors (hot functions first)",
+            variable=self.layout_config_mine_selectors_var,
+        )
+        chk_layout_mine_selectors.grid(row=6, column=0, sticky="w")
+
     # handleling
 
     def select_input_file(self):
@@ -471,67 +546,14 @@ class ObfuscationApp:
             return
 
         try:
-            # pragme statement should not be obfuscated, so we extract it out and put it back in the last step
-            pragma_pattern = r'(pragma\s+solidity\s+[^;]+;)'  # Matches the pragma line
-            pragma_match = re.search(pragma_pattern, sol_content)
-    
-            # Extract the pragma statement if it exists and remove it from code
-            pragma_statement = pragma_match.group(0) if pragma_match else ""
-    
-            # Remove the pragma statement from the code
-            sol_content = re.sub(pragma_pattern, '', sol_content)
-
-            # Data flow
-            if self.dataflow_var.get():
-                dfoCfg = dataflowObfuscation.dataflowConfig(
-                    self.dataflow_config_scalar_to_struct_var.get(),
-                    self.dataflow_config_promote_local_to_global_var.get(),
-                    self.dataflow_config_constants_to_dynamic_arrays_var.get(),
-                    self.dataflow_config_split_boolean_expressions_var.get(),
-                    self.dataflow_config_constants_to_arithmetic_var.get()
-                )
-                dfo = dataflowObfuscation.dataflowObfuscation(sol_content)
-                sol_content = dfo.obfuscate(dfoCfg)
-
-            # Control flow
-            if self.controlflow_var.get():
-                cfoCfg = controlflowObfuscation.controlflowConfig(
-                    self.controlflow_config_instruction_insert_var.get(),
-                    self.controlflow_config_instruction_replace_var.get(),
-                    self.controlflow_config_insert_opaque_predicate_var.get(),
-                    self.controlflow_config_shuffle_code_block_var.get()
-                    )
-                cfo = controlflowObfuscation.controlflowObfuscation(sol_content)
-                sol_content = cfo.run(cfoCfg)
-
-            # Dead code
-            if self.deadcode_var.get():
-                dcCfg = deadcodeObfuscation.deadcodeConfig(
-                    self.deadcode_config_insert_deadcode_helper_var.get(),
-                    self.deadcode_config_insert_bogus_blocks_var.get()
-                )
-                dco = deadcodeObfuscation.deadcodeObfuscation(sol_content)
-                sol_content = dco.run(dcCfg)
-                pass
-
-            # Layout
-            if self.layout_var.get():
-                loCfg = layoutObfuscation.layoutConfig(
-                    self.layout_config_remove_comments_var.get(),
-                    self.layout_config_obfuscate_variables_var.get(),
-                    self.layout_config_obfuscate_mappings_var.get(),
-                    self.layout_config_obfuscate_vectors_var.get(),
-                    self.layout_config_obfuscate_functions_var.get(),
-                    self.layout_config_minify_code_var.get()
-                )
-                lo = layoutObfuscation.layoutObfuscation(sol_content)
-                sol_content = lo.run(loCfg)
-
-            # add the pragma statement back
-            sol_content = pragma_statement + sol_content
+            self.get_config()
+            rename_map = {}
+            sol_content = obfuscationPipeline.run_pipeline(sol_content, self.config_dict, rename_map=rename_map)
 
             with open(output_path, "w", encoding="utf-8") as f:
                 f.write(sol_content)
+            # the gas comparison in measure_complexity finds renamed functions and contracts through it
+            gas_harness.save_rename_map(output_path, rename_map)
 
             messagebox.showinfo(
                 "Success",
@@ -562,9 +584,22 @@ class ObfuscationApp:
         
         output_path = os.path.join(self.output_dir_var.get().strip(), out_name)
         
+        report_content = "Before obfuscate\n" + calculate_complexity(sol_content) + "\n" + "After obfuscated:\n" + calculate_complexity(obfuscated_content)
+
+        # optional gas / bytecode size comparison on a call scenario
+        self.get_config()
+        scenario_path = self.config_dict.get("gasScenarioPath")
+        if scenario_path:
+            try:
+                Ast_generator.set_solc_binary(self.config_dict.get("solcPath"))
+                comparison = gas_harness.compare(sol_content, obfuscated_content, gas_harness.load_scenario(scenario_path),
+                                                 gas_harness.load_rename_map(obfuscated_filename))
+                report_content += "\nGas and bytecode size:\n" + gas_harness.format_gas_report(comparison)
+            except Exception as e:
+                report_content += f"\nGas and bytecode size: skipped ({e})\n"
+
         try:
             with open(output_path, "w", encoding="utf-8") as f:
-                report_content = "Before obfuscate\n" + calculate_complexity(sol_content) + "\n" + "After obfuscated:\n" + calculate_complexity(obfuscated_content)
                 f.write(report_content)
             messagebox.showinfo(
                 "Success",
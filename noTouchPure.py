@@ -3,6 +3,8 @@
 
 import json
 
+from utilities.ast_index import AstIndex, ENCLOSING_CONSTRUCT_TYPES
+
 
 class noTouchPure:
     """
@@ -10,8 +12,12 @@ class noTouchPure:
     过滤掉在pure/view函数中的变量，防止破坏函数的状态可变性
     """
 
-    def __init__(self, _jsonContent):
+    def __init__(self, _jsonContent, _astIndex=None):
         self.json = _jsonContent
+        # 所有查询共用一次遍历建立的索引
+        self.index = _astIndex if _astIndex is not None else AstIndex(_jsonContent)
+        # 按需建立的区间索引 (函数/修饰器/assembly/unchecked), 每种只建一次
+        self._rangeIndexes = {}
         self.PURE_FLAG = "pure"
         self.VIEW_FLAG = "view"
         self.CONSTANT_FLAG = "constant"
@@ -19,23 +25,48 @@ class noTouchPure:
 
     def findASTNode(self, _key, _value):
         """
-        BFS遍历AST查找特定类型的节点
+        查找特定类型的节点 (基于AST索引)
+        """
+        return self.index.find(_key, _value)
+
+    def getStateMutability(self, func):
+        """
+        读取函数的stateMutability, 兼容compact AST和legacy AST
         """
-        queue = [self.json]
-        result = []
+        if "stateMutability" in func:
+            return func["stateMutability"]
+        return func.get("attributes", {}).get("stateMutability")
 
-        while queue:
-            data = queue.pop()
-            for key in data:
-                if key == _key and data[key] == _value:
-                    result.append(data)
-                elif isinstance(data[key], dict):
-                    queue.append(data[key])
-                elif isinstance(data[key], list):
-                    for item in data[key]:
-                        if isinstance(item, dict):
-                            queue.append(item)
-        return result
+    def isPureOrView(self, func):
+        return self.getStateMutability(func) in [self.PURE_FLAG, self.VIEW_FLAG]
+
+    def findPureViewFunctions(self):
+        """
+        找到所有pure和view函数节点
+        """
+        return [func for func in self.index.of_type("FunctionDefinition") if self.isPureOrView(func)]
+
+    def getRangeIndex(self, _kind):
+        """
+        获取某类结构的src区间索引, O(log n) 查询包含关系
+        _kind: "pureView" 或 ENCLOSING_CONSTRUCT_TYPES 中的节点类型, "construct" 表示全部
+        """
+        if _kind not in self._rangeIndexes:
+            if _kind == "pureView":
+                rangeIndex = self.index.span_index(("FunctionDefinition",), self.isPureOrView)
+            elif _kind == "construct":
+                rangeIndex = self.index.span_index(ENCLOSING_CONSTRUCT_TYPES)
+            else:
+                rangeIndex = self.index.span_index((_kind,))
+            self._rangeIndexes[_kind] = rangeIndex
+        return self._rangeIndexes[_kind]
+
+    def enclosingConstruct(self, variable_node):
+        """
+        返回包含该变量的最内层结构 (函数/修饰器/assembly块/unchecked块)
+        """
+        sPos, ePos = self.srcToPos(variable_node["src"])
+        return self.getRangeIndex("construct").enclosing(sPos, ePos)
 
     def srcToPos(self, _str):
         """
@@ -66,49 +97,16 @@ class noTouchPure:
         """
         查找变量的父函数
         """
-        target_id = variable_node.get("id")
-        if not target_id:
-            return None
-
-        queue = [self.json]
-        function_stack = []
-
-        while queue:
-            node = queue.pop()
-
-            if isinstance(node, dict):
-                # 如果是函数定义，记录当前函数
-                if node.get("name") == "FunctionDefinition":
-                    function_stack.append(node)
-
-                # 检查是否找到目标变量
-                if node.get("id") == target_id:
-                    return function_stack[-1] if function_stack else None
-
-                # 遍历子节点
-                for key, value in node.items():
-                    if isinstance(value, dict):
-                        queue.append(value)
-                    elif isinstance(value, list):
-                        # 在进入列表前保存函数栈状态
-                        current_function_stack = function_stack.copy()
-                        for item in value:
-                            if isinstance(item, dict):
-                                queue.append(item)
-                        # 恢复函数栈状态（列表遍历完成）
-                        function_stack = current_function_stack
-
-                # 如果是函数定义结束，弹出栈
-                if node.get("name") == "FunctionDefinition" and function_stack:
-                    function_stack.pop()
-
-        return None
+        return self.index.enclosing_function(variable_node)
 
     def isConstantOrImmutable(self, variable_node):
         """
         检查变量是否为常量或不可变变量
         """
         try:
+            if variable_node.get("constant") == True or \
+                    variable_node.get("mutability") in [self.CONSTANT_FLAG, self.IMMUTABLE_FLAG]:
+                return True
             attributes = variable_node.get("attributes", {})
             return (attributes.get(self.CONSTANT_FLAG) == True or
                     attributes.get(self.IMMUTABLE_FLAG) == True)
@@ -121,7 +119,7 @@ class noTouchPure:
         """
         try:
             attributes = variable_node.get("attributes", {})
-            storage_location = attributes.get("storageLocation", "default")
+            storage_location = variable_node.get("storageLocation", attributes.get("storageLocation", "default"))
             # storage 和 calldata 位置的变量通常不应转换为状态变量
             return storage_location in ["storage", "calldata"]
         except:
@@ -131,30 +129,20 @@ class noTouchPure:
         """
         检查变量是否在assembly块中（简化实现）
         """
-        assembly_blocks = self.findASTNode("name", "InlineAssembly")
-        if not assembly_blocks:
+        assembly_index = self.getRangeIndex("InlineAssembly")
+        if not len(assembly_index):
             return False
 
-        assembly_positions = self.getStartEndPos(assembly_blocks)
         var_sPos, var_ePos = self.srcToPos(variable_node["src"])
 
-        return self.isInRange(assembly_positions, var_sPos, var_ePos)
+        return assembly_index.contains(var_sPos, var_ePos)
 
     def runLocalVar(self, _list):
         """
         主要的过滤方法 - 过滤掉不应被转换为状态变量的局部变量
         """
-        # 1. 找到所有pure和view函数节点
-        funcNode = self.findASTNode("name", "FunctionDefinition")
-        pureViewFuncNode = []
-
-        for func in funcNode:
-            state_mutability = func["attributes"].get("stateMutability")
-            if state_mutability in [self.PURE_FLAG, self.VIEW_FLAG]:
-                pureViewFuncNode.append(func)
-
-        # 2. 获取pure/view函数的起始和中止位置
-        posList = self.getStartEndPos(pureViewFuncNode)
+        # 1-2. pure和view函数的区间索引
+        pureViewIndex = self.getRangeIndex("pureView")
 
         noTouchData = []
 
@@ -162,7 +150,7 @@ class noTouchPure:
         for var in _list:
             # 检查变量是否在pure/view函数中
             sPos, ePos = self.srcToPos(var["src"])
-            if self.isInRange(posList, sPos, ePos):
+            if pureViewIndex.contains(sPos, ePos):
                 continue
 
             # 检查是否为常量或不可变变量
@@ -226,20 +214,12 @@ class noTouchPure:
         """
         只过滤pure/view函数中的变量
         """
-        funcNode = self.findASTNode("name", "FunctionDefinition")
-        pureViewFuncNode = []
-
-        for func in funcNode:
-            state_mutability = func["attributes"].get("stateMutability")
-            if state_mutability in [self.PURE_FLAG, self.VIEW_FLAG]:
-                pureViewFuncNode.append(func)
-
-        posList = self.getStartEndPos(pureViewFuncNode)
+        pureViewIndex = self.getRangeIndex("pureView")
         filtered_vars = []
 
         for var in variable_list:
             sPos, ePos = self.srcToPos(var["src"])
-            if not self.isInRange(posList, sPos, ePos):
+            if not pureViewIndex.contains(sPos, ePos):
                 filtered_vars.append(var)
 
         return filtered_vars
\ No newline at end of file
@@ -0,0 +1,191 @@
+import re
+
+import Ast_generator
+from utilities.gas_harness import BYTECODE_OUTPUT_SELECTION
+from utilities.size_budget import SizeBudget, EIP170_LIMIT
+from utilities.call_profile import DEFAULT_HOT_GAS_SHARE, hot_functions, load_profile
+from utilities.selector_mining import DEFAULT_MINING_WORKERS, DEFAULT_ZERO_BYTES
+from utilities.opaque_predicates import DEFAULT_TIER
+from utilities.flattening import DEFAULT_MAX_BLOCKS
+import layoutObfuscation
+import dataflowObfuscation
+import controlflowObfuscation
+import deadcodeObfuscation
+
+# Matches the pragma line
+PRAGMA_PATTERN = r'(pragma\s+solidity\s+[^;]+;)'
+
+
+def split_pragma(sol_content: str):
+    """Extract the pragma statement and return (pragma_statement, code_without_pragma)"""
+    pragma_match = re.search(PRAGMA_PATTERN, sol_content)
+    pragma_statement = pragma_match.group(0) if pragma_match else ""
+    return pragma_statement, re.sub(PRAGMA_PATTERN, '', sol_content)
+
+
+def dataflow_config_from_dict(config_dict: dict) -> dataflowObfuscation.dataflowConfig:
+    cfg = config_dict["dataflowConfig"]
+    return dataflowObfuscation.dataflowConfig(
+        cfg[0]["scalarToStruct"],
+        cfg[1]["promoteLocalToGlobal"],
+        cfg[2]["constantsToDynamicArrays"],
+        cfg[3]["splitBooleanExpressions"],
+        cfg[4]["constantsToArithmetic"],
+        # configurations saved before these options existed keep the previous behaviour
+        cfg[5]["promoteToTransient"] if len(cfg) > 5 else False,
+        cfg[6]["promoteLoopWrites"] if len(cfg) > 6 else False,
+        config_dict.get("booleanClauseGasBudget"),
+        config_dict.get("booleanClauseFunctionGasBudget")
+    )
+
+
+def controlflow_config_from_dict(config_dict: dict) -> controlflowObfuscation.controlflowConfig:
+    cfg = config_dict["controlflowConfig"]
+    return controlflowObfuscation.controlflowConfig(
+        cfg[0]["instructionInsert"],
+        cfg[1]["instructionReplace"],
+        cfg[2]["insertOpaquePredicate"],
+        cfg[3]["shuffleCodeBlock"],
+        # configurations saved before the tier existed keep the original keccak loop
+        cfg[4]["opaquePredicateTier"] if len(cfg) > 4 else DEFAULT_TIER,
+        config_dict.get("precomputeOpaquePredicates", False),
+        cfg[5]["flattenControlFlow"] if len(cfg) > 5 else False,
+        config_dict.get("flattenFunctions") or (),
+        config_dict.get("flattenMaxBlocks") or DEFAULT_MAX_BLOCKS
+    )
+
+
+def deadcode_config_from_dict(config_dict: dict) -> deadcodeObfuscation.deadcodeConfig:
+    cfg = config_dict["deadcodeConfig"]
+    return deadcodeObfuscation.deadcodeConfig(
+        cfg[0]["insertDeadcodeHelper"],
+        cfg[1]["insertBogusBlocks"],
+        config_dict.get("precomputeOpaquePredicates", False),
+        # configurations saved before outlining existed keep inline blocks
+        cfg[2]["outlineDeadcode"] if len(cfg) > 2 else False
+    )
+
+
+def layout_config_from_dict(config_dict: dict) -> layoutObfuscation.layoutConfig:
+    cfg = config_dict["layoutConfig"]
+    return layoutObfuscation.layoutConfig(
+        cfg[0]["removeComments"],
+        cfg[1]["obfuscateVariables"],
+        cfg[2]["obfuscateMappings"],
+        cfg[3]["obfuscateVectors"],
+        cfg[4]["obfuscateFunctions"],
+        cfg[5]["minifyCode"],
+        # configurations saved before selector mining existed keep random names
+        cfg[6]["mineSelectors"] if len(cfg) > 6 else False,
+        config_dict.get("selectorZeroBytes") or DEFAULT_ZERO_BYTES,
+        config_dict.get("selectorMiningWorkers") or DEFAULT_MINING_WORKERS
+    )
+
+
+def size_budget_from_dict(config_dict: dict, code: str, pragma_statement: str):
+    """SizeBudget for the sizeBudget / maxRuntimeSize / maxSizeOverheadPercent keys, None when disabled"""
+    if not config_dict.get("sizeBudget"):
+        return None
+    return SizeBudget(
+        code,
+        pragma_statement,
+        config_dict.get("maxRuntimeSize") or EIP170_LIMIT,
+        config_dict.get("maxSizeOverheadPercent") or None
+    )
+
+
+def hot_functions_from_dict(config_dict: dict):
+    """
+    Hot function names, hottest first: from the profile at profilePath (split at hotGasShare),
+    else the hotFunctions list; None when neither is set
+    """
+    profile_path = config_dict.get("profilePath")
+    if profile_path:
+        hot = hot_functions(load_profile(profile_path), config_dict.get("hotGasShare") or DEFAULT_HOT_GAS_SHARE)
+    elif config_dict.get("hotFunctions"):
+        hot = tuple(config_dict["hotFunctions"])
+    else:
+        return None
+    print(f"Profile-guided: hot functions {', '.join(hot) or 'none'} only get layout obfuscation")
+    return hot
+
+
+def enabled_types(config_dict: dict) -> dict:
+    """Flatten the obfuscationType list into {type_name: enabled}"""
+    types = {}
+    for item in config_dict["obfuscationType"]:
+        types.update(item)
+    return types
+
+
+def solc_inputs(sol_content: str, config_dict: dict) -> list:
+    """
+    The solc standard-json inputs run_pipeline compiles before any pass has changed sol_content.
+    Compiling them ahead of time (see batchObfuscation) turns those compiles into AST cache hits;
+    everything later depends on random choices of the passes and cannot be predicted.
+    """
+    types = enabled_types(config_dict)
+    pragma_statement, code = split_pragma(sol_content)
+    inputs = []
+    if config_dict.get("sizeBudget"):
+        inputs.append(Ast_generator.build_standard_json_input(pragma_statement + code, BYTECODE_OUTPUT_SELECTION))
+    if types.get("dataflow"):
+        dataflow = dataflow_config_from_dict(config_dict)
+        # splitBooleanExpressions reuses the first AST, or compiles whatever the text passes before it left
+        text_passes_first = dataflow.scalar_to_struct_config or dataflow.constants_to_dynamic_arrays_config
+        if dataflow.promote_local_to_global_config or (dataflow.split_boolean_expressions_config and not text_passes_first):
+            inputs.append(Ast_generator.build_standard_json_input(code))
+    return inputs
+
+
+def run_pipeline(sol_content: str, config_dict: dict, observer=None, rename_map: dict = None) -> str:
+    """
+    Run dataflow -> controlflow -> deadcode -> layout on one Solidity source,
+    using a configuration in the same shape as Configuration.json.
+    observer(step, before, after) is called after every enabled sub-pass with the
+    pragma-free source and may return replacement code (see utilities.observer)
+    rename_map, when given, receives {original name: new name} of every identifier the
+    layout pass renamed, which the gas harness needs to find renamed functions and contracts
+    """
+    types = enabled_types(config_dict)
+    # only recorded here, solc itself is resolved the first time an AST based pass compiles
+    Ast_generator.set_solc_binary(config_dict.get("solcPath"))
+
+    # pragme statement should not be obfuscated, so we extract it out and put it back in the last step
+    pragma_statement, sol_content = split_pragma(sol_content)
+
+    # optional bytecode size budget: thins out insertions and vetoes steps that would exceed it
+    budget = size_budget_from_dict(config_dict, sol_content, pragma_statement)
+    if budget is not None:
+        observer = budget.observer(observer)
+
+    # optional call profile: functions that dominate the replayed gas are kept free of runtime overhead
+    hot = hot_functions_from_dict(config_dict)
+
+    # Data flow
+    if types.get("dataflow"):
+        dfo = dataflowObfuscation.dataflowObfuscation(sol_content, pragma_statement)
+        sol_content = dfo.obfuscate(dataflow_config_from_dict(config_dict), observer, hot)
+
+    # Control flow
+    if types.get("controlflow"):
+        cfo = controlflowObfuscation.controlflowObfuscation(sol_content)
+        sol_content = cfo.run(controlflow_config_from_dict(config_dict), observer, budget, hot)
+
+    # Dead code
+    if types.get("deadcode"):
+        dco = deadcodeObfuscation.deadcodeObfuscation(sol_content)
+        sol_content = dco.run(deadcode_config_from_dict(config_dict), observer, budget, hot)
+
+    # Layout
+    if types.get("layout"):
+        lo = layoutObfuscation.layoutObfuscation(sol_content)
+        sol_content = lo.run(layout_config_from_dict(config_dict), observer, hot)
+        if rename_map is not None:
+            rename_map.update({**lo.function_map, **lo.variable_map})
+
+    if budget is not None:
+        print(budget.summary())
+
+    # add the pragma statement back
+    return pragma_statement + sol_content
@@ -0,0 +1,138 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import Ast_generator
+import obfuscationPipeline
+from utilities import gas_harness
+
+
+def record_snapshots(sol_content: str, config_dict: dict, quiet: bool = True):
+    """
+    Run the pipeline once and keep the full source (pragma included) after every
+    enabled sub-pass, together with the time spent in that sub-pass.
+    Returns (snapshots, obfuscated source).
+    """
+    pragma_statement, _ = obfuscationPipeline.split_pragma(sol_content)
+    snapshots = []
+    last = time.perf_counter()
+
+    def observer(step, before, after):
+        nonlocal last
+        snapshots.append({"step": step, "seconds": time.perf_counter() - last, "source": pragma_statement + after})
+        last = time.perf_counter()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        obfuscated = obfuscationPipeline.run_pipeline(sol_content, config_dict, observer)
+    return snapshots, obfuscated
+
+
+def measure_snapshot(source: str, scenario: dict = None, reference: dict = None, solc_path: str = None) -> dict:
+    """
+    Compile one snapshot (through the AST/bytecode cache) and, with a scenario, replay it.
+    Without a scenario only the runtime size (summed over all contracts) is measured.
+    """
+    Ast_generator.set_solc_binary(solc_path)
+    result = {"status": "ok", "error": None, "runtimeSize": None, "deployGas": None, "scenarioGas": None}
+    try:
+        if scenario:
+            measured = gas_harness.measure(source, scenario, reference=reference)
+            result["runtimeSize"] = measured["runtimeSize"]
+            result["deployGas"] = measured["deployGas"]
+            result["scenarioGas"] = sum(sum(stats["gas"]) for stats in measured["functions"].values())
+        else:
+            contracts = gas_harness.compile_contracts(source)
+            result["runtimeSize"] = sum(len(c["runtime"]) // 2 for c in contracts.values())
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def attribute_costs(sol_content: str, config_dict: dict, scenario: dict = None, workers: int = None,
+                    quiet: bool = True) -> list:
+    """
+    Marginal bytecode size, gas and Python time of every enabled sub-pass.
+
+    The pipeline runs once; the original and every snapshot are then measured in
+    parallel, so the report costs about one extra compile round. Each row holds the
+    absolute measurements and the change against the previous row (None when either
+    side failed to compile).
+    """
+    snapshots, _ = record_snapshots(sol_content, config_dict, quiet)
+    solc_path = config_dict.get("solcPath")
+
+    reference = None
+    if scenario:
+        # the original contract lets renamed functions be found again, and warms the cache for its own row
+        Ast_generator.set_solc_binary(solc_path)
+        contracts = gas_harness.compile_contracts(sol_content)
+        reference = contracts[gas_harness.resolve_contract(contracts, scenario.get("contract"))]
+
+    rows = [{"step": "original", "seconds": 0.0, "source": sol_content}] + snapshots
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(measure_snapshot, row["source"], scenario, reference, solc_path) for row in rows]
+        for row, future in zip(rows, futures):
+            row.update(future.result())
+
+    previous = None
+    for row in rows:
+        for key in ("runtimeSize", "deployGas", "scenarioGas"):
+            ok = previous is not None and row[key] is not None and previous[key] is not None
+            row[key + "Delta"] = row[key] - previous[key] if ok else None
+        previous = row
+        del row["source"]
+    return rows
+
+
+def _cell(value, delta) -> str:
+    if value is None:
+        return "-"
+    return f"{value} ({delta:+d})" if delta is not None else str(value)
+
+
+def format_attribution_report(rows: list) -> str:
+    lines = [f"{'step':<26}{'python ms':>11}  {'runtime bytes':<20}{'deploy gas':<22}{'scenario gas'}"]
+    for row in rows:
+        line = (f"{row['step']:<26}{row['seconds'] * 1000:>11.1f}  "
+                f"{_cell(row['runtimeSize'], row['runtimeSizeDelta']):<20}"
+                f"{_cell(row['deployGas'], row['deployGasDelta']):<22}"
+                f"{_cell(row['scenarioGas'], row['scenarioGasDelta']):<22}")
+        if row["status"] != "ok":
+            line += f"  {row['error']}"
+        lines.append(line.rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Attribute bytecode size, gas and time to each enabled obfuscation sub-pass")
+    parser.add_argument("input", help="Solidity file to obfuscate")
+    parser.add_argument("--config", default="Configuration.json", help="configuration file (same format as the GUI)")
+    parser.add_argument("--scenario", default=None, help="call scenario for gas (default: gasScenarioPath from the config)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--solc", default=None, help="path of the solc binary (default: solcPath from the config, then auto-detect)")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the per-pass output of the pipeline")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config_dict = json.load(f)
+    if args.solc:
+        config_dict["solcPath"] = args.solc
+    scenario_path = args.scenario or config_dict.get("gasScenarioPath")
+    scenario = gas_harness.load_scenario(scenario_path) if scenario_path else None
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        sol_content = f.read()
+
+    rows = attribute_costs(sol_content, config_dict, scenario, args.workers, quiet=not args.verbose)
+    print(json.dumps(rows, indent=2) if args.json else format_attribution_report(rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
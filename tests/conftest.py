@@ -0,0 +1,86 @@
+import copy
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the obfuscator is a set of top-level modules, not an installed package
+sys.path.insert(0, REPO_ROOT)
+
+FIXTURES = sorted(glob.glob(os.path.join(REPO_ROOT, "testCase", "*.sol")))
+
+with open(os.path.join(REPO_ROOT, "Configuration.json"), "r", encoding="utf-8") as f:
+    _CONFIGURATION = json.load(f)
+
+
+@pytest.fixture(params=FIXTURES, ids=os.path.basename)
+def fixture_source(request) -> str:
+    with open(request.param, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def config_dict() -> dict:
+    """A copy of the shipped Configuration.json"""
+    return copy.deepcopy(_CONFIGURATION)
+
+
+@pytest.fixture
+def well_formed():
+    """Function that parses a Solidity source and fails the test on the first syntax error"""
+    antlr4 = pytest.importorskip("antlr4")
+    pytest.importorskip("solidity_parser")
+    from antlr4.error.ErrorListener import ErrorListener
+    from solidity_parser.solidity_antlr4.SolidityLexer import SolidityLexer
+    from solidity_parser.solidity_antlr4.SolidityParser import SolidityParser
+
+    class _Raise(ErrorListener):
+        def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
+            raise SyntaxError(f"line {line}:{column} {msg}")
+
+    def check(source: str):
+        lexer = SolidityLexer(antlr4.InputStream(source))
+        parser = SolidityParser(antlr4.CommonTokenStream(lexer))
+        for recognizer in (lexer, parser):
+            recognizer.removeErrorListeners()
+            recognizer.addErrorListener(_Raise())
+        try:
+            parser.sourceUnit()
+        except SyntaxError as e:
+            line = int(str(e).split()[1].split(":")[0])
+            pytest.fail(f"{e}\n{source.splitlines()[line - 1]}")
+
+    return check
+
+
+def function_bodies(code: str) -> dict:
+    """{function name: body text} of every named function"""
+    from utilities.flattening import ControlFlowFlattener
+    from utilities.lexer import tokenize
+
+    tokens = tokenize(code)
+    return {name: code[tokens.starts[open_]:tokens.ends[close]]
+            for name, open_, close in ControlFlowFlattener.function_bodies(tokens)}
+
+
+def run_without_pragma(transform, source: str) -> str:
+    """Run transform on source the way run_pipeline does: with the pragma taken out and put back"""
+    from obfuscationPipeline import split_pragma
+
+    pragma_statement, code = split_pragma(source)
+    return pragma_statement + transform(code)
+
+
+@pytest.fixture
+def solc_binary(monkeypatch):
+    """Path of an installed solc; skips the test instead of downloading one"""
+    import Ast_generator
+
+    monkeypatch.setenv("SOLOBF_SOLC_OFFLINE", "1")
+    try:
+        return Ast_generator.get_solc_binary()
+    except (RuntimeError, OSError) as e:
+        pytest.skip(f"solc is not available: {e}")
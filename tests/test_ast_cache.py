@@ -0,0 +1,52 @@
+import os
+
+from utilities import ast_cache
+from utilities.ast_cache import AstCache, combine_stats
+
+
+def _scans(monkeypatch):
+    calls = []
+    real_scandir = os.scandir
+
+    def counting_scandir(path):
+        calls.append(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(ast_cache.os, "scandir", counting_scandir)
+    return calls
+
+
+def test_put_does_not_rescan_below_the_limit(tmp_path, monkeypatch):
+    cache = AstCache(str(tmp_path), max_bytes=1 << 20)
+    scans = _scans(monkeypatch)
+    for i in range(100):
+        cache.put(f"key{i}", {"i": i})
+    # one scan to learn the directory size, none afterwards
+    assert len(scans) == 1
+    assert cache.get("key7") == {"i": 7}
+
+
+def test_put_rescans_periodically(tmp_path, monkeypatch):
+    cache = AstCache(str(tmp_path), max_bytes=1 << 20)
+    scans = _scans(monkeypatch)
+    for i in range(ast_cache.RESCAN_EVERY_WRITES + 1):
+        cache.put(f"key{i}", {"i": i})
+    assert len(scans) == 2
+
+
+def test_eviction_keeps_the_directory_under_the_limit(tmp_path):
+    value = {"payload": "x" * 1000}
+    cache = AstCache(str(tmp_path), max_bytes=10_000)
+    for i in range(50):
+        cache.put(f"key{i}", value)
+    total = sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+    assert total <= 10_000
+    assert cache.evictions > 0
+    # the entry just written survives
+    assert cache.get("key49") == value
+
+
+def test_combine_stats_adds_up_processes():
+    stats = combine_stats([{"hits": 3, "misses": 1, "writes": 1, "evictions": 0},
+                           {"hits": 1, "misses": 3, "writes": 3, "evictions": 2}])
+    assert stats == {"hits": 4, "misses": 4, "writes": 4, "evictions": 2, "hitRate": 0.5}
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import Ast_generator
+import batchObfuscation
+
+JOBS = [(f"in{i}.sol", f"out{i}.sol") for i in range(12)]
+
+
+class BrokenPool(Executor):
+    def submit(self, fn, *args, **kwargs):
+        raise BrokenProcessPool("a worker died")
+
+
+@pytest.fixture(autouse=True)
+def no_prefetch(monkeypatch):
+    # the compile stage only forwards files without a cache, no solc is started
+    monkeypatch.setattr(Ast_generator, "get_default_cache", lambda: None)
+
+
+def _run(pool, workers=2, queue_size=1):
+    seen = []
+    records = asyncio.run(asyncio.wait_for(
+        batchObfuscation._run_stages(JOBS, {}, pool, workers, 2, queue_size, seen.append), timeout=10))
+    return records, seen
+
+
+def test_broken_pool_yields_error_records_instead_of_hanging():
+    records, seen = _run(BrokenPool())
+    assert len(records) == len(JOBS) == len(seen)
+    assert {record["status"] for record in records} == {"error"}
+    assert all(record["error"].startswith("BrokenProcessPool") for record in records)
+
+
+def test_every_job_is_transformed_once(monkeypatch):
+    monkeypatch.setattr(batchObfuscation, "obfuscate_file",
+                        lambda input_path, output_path, config_dict: batchObfuscation._new_record(input_path, output_path))
+    with ThreadPoolExecutor(2) as pool:
+        records, _ = _run(pool)
+    assert sorted(record["input"] for record in records) == sorted(path for path, _ in JOBS)
+    assert all(record["status"] == "ok" and record["prefetchSeconds"] == 0.0 for record in records)
+
+
+def _die(input_path, output_path, config_dict):
+    # a worker killed by the OS (OOM, a crash in native code)
+    os._exit(1)
+
+
+def test_dead_worker_yields_error_records_for_every_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(batchObfuscation, "obfuscate_file", _die)
+    for i in range(4):
+        (tmp_path / f"c{i}.sol").write_text("contract C {}\n")
+    output_dir = tmp_path / "out"
+    records = batchObfuscation.obfuscate_directory(str(tmp_path), str(output_dir), {}, workers=2)
+
+    assert len(records) == 4
+    assert {record["status"] for record in records} == {"error"}
+    with open(output_dir / batchObfuscation.STATUS_FILE_NAME, encoding="utf-8") as f:
+        assert sorted(json.loads(line)["input"] for line in f) == sorted(str(tmp_path / f"c{i}.sol") for i in range(4))
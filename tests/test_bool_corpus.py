@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+import Ast_generator
+from SplitBoolean import SplitBooleanVariables
+from conftest import run_without_pragma
+from utilities.bool_corpus import load_bool_corpus, measure_corpus_gas, _raw_entries
+
+
+@pytest.mark.parametrize("max_gas", [0, 5, 16, 30, 100])
+@pytest.mark.parametrize("pure_only", [True, False])
+def test_choose_stays_within_the_budget(max_gas, pure_only):
+    corpus = load_bool_corpus()
+    pure_texts = {entry.text for entry in corpus.expressions[True].entries + corpus.terms[True].entries}
+    rng = random.Random(max_gas)
+    for _ in range(200):
+        clause = corpus.choose(max_gas, pure_only, rng)
+        if clause is None:
+            continue
+        text, gas = clause
+        assert gas <= max_gas
+        if pure_only:
+            assert text in pure_texts or not any(word in text for word in ("block.", "msg.", "tx.", "gasleft"))
+
+
+def test_clauses_over_the_budget_are_never_evaluated():
+    splitter = SplitBooleanVariables("", {}, gas_budget=0)
+    for _ in range(50):
+        before, after = splitter.split_boolean_expression("true")
+        assert before == "(" and after.startswith(" || (")
+    assert splitter.evaluated_gas == 0
+
+
+def test_function_budget_is_shared_by_the_function():
+    function = {"nodeType": "FunctionDefinition", "stateMutability": "view"}
+    splitter = SplitBooleanVariables("", {}, function_gas_budget=40)
+    for _ in range(200):
+        splitter.split_boolean_expression("false", function)
+    assert splitter.function_gas[id(function)] <= 40
+
+
+def test_output_is_well_formed(fixture_source, well_formed, solc_binary):
+    def split(code):
+        return SplitBooleanVariables(code, Ast_generator.compile_ast(code)).apply_boolean_splitting(1.0)
+
+    well_formed(run_without_pragma(split, fixture_source))
+
+
+def test_every_entry_is_measured(solc_binary):
+    measured = measure_corpus_gas()
+    for kind, entry in _raw_entries():
+        assert measured[(kind, entry.text)] >= 0
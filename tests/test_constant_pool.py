@@ -0,0 +1,52 @@
+import re
+
+import pytest
+
+from conftest import run_without_pragma
+from dataflowObfuscation import dataflowObfuscation
+
+SOURCE = """contract Pool {
+    function values() external pure returns (uint256 a, uint256 b, uint256 c, uint256 d) {
+        a = 7;
+        b = 4294967296;
+        c = 340282366920938463463374607431768211455;
+        d = 115792089237316195423570985008687907853269984665640564039457584007913129639935;
+    }
+}
+"""
+
+
+def _decode(code: str, word: str, shift: int, bits: int) -> int:
+    constants = {name: int(value, 16) for name, value in
+                 re.findall(r"uint256 private constant (\w+) = 0x([0-9a-f]{64});", code)}
+    return ((constants[word] ^ constants["dataPoolKey"]) >> shift) & ((1 << bits) - 1)
+
+
+def test_every_access_decodes_to_its_constant():
+    obfuscator = dataflowObfuscation(SOURCE)
+    out = obfuscator.constants_to_dynamic_arrays(SOURCE)
+    assert len(obfuscator.constant_mappings) == 4
+    for value, (word, shift, bits) in obfuscator.constant_mappings.items():
+        assert f"getDynamicValue({word}, {shift}, {bits})" in out
+        assert _decode(out, word, shift, bits) == value
+
+
+def test_narrow_constants_share_a_word():
+    source = "contract Pool {\n    function f() external pure returns (uint256 s) {\n" + \
+             "".join(f"        s += {1000 + i};\n" for i in range(8)) + "    }\n}\n"
+    obfuscator = dataflowObfuscation(source)
+    obfuscator.constants_to_dynamic_arrays(source)
+    assert {word for word, _, _ in obfuscator.constant_mappings.values()} == {"dataPool_0"}
+
+
+def test_output_is_well_formed(fixture_source, well_formed):
+    well_formed(run_without_pragma(lambda code: dataflowObfuscation(code).constants_to_dynamic_arrays(code),
+                                   fixture_source))
+
+
+def test_lookup_gas_does_not_grow_with_the_pool(solc_binary):
+    from utilities.gas_harness import benchmark_constant_pool
+
+    small, large = benchmark_constant_pool((1, 64))
+    assert large["packedGas"] == small["packedGas"]
+    assert large["packedGas"] < large["hashedGas"]
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+import controlflowObfuscation
+import deadcodeObfuscation
+from conftest import function_bodies, run_without_pragma
+from obfuscationPipeline import controlflow_config_from_dict
+from utilities.opaque_predicates import BASELINE, BASELINE_PREDICATE, PREDICATES, TIER_CHOICES
+
+
+def _run(code: str, config) -> str:
+    return controlflowObfuscation.controlflowObfuscation(code).run(config)
+
+
+@pytest.mark.parametrize("tier", TIER_CHOICES)
+def test_output_is_well_formed(fixture_source, well_formed, tier):
+    random.seed(1)
+    config = controlflowObfuscation.controlflowConfig(True, True, True, True, tier)
+    well_formed(run_without_pragma(lambda code: _run(code, config), fixture_source))
+
+
+def test_configuration_without_tier_keeps_the_baseline_helper(fixture_source, config_dict):
+    del config_dict["controlflowConfig"][4:]
+    config = controlflow_config_from_dict(config_dict)
+    assert config.opaque_predicate_tier == BASELINE
+
+    baseline = next(p for p in PREDICATES if p.name == BASELINE_PREDICATE)
+    out = run_without_pragma(lambda code: _run(code, config), fixture_source)
+    if "opaqueTrue()" in out:
+        assert function_bodies(out)["opaqueTrue"].strip("{}").strip() == baseline.body.strip()
+
+
+def test_deadcode_leaves_the_predicate_helpers_alone(fixture_source, monkeypatch):
+    config = controlflowObfuscation.controlflowConfig(False, False, True, False, "cheap")
+    code = run_without_pragma(lambda code: _run(code, config), fixture_source)
+    # every function is chosen for a bogus block
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    out = deadcodeObfuscation.deadcodeObfuscation(code).run(deadcodeObfuscation.deadcodeConfig(True, True))
+
+    bodies = function_bodies(out)
+    for name in ("opaqueTrue", "opaqueTruePure"):
+        if name in bodies:
+            assert "__dcOpaqueFalse" not in bodies[name]
+    user_bodies = [body for name, body in bodies.items() if not name.startswith(("__dc", "opaqueTrue"))]
+    if user_bodies:
+        assert any("__dcOpaqueFalse" in body for body in user_bodies)
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from conftest import run_without_pragma
+from dataflowObfuscation import dataflowObfuscation
+
+
+@pytest.mark.parametrize("step", ["scalar_to_struct", "constants_to_arithmetic"])
+def test_text_pass_output_is_well_formed(fixture_source, well_formed, step):
+    random.seed(11)
+
+    def transform(code):
+        obfuscator = dataflowObfuscation(code)
+        return obfuscator._run_text_pass(getattr(obfuscator, step), code)
+
+    well_formed(run_without_pragma(transform, fixture_source))
+
+
+def test_arithmetic_keeps_the_value():
+    random.seed(11)
+    obfuscator = dataflowObfuscation("")
+    for value in (0, 1, 7, 255, 1000, 123456789):
+        for _ in range(20):
+            # the expressions only use + - * / % << >> on literals, Python integer semantics match for these
+            expression = obfuscator.create_complex_arithmetic(value)
+            assert eval(expression.replace("/", "//")) == value, expression
+
+
+def test_literals_in_inline_assembly_are_kept():
+    code = ("contract A {\n    function f() external pure returns (uint256 r) {\n"
+            "        assembly {\n            r := add(5, 7)\n        }\n        r += 9;\n    }\n}\n")
+    out = dataflowObfuscation(code).constants_to_arithmetic(code)
+    assert "r := add(5, 7)" in out
+    assert "r += 9;" not in out
+
+
+def test_shadowed_state_variables_stay_out_of_the_struct():
+    code = ("contract S {\n    uint256 counter;\n    uint256 total;\n"
+            "    function f() external returns (uint256) {\n        uint256 counter = 10;\n"
+            "        total += counter;\n        return total;\n    }\n}\n")
+    out = dataflowObfuscation(code).scalar_to_struct(code)
+    assert "uint256 counter = 10;" in out
+    assert "dataStruct.total += counter;" in out
+
+
+def test_packing_is_never_worse_than_source_order():
+    fields = [("bool", "a"), ("uint256", "b"), ("uint8", "c"), ("address", "d"),
+              ("uint128", "e"), ("uint64", "f"), ("bool", "g"), ("uint128", "h")]
+    source = list(fields)
+    for seed in range(200):
+        random.seed(seed)
+        packed = dataflowObfuscation._pack_struct_fields(fields)
+        assert fields == source
+        assert sorted(packed) == sorted(source)
+        assert dataflowObfuscation._count_slots(packed) <= dataflowObfuscation._count_slots(source)
+
+
+def test_packing_falls_back_to_source_order(monkeypatch):
+    # a packing that looks worse than the source order must hand back the fields exactly as declared
+    fields = [("uint128", "a"), ("uint128", "b"), ("address", "c")]
+    counts = iter([3, 2])
+    monkeypatch.setattr(dataflowObfuscation, "_count_slots", classmethod(lambda cls, _: next(counts)))
+    random.seed(3)
+    assert dataflowObfuscation._pack_struct_fields(fields) == fields
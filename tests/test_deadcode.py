@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+import deadcodeObfuscation
+from conftest import run_without_pragma
+from utilities.size_budget import SizeBudget
+
+
+def _run(code: str, outline: bool) -> str:
+    config = deadcodeObfuscation.deadcodeConfig(True, True, outline=outline, dead_routines=2)
+    return deadcodeObfuscation.deadcodeObfuscation(code).run(config)
+
+
+def _contract(functions: int) -> str:
+    return "contract Many {\n    uint256 x;\n" + "".join(
+        f"\n    function f{i}(uint256 a) external {{\n        x = a + {i};\n    }}\n" for i in range(functions)) + "}\n"
+
+
+@pytest.fixture
+def every_function(monkeypatch):
+    # every function is chosen for a bogus block
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+
+
+@pytest.mark.parametrize("outline", [False, True])
+def test_output_is_well_formed(fixture_source, well_formed, outline):
+    random.seed(3)
+    well_formed(run_without_pragma(lambda code: _run(code, outline), fixture_source))
+
+
+def test_outlining_never_grows_the_code(every_function, capsys):
+    inlined = 0
+    for seed in range(20):
+        random.seed(seed)
+        out = _run(_contract(1), outline=True)
+        report = capsys.readouterr().out
+        assert "larger" not in report
+        if "inlining the blocks" in report:
+            assert "__dcRoutine" not in out
+            inlined += 1
+        else:
+            assert "runtime bytes smaller than inline blocks" in report
+    # a single call site rarely pays for a routine
+    assert inlined
+
+
+def test_many_call_sites_share_routines(every_function, capsys):
+    out = _run(_contract(12), outline=True)
+    assert out.count("function __dcRoutine") == 2
+    assert out.count("__dcRoutine") > 12
+    assert "runtime bytes smaller than inline blocks" in capsys.readouterr().out
+
+
+class _RoutinesOnlyBudget(SizeBudget):
+    # room for the shared routines but for none of the call sites
+    def allow(self, snippet: str) -> bool:
+        return "function __dcRoutine" in snippet and super().allow(snippet)
+
+
+class _NoRoutinesBudget(SizeBudget):
+    # room for anything except the shared routines
+    def allow(self, snippet: str) -> bool:
+        return "function __dcRoutine" not in snippet and super().allow(snippet)
+
+
+def _with_helper(functions: int):
+    obfuscator = deadcodeObfuscation.deadcodeObfuscation("")
+    return obfuscator, obfuscator._insert_deadcode_helper(_contract(functions))
+
+
+def test_routines_are_not_charged_without_call_sites(every_function):
+    obfuscator, code = _with_helper(12)
+    budget = _RoutinesOnlyBudget(code)
+    assert obfuscator._insert_bogus_blocks_into_functions(code, budget, routines=2) == code
+    assert budget.pending == 0.0
+
+
+def test_routines_over_budget_fall_back_to_inline_blocks(every_function, capsys):
+    obfuscator, code = _with_helper(12)
+    out = obfuscator._insert_bogus_blocks_into_functions(code, _NoRoutinesBudget(code), routines=2)
+    assert "__dcRoutine" not in out
+    assert out.count("__dcOpaqueFalse()") > code.count("__dcOpaqueFalse()")
+    assert "do not fit the size budget" in capsys.readouterr().out
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+import controlflowObfuscation
+from conftest import run_without_pragma
+from utilities.flattening import STATE_VARIABLE, ControlFlowFlattener
+from utilities.lexer import tokenize
+
+GUARDS = """contract Guards {
+    uint256 total;
+
+    function check(uint256 x) external returns (uint256) {
+        uint256 y = 1;
+        if (x == 0)
+            revert("zero");
+        y = x;
+        if (x == 1) return 5;
+        total += y;
+        if (x == 2) {
+            return 6;
+        } else {
+            total += 1;
+        }
+        return y + 1;
+    }
+
+    function opaqueTrue() private pure returns (bool) {
+        uint256 a = 1;
+        a += 2;
+        return a == 3;
+    }
+}
+"""
+
+
+def dispatched_blocks(code: str) -> list:
+    """Token lists of the statements of every block of a chain dispatcher"""
+    tokens = tokenize(code)
+    code_indices = tokens.code_indices()
+    blocks = []
+    for k, i in enumerate(code_indices[:-4]):
+        if not (tokens.is_identifier(i, STATE_VARIABLE) and tokens.is_punct(code_indices[k + 1], "=")
+                and tokens.is_punct(code_indices[k + 2], "=")):
+            continue
+        open_ = code_indices[k + 5]
+        inner = [j for j in code_indices if open_ < j < tokens.match[open_]]
+        blocks.append(ControlFlowFlattener._statements(tokens, inner))
+    return tokens, blocks
+
+
+def assert_blocks_leave(code: str):
+    tokens, blocks = dispatched_blocks(code)
+    assert blocks
+    for statements in blocks:
+        last = statements[-1]
+        assert tokens.token_text(last[0]) in ("return", "revert") or tokens.is_identifier(last[0], STATE_VARIABLE), \
+            " ".join(tokens.token_text(i) for i in last)
+
+
+def test_braceless_guards_keep_their_transition():
+    out = ControlFlowFlattener(16, "chain", random.Random(7)).flatten(GUARDS)
+    assert_blocks_leave(out)
+    _, blocks = dispatched_blocks(out)
+    # five plain statements and the final return, one block per branch and the condition of the if / else
+    assert len(blocks) == 9
+
+
+def test_predicate_helpers_are_not_flattened():
+    flattener = ControlFlowFlattener(16, "chain", random.Random(7))
+    flattener.flatten(GUARDS)
+    assert flattener.flattened == ["check"]
+
+
+@pytest.mark.parametrize("dispatch", ["tree", "chain"])
+def test_output_is_well_formed(fixture_source, well_formed, dispatch):
+    def flatten(code):
+        code = controlflowObfuscation.controlflowObfuscation(code).run(
+            controlflowObfuscation.controlflowConfig(False, False, True, False))
+        return ControlFlowFlattener(16, dispatch, random.Random(3)).flatten(code)
+
+    out = run_without_pragma(flatten, fixture_source)
+    well_formed(out)
+    if dispatch == "chain" and STATE_VARIABLE in out:
+        assert_blocks_leave(out)
+
+
+def test_storage_pointer_behind_a_mapping_type_is_not_flattened():
+    code = """contract Pointers {
+    mapping(address => mapping(uint256 => uint256)) s;
+
+    function run(uint256 a) external returns (uint256) {
+        mapping(uint256 => uint256) storage m = s[msg.sender];
+        if (a > 1) {
+            a += 1;
+        } else {
+            a += 2;
+        }
+        m[a] = 3;
+        return m[a];
+    }
+}
+"""
+    flattener = ControlFlowFlattener(16, "tree", random.Random(7))
+    assert flattener.flatten(code) == code
+    assert "storage" in flattener.skipped["run"]
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+import obfuscationPipeline
+from utilities import gas_harness
+
+TOKEN = """pragma solidity ^0.8.20;
+
+contract Owned {
+    address owner = msg.sender;
+}
+
+contract Token is Owned {
+    mapping(address => uint256) balances;
+    mapping(address => mapping(address => uint256)) allowances;
+
+    constructor() {
+        balances[msg.sender] = 1000;
+    }
+
+    function transfer(address to, uint256 value) external returns (bool) {
+        balances[msg.sender] -= value;
+        balances[to] += value;
+        return true;
+    }
+
+    function approve(address spender, uint256 value) external returns (bool) {
+        allowances[msg.sender][spender] = value;
+        return true;
+    }
+}
+"""
+
+SCENARIO = {"contract": "Token", "calls": [{"function": "transfer", "args": ["account:1", 5]},
+                                           {"function": "approve", "args": ["account:1", 5]}]}
+
+
+def _layout_only(config_dict):
+    config_dict["obfuscationType"] = [{"controlflow": False}, {"dataflow": False}, {"layout": True}, {"deadcode": False}]
+    config_dict["sizeBudget"] = False
+    config_dict["profilePath"] = ""
+    return config_dict
+
+
+def _entry(name):
+    return {"type": "function", "name": name, "stateMutability": "nonpayable",
+            "inputs": [{"type": "address"}, {"type": "uint256"}], "outputs": [{"type": "bool"}]}
+
+
+def test_run_pipeline_reports_its_renames(config_dict):
+    random.seed(2)
+    rename_map = {}
+    out = obfuscationPipeline.run_pipeline(TOKEN, _layout_only(config_dict), rename_map=rename_map)
+    assert {"Owned", "transfer", "approve"} <= set(rename_map)
+    for name, new_name in rename_map.items():
+        assert new_name in out
+
+
+def test_rename_map_round_trip(tmp_path):
+    obfuscated = tmp_path / "Token_obfu.sol"
+    assert gas_harness.load_rename_map(str(obfuscated)) is None
+    gas_harness.save_rename_map(str(obfuscated), {"transfer": "abc"})
+    assert (tmp_path / "Token_obfu.renames.json").is_file()
+    assert gas_harness.load_rename_map(str(obfuscated)) == {"transfer": "abc"}
+
+
+def test_rename_map_tells_same_shaped_functions_apart():
+    original = {"abi": [_entry("transfer"), _entry("approve")]}
+    obfuscated = {"abi": [_entry("xq1"), _entry("zr2")]}
+    with pytest.raises(ValueError):
+        gas_harness.resolve_function(obfuscated, "approve", None, original)
+    entry = gas_harness.resolve_function(obfuscated, "approve", {"transfer": "xq1", "approve": "zr2"}, original)
+    assert entry["name"] == "zr2"
+
+
+def test_rename_map_picks_the_contract_among_several():
+    contracts = {"aa": {"bytecode": "00"}, "bb": {"bytecode": "00"}}
+    assert gas_harness.resolve_contract(contracts, "Token", {"Token": "bb"}) == "bb"
+
+
+def test_compare_through_the_rename_map(config_dict, solc_binary):
+    pytest.importorskip("eth_tester")
+    random.seed(2)
+    rename_map = {}
+    obfuscated = obfuscationPipeline.run_pipeline(TOKEN, _layout_only(config_dict), rename_map=rename_map)
+    comparison = gas_harness.compare(TOKEN, obfuscated, SCENARIO, rename_map)
+    assert comparison["after"]["functions"]["approve"]["resolvedAs"] == rename_map["approve"]
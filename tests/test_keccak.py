@@ -0,0 +1,23 @@
+import pytest
+
+from utilities.keccak import _keccak256_python, keccak256
+from utilities.selector_mining import selector
+
+EMPTY = "c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470"
+
+
+@pytest.mark.parametrize("hash_function", [_keccak256_python, keccak256])
+def test_known_vectors(hash_function):
+    assert hash_function(b"").hex() == EMPTY
+    assert hash_function(b"transfer(address,uint256)")[:4].hex() == "a9059cbb"
+
+
+def test_python_fallback_matches_across_block_boundaries():
+    # 135, 136 and 137 bytes straddle the 136-byte rate, where the padding changes shape
+    for length in (135, 136, 137, 300):
+        data = bytes(range(256))[:length] if length <= 256 else bytes(length)
+        assert _keccak256_python(data) == keccak256(data)
+
+
+def test_selector_of_canonical_signature():
+    assert selector("transfer", ["address", "uint256"]) == 0xa9059cbb
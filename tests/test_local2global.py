@@ -0,0 +1,55 @@
+import pytest
+
+import Ast_generator
+from Local2Global import LocalToGlobalConverter, TRANSIENT_MIN_VERSION, COLD_SLOAD_GAS, STACK_ACCESS_GAS
+from utilities.pragma import minimum_version, parse_version
+
+SOURCE = """contract Counter {
+    uint256 total;
+
+    function add(uint256 amount) external returns (uint256) {
+        uint256 next;
+        next = total + amount;
+        total = next;
+        return next;
+    }
+}
+"""
+
+
+def test_pinned_compiler_accepts_transient_variables():
+    assert parse_version(Ast_generator.SOLC_VERSION) >= TRANSIENT_MIN_VERSION
+
+
+@pytest.mark.parametrize("version, expected", [
+    ("0.8.28", (0, 8, 28)),
+    ("0.8.26+commit.8a97fa7a", (0, 8, 26)),
+    ("v0.8.30", (0, 8, 30)),
+    ("", (0, 0, 0)),
+])
+def test_parse_version(version, expected):
+    assert parse_version(version) == expected
+
+
+def test_minimum_version_of_transient_pragma():
+    assert minimum_version("pragma solidity ^0.8.28;") >= TRANSIENT_MIN_VERSION
+    assert minimum_version("pragma solidity >=0.8.24 <0.9.0;") < TRANSIENT_MIN_VERSION
+
+
+def test_first_storage_write_is_priced_as_zero_to_nonzero(solc_binary):
+    converter = LocalToGlobalConverter(SOURCE, Ast_generator.compile_ast(SOURCE))
+    converter.convert_local_to_global(1)
+    entry, = [entry for entry in converter.gas_report if entry["name"].endswith("next")] or converter.gas_report
+    assert (entry["reads"], entry["writes"]) == (2, 1)
+    # cold SSTORE of a zero slot (22100) for the write, two warm reads, minus three stack accesses
+    assert entry["gasDelta"] == COLD_SLOAD_GAS + 20000 + 2 * 100 - 3 * STACK_ACCESS_GAS
+
+
+@pytest.mark.parametrize("solc_version, transient", [("0.8.28", True), ("0.8.26", False)])
+def test_transient_needs_a_compiler_that_accepts_it(solc_binary, monkeypatch, solc_version, transient):
+    import dataflowObfuscation
+
+    monkeypatch.setattr(dataflowObfuscation, "get_solc_version", lambda: solc_version)
+    dfo = dataflowObfuscation.dataflowObfuscation(SOURCE, "pragma solidity ^0.8.28;")
+    out = dfo.promote_local_to_global(SOURCE, gas_aware=True)
+    assert (" transient " in out) == transient
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+import layoutObfuscation
+from conftest import run_without_pragma
+from utilities import selector_mining
+from utilities.selector_mining import SelectorMiner, leading_zero_bytes, public_signatures, selector
+
+SOURCE = """interface IToken {
+    function transfer(address to, uint256 value) external returns (bool);
+}
+
+contract Base {
+    uint256 public total;
+    mapping(address owner => mapping(uint256 => bool)) public allowed;
+    uint256[] public values;
+
+    function base(uint256 a) external {}
+
+    function base(uint256 a, uint256 b) public {}
+}
+
+contract Child is Base {
+    function run(uint8 x) external returns (uint256) {
+        return x + total;
+    }
+
+    function helper() internal {}
+}
+"""
+
+
+def _config(mine: bool = True) -> layoutObfuscation.layoutConfig:
+    return layoutObfuscation.layoutConfig(False, True, True, True, True, False, mine, 1)
+
+
+def test_public_signatures_cover_overloads_interfaces_and_getters():
+    assert sorted(public_signatures(SOURCE)) == sorted([
+        ("transfer", ["address", "uint256"]),
+        ("total", []),
+        ("allowed", ["address", "uint256"]),
+        ("values", ["uint256"]),
+        ("base", ["uint256"]),
+        ("base", ["uint256", "uint256"]),
+        ("run", ["uint8"]),
+    ])
+
+
+def test_mining_is_serial_by_default(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("the default miner must not start processes")
+
+    monkeypatch.setattr(selector_mining, "ProcessPoolExecutor", no_pool)
+    renames = SelectorMiner(1).mine({"run": ["uint8"]}, {"run": "abc"})
+    assert leading_zero_bytes(selector(renames["run"], ["uint8"])) >= 1
+
+
+def test_reserved_selectors_are_never_mined():
+    first = SelectorMiner(1).mine({"run": ["uint8"]}, {"run": "abc"})["run"]
+    reserved = {selector(first, ["uint8"])}
+    miner = SelectorMiner(1, reserved=reserved)
+    second = miner.mine({"run": ["uint8"]}, {"run": "abc"})["run"]
+    assert second != first and selector(second, ["uint8"]) not in reserved
+
+
+def test_obfuscated_selectors_are_distinct():
+    random.seed(5)
+    out = layoutObfuscation.layoutObfuscation(SOURCE).run(_config())
+    selectors = [selector(name, parameters) for name, parameters in public_signatures(out)]
+    assert len(set(selectors)) == len(selectors)
+    assert "run" not in out
+
+
+def test_output_is_well_formed(fixture_source, well_formed):
+    random.seed(5)
+    well_formed(run_without_pragma(lambda code: layoutObfuscation.layoutObfuscation(code).run(_config()), fixture_source))
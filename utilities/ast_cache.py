@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "solidity-obfuscator", "ast")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SUFFIX = ".json"
+# the directory is rescanned after this many writes of this process, other processes write to it too
+RESCAN_EVERY_WRITES = 256
+# eviction trims down to this share of max_bytes, so the writes right after it do not trigger another scan
+EVICT_LOW_WATER = 0.9
+COUNTERS = ("hits", "misses", "writes", "evictions")
+
+
+class AstCache:
+    """
+    Content-addressed on-disk cache for solc outputs (ASTs and, when requested, bytecode).
+
+    Entries are keyed by (sha256 of the source, solc version, compile settings) and
+    stored one file per key. Writes go through a temporary file and os.replace, so
+    several worker processes can share one directory. The directory is kept under
+    max_bytes by evicting the least recently used entries (hits refresh the mtime).
+    Writes only add to a running size estimate; the directory is scanned when the
+    estimate passes max_bytes or every RESCAN_EVERY_WRITES writes, not on every put.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # directory size at the last scan plus what this process wrote since, None before the first scan
+        self._estimated_bytes = None
+        self._writes_since_scan = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(source: str, solc_version: str, settings: dict) -> str:
+        source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        settings_json = json.dumps(settings, sort_keys=True, separators=(",", ":"))
+        key_material = f"{source_hash}\0{solc_version}\0{settings_json}"
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, key: str):
+        """Return the cached value or None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # missing, or evicted / half-written by another process
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value) -> None:
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp_", suffix=CACHE_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.writes += 1
+        self._writes_since_scan += 1
+        if self._estimated_bytes is not None:
+            self._estimated_bytes += len(data)
+        if self._estimated_bytes is None or self._estimated_bytes > self.max_bytes \
+                or self._writes_since_scan >= RESCAN_EVERY_WRITES:
+            self.evict(keep=self._path(key))
+
+    def evict(self, keep: str = None) -> None:
+        """
+        Scan the directory and, when it exceeds max_bytes, delete least recently used entries
+        until it fits in EVICT_LOW_WATER of it (never the keep path)
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHE_SUFFIX) or entry.name.startswith(".tmp_"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        self._writes_since_scan = 0
+        self._estimated_bytes = total
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * EVICT_LOW_WATER
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._estimated_bytes = total
+
+    def clear(self) -> None:
+        self._estimated_bytes = None
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(CACHE_SUFFIX):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def counters(self) -> dict:
+        return {name: getattr(self, name) for name in COUNTERS}
+
+    def stats(self) -> dict:
+        """Counters of this process only, see combine_stats for batch runs"""
+        return combine_stats([self.counters()])
+
+
+def combine_stats(counters) -> dict:
+    """
+    Sum counters() snapshots (or differences of them) of several processes sharing
+    a cache directory, e.g. the workers of a batch run, and add the overall hit rate
+    """
+    total = dict.fromkeys(COUNTERS, 0)
+    for entry in counters:
+        for name in COUNTERS:
+            total[name] += entry.get(name, 0)
+    lookups = total["hits"] + total["misses"]
+    total["hitRate"] = total["hits"] / lookups if lookups else 0.0
+    return total
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """
+    Process-wide cache configured from the environment:
+    SOLOBF_AST_CACHE=0 disables it, SOLOBF_AST_CACHE_DIR and SOLOBF_AST_CACHE_MAX_MB override the defaults.
+    """
+    global _default_cache
+    if os.environ.get("SOLOBF_AST_CACHE", "1") == "0":
+        return None
+    if _default_cache is None:
+        cache_dir = os.environ.get("SOLOBF_AST_CACHE_DIR", DEFAULT_CACHE_DIR)
+        max_mb = os.environ.get("SOLOBF_AST_CACHE_MAX_MB")
+        max_bytes = int(float(max_mb) * 1024 * 1024) if max_mb else DEFAULT_MAX_BYTES
+        _default_cache = AstCache(cache_dir, max_bytes)
+    return _default_cache
@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+from utilities.range_index import RangeIndex
+
+FUNCTION_NODE_TYPES = ("FunctionDefinition", "ModifierDefinition")
+CONTRACT_NODE_TYPES = ("ContractDefinition",)
+# constructs a local variable can sit in that change how it may be rewritten
+ENCLOSING_CONSTRUCT_TYPES = ("FunctionDefinition", "ModifierDefinition", "InlineAssembly", "UncheckedBlock")
+LOOP_NODE_TYPES = ("ForStatement", "WhileStatement", "DoWhileStatement")
+
+
+def src_to_position(src_str):
+    """Convert a solc src string "start:length:file" to [start, end]"""
+    parts = src_str.split(":")
+    start = int(parts[0])
+    return [start, start + int(parts[1])]
+
+
+class AstIndex:
+    """
+    Index over a solc (compact JSON) AST, built in a single traversal.
+
+    Exposes nodes by id and by nodeType, parent links, the enclosing function /
+    modifier and contract of every node, and an inverted index from
+    referencedDeclaration to the nodes that reference it. Nodes are kept in
+    source (pre-)order.
+    """
+
+    def __init__(self, ast):
+        self.ast = ast
+        self.nodes = []
+        self.by_id = {}
+        self.by_type = defaultdict(list)
+        self.references = defaultdict(list)
+        # keyed by id() of the node dict, not every indexed dict is guaranteed to carry an AST id
+        self._parent = {}
+        self._function = {}
+        self._contract = {}
+        self._build()
+
+    def _build(self):
+        # (value, nearest indexed ancestor, enclosing function, enclosing contract)
+        stack = [(self.ast, None, None, None)]
+        while stack:
+            value, parent, function, contract = stack.pop()
+
+            if isinstance(value, list):
+                for item in reversed(value):
+                    if isinstance(item, (dict, list)):
+                        stack.append((item, parent, function, contract))
+                continue
+
+            node_type = value.get("nodeType")
+            if node_type is not None:
+                key = id(value)
+                self.nodes.append(value)
+                self.by_type[node_type].append(value)
+                if "id" in value:
+                    self.by_id[value["id"]] = value
+                if "referencedDeclaration" in value:
+                    self.references[value["referencedDeclaration"]].append(value)
+                self._parent[key] = parent
+                self._function[key] = function
+                self._contract[key] = contract
+
+                parent = value
+                if node_type in FUNCTION_NODE_TYPES:
+                    function = value
+                elif node_type in CONTRACT_NODE_TYPES:
+                    contract = value
+
+            for child in reversed(list(value.values())):
+                if isinstance(child, (dict, list)):
+                    stack.append((child, parent, function, contract))
+
+    def node(self, node_id):
+        return self.by_id.get(node_id)
+
+    def of_type(self, node_type):
+        return self.by_type.get(node_type, [])
+
+    def find(self, key, value):
+        """All indexed nodes where node[key] == value (uses the type index for nodeType)"""
+        if key == "nodeType":
+            return list(self.of_type(value))
+        return [node for node in self.nodes if node.get(key) == value]
+
+    def parent(self, node):
+        return self._parent.get(id(node))
+
+    def ancestors(self, node):
+        current = self.parent(node)
+        while current is not None:
+            yield current
+            current = self.parent(current)
+
+    def has_ancestor_of_type(self, node, node_types, stop_types=FUNCTION_NODE_TYPES):
+        """True if an ancestor of one of node_types appears before reaching one of stop_types"""
+        for ancestor in self.ancestors(node):
+            ancestor_type = ancestor.get("nodeType")
+            if ancestor_type in node_types:
+                return True
+            if ancestor_type in stop_types:
+                return False
+        return False
+
+    def enclosing_function(self, node):
+        """Closest FunctionDefinition / ModifierDefinition containing node"""
+        return self._function.get(id(node))
+
+    def enclosing_contract(self, node):
+        return self._contract.get(id(node))
+
+    def span_index(self, node_types, predicate=None):
+        """RangeIndex over the src spans of the nodes of the given types (optionally filtered)"""
+        items = []
+        for node_type in node_types:
+            for node in self.of_type(node_type):
+                if predicate is None or predicate(node):
+                    start, end = src_to_position(node["src"])
+                    items.append((start, end, node))
+        return RangeIndex(items)
+
+    def references_to(self, declaration_id, node_type=None):
+        refs = self.references.get(declaration_id, [])
+        if node_type is None:
+            return list(refs)
+        return [ref for ref in refs if ref.get("nodeType") == node_type]
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import random
+import sys
+from bisect import bisect_right
+from functools import lru_cache
+
+import Ast_generator
+from utilities import gas_harness
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bool_corpus.json")
+MUTABILITIES = ("pure", "view")
+# a random integer literal term, and the comparison joining two terms
+INTEGER_LITERAL_GAS = 3
+COMPARISON_GAS = 10
+COMPARISON_OPERATORS = ("==", "!=", ">", "<", ">=", "<=")
+
+PROBE_PRAGMA = "pragma solidity ^0.8.20;"
+
+
+class BoolEntry:
+    """
+    One corpus expression (a boolean clause or an integer comparison term).
+
+    gas is the execution gas of evaluating the text once (solc 0.8, optimizer off). The shipped
+    numbers are estimates counted from the opcodes; measure_corpus_gas() measures them as the
+    difference to returning a literal.
+    Pure entries only use literals, so they also fit pure functions, modifiers and
+    state variable initializers; view entries read the environment.
+    """
+
+    def __init__(self, text: str, gas: int, mutability: str):
+        self.text = text
+        self.gas = gas
+        self.mutability = mutability
+
+    @property
+    def is_pure(self) -> bool:
+        return self.mutability == "pure"
+
+
+class _GasIndex:
+    """Entries sorted by gas, so the ones within a budget are a prefix"""
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: entry.gas)
+        self.gas = [entry.gas for entry in self.entries]
+
+    def within(self, max_gas=None) -> list:
+        if max_gas is None:
+            return self.entries
+        return self.entries[:bisect_right(self.gas, max_gas)]
+
+
+class BoolCorpus:
+    """
+    Validated boolean corpus, indexed by gas for pure-only and unrestricted contexts.
+
+    choose() returns a clause and its gas: either a corpus expression or a comparison
+    of two terms (corpus terms or integer literals), optionally within a gas budget.
+    """
+
+    def __init__(self, expressions: list, terms: list):
+        self.expressions = {True: _GasIndex(e for e in expressions if e.is_pure), False: _GasIndex(expressions)}
+        self.terms = {True: _GasIndex(t for t in terms if t.is_pure), False: _GasIndex(terms)}
+
+    def _comparison(self, max_gas, pure_only, rng):
+        # the right term needs room for at least an integer literal
+        left_budget = None if max_gas is None else max_gas - COMPARISON_GAS - INTEGER_LITERAL_GAS
+        if left_budget is not None and left_budget < INTEGER_LITERAL_GAS:
+            return None
+        left_text, left_gas = self._term(left_budget, pure_only, rng)
+        right_budget = None if max_gas is None else max_gas - COMPARISON_GAS - left_gas
+        right_text, right_gas = self._term(right_budget, pure_only, rng)
+        operator = rng.choice(COMPARISON_OPERATORS)
+        return f"{left_text} {operator} {right_text}", left_gas + right_gas + COMPARISON_GAS
+
+    def _term(self, max_gas, pure_only, rng):
+        candidates = self.terms[pure_only].within(max_gas)
+        # integer literals always fit, they keep a share of the draws
+        if not candidates or rng.random() < 1 / (len(candidates) + 1):
+            return str(rng.randint(1, 1000)), INTEGER_LITERAL_GAS
+        term = rng.choice(candidates)
+        return term.text, term.gas
+
+    def choose(self, max_gas=None, pure_only=False, rng=random):
+        """(text, gas) of a random clause costing at most max_gas, None if nothing fits"""
+        expressions = self.expressions[pure_only].within(max_gas)
+        if not expressions or rng.random() < 0.5:
+            comparison = self._comparison(max_gas, pure_only, rng)
+            if comparison is not None:
+                return comparison
+        if not expressions:
+            return None
+        expression = rng.choice(expressions)
+        return expression.text, expression.gas
+
+
+def _entries(corpus: dict, key: str, path: str) -> list:
+    entries = []
+    for i, item in enumerate(corpus.get(key, [])):
+        where = f"{path}: {key}[{i}]"
+        if not isinstance(item, dict) or not isinstance(item.get("text"), str) or not item["text"].strip():
+            raise ValueError(f"{where} needs a non-empty \"text\"")
+        gas = item.get("gas")
+        if not isinstance(gas, int) or isinstance(gas, bool) or gas < 0:
+            raise ValueError(f"{where} needs a non-negative integer \"gas\", got {gas!r}")
+        mutability = item.get("mutability", "view")
+        if mutability not in MUTABILITIES:
+            raise ValueError(f"{where} has mutability {mutability!r}, expected one of {', '.join(MUTABILITIES)}")
+        entries.append(BoolEntry(item["text"], gas, mutability))
+    return entries
+
+
+@lru_cache(maxsize=None)
+def load_bool_corpus(path: str = CORPUS_PATH) -> BoolCorpus:
+    """Load, validate and index the corpus once per path"""
+    with open(path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    expressions = _entries(corpus, "boolExpressions", path)
+    if not expressions:
+        raise ValueError(f"{path}: boolExpressions is empty")
+    return BoolCorpus(expressions, _entries(corpus, "comparisonTerms", path))
+
+
+def _raw_entries(path: str = CORPUS_PATH) -> list:
+    corpus = load_bool_corpus(path)
+    return [("expression", e) for e in corpus.expressions[False].entries] + \
+           [("term", t) for t in corpus.terms[False].entries]
+
+
+def build_probe_contract(entries: list) -> str:
+    """One contract evaluating every entry from its own external function, plus a literal baseline"""
+    parts = [PROBE_PRAGMA, "\ncontract BoolCorpusProbe {\n"]
+    parts.append("\n    function baseline() external view returns (bool) {\n        return true;\n    }\n")
+    for i, (kind, entry) in enumerate(entries):
+        # a term is compared with a literal, which the baseline comparison below subtracts
+        expression = entry.text if kind == "expression" else f"{entry.text} != 0"
+        parts.append(f"\n    function run{i}() external view returns (bool) {{\n        return {expression};\n    }}\n")
+    parts.append("\n    function literalComparison() external view returns (bool) {\n"
+                 "        return block.number != 0;\n    }\n")
+    parts.append("}\n")
+    return "".join(parts)
+
+
+def measure_corpus_gas(path: str = CORPUS_PATH) -> dict:
+    """Gas of every corpus entry, as the difference to returning a literal"""
+    entries = _raw_entries(path)
+    scenario = {
+        "contract": "BoolCorpusProbe",
+        "calls": [{"function": "baseline"}, {"function": "literalComparison"}] +
+                 [{"function": f"run{i}"} for i in range(len(entries))],
+    }
+    measured = gas_harness.measure(build_probe_contract(entries), scenario)["functions"]
+    baseline = measured["baseline"]["avgGas"]
+    # "block.number != 0" minus the 2 gas NUMBER leaves the cost of comparing a term with a literal
+    comparison = measured["literalComparison"]["avgGas"] - baseline - 2
+    result = {}
+    for i, (kind, entry) in enumerate(entries):
+        gas = measured[f"run{i}"]["avgGas"] - baseline
+        result[(kind, entry.text)] = gas - comparison if kind == "term" else gas
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the gas of every boolean corpus entry against its estimated cost")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="corpus file (default: bool_corpus.json)")
+    parser.add_argument("--solc", default=None, help="path to the solc binary")
+    args = parser.parse_args(argv)
+
+    Ast_generator.set_solc_binary(args.solc)
+    measured = measure_corpus_gas(args.corpus)
+    print(f"{'kind':<12}{'estimate':>10}{'measured':>10}  text")
+    for kind, entry in _raw_entries(args.corpus):
+        print(f"{kind:<12}{entry.gas:>10}{measured[(kind, entry.text)]:>10.0f}  {entry.text}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
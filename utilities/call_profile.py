@@ -0,0 +1,126 @@
+import argparse
+import json
+import sys
+from bisect import bisect_right
+
+import Ast_generator
+from utilities import gas_harness
+from utilities.lexer import IDENTIFIER
+
+# hot functions are the most expensive ones that together account for this share of the profiled gas
+DEFAULT_HOT_GAS_SHARE = 0.8
+
+
+def record_profile(code: str, scenario: dict) -> dict:
+    """
+    Replay scenario against code (pragma included) in the in-process EVM and record,
+    per Solidity function name, the number of calls and the gas they used.
+    Overloads share a name in the source, so they share an entry.
+    """
+    measured = gas_harness.measure(code, scenario)
+    functions = {}
+    for stats in measured["functions"].values():
+        entry = functions.setdefault(stats["resolvedAs"], {"calls": 0, "reverted": 0, "totalGas": 0})
+        entry["calls"] += len(stats["gas"]) + stats["reverted"]
+        entry["reverted"] += stats["reverted"]
+        entry["totalGas"] += sum(stats["gas"])
+    for entry in functions.values():
+        succeeded = entry["calls"] - entry["reverted"]
+        entry["avgGas"] = entry["totalGas"] / succeeded if succeeded else None
+    return {"contract": measured["contract"], "functions": functions}
+
+
+def save_profile(profile: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def load_profile(path: str) -> dict:
+    """
+    A profile is a JSON file written by record_profile / this module's CLI:
+    {
+        "contract": "Token",
+        "functions": {"transfer": {"calls": 120, "reverted": 0, "totalGas": 4100000, "avgGas": 34166.7}}
+    }
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def hot_functions(profile: dict, hot_gas_share: float = DEFAULT_HOT_GAS_SHARE) -> tuple:
+    """
+    Names of the fewest functions that together used hot_gas_share of the profiled gas,
+    most expensive first; functions missing from the profile were never called and are cold
+    """
+    functions = sorted(profile.get("functions", {}).items(), key=lambda item: item[1]["totalGas"], reverse=True)
+    total = sum(entry["totalGas"] for _, entry in functions)
+    hot = []
+    covered = 0
+    for name, entry in functions:
+        if total == 0 or covered >= total * hot_gas_share:
+            break
+        hot.append(name)
+        covered += entry["totalGas"]
+    return tuple(hot)
+
+
+def function_body_context(tokens, names):
+    """Function telling whether a token index lies in the body of a function whose name is in names"""
+    code_indices = tokens.code_indices()
+    bodies = []
+    for k, i in enumerate(code_indices[:-1]):
+        if not tokens.is_identifier(i, "function"):
+            continue
+        name_index = code_indices[k + 1]
+        if tokens.kinds[name_index] != IDENTIFIER or tokens.token_text(name_index) not in names:
+            continue
+        # the header runs up to the body's "{", or to ";" for a declaration without body
+        for m in range(k + 2, len(code_indices)):
+            j = code_indices[m]
+            if tokens.is_punct(j, ";"):
+                break
+            if tokens.is_punct(j, "{"):
+                if tokens.match[j] != -1:
+                    bodies.append((j, tokens.match[j]))
+                break
+    opens = [open_ for open_, _ in bodies]
+
+    def contains(index: int) -> bool:
+        k = bisect_right(opens, index) - 1
+        return k >= 0 and index < bodies[k][1]
+
+    return contains
+
+
+def format_profile(profile: dict, hot: tuple) -> str:
+    lines = [f"{'function':<30}{'calls':>8}{'reverted':>10}{'total gas':>14}{'avg gas':>12}  hot"]
+    functions = sorted(profile["functions"].items(), key=lambda item: item[1]["totalGas"], reverse=True)
+    for name, entry in functions:
+        average = f"{entry['avgGas']:.0f}" if entry["avgGas"] is not None else "-"
+        lines.append(f"{name:<30}{entry['calls']:>8}{entry['reverted']:>10}{entry['totalGas']:>14}{average:>12}"
+                     f"  {'yes' if name in hot else ''}".rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record a per-function call/gas profile by replaying a call scenario")
+    parser.add_argument("input", help="Solidity file (the original, unobfuscated contract)")
+    parser.add_argument("scenario", help="scenario JSON file with the recorded calls (see utilities.gas_harness)")
+    parser.add_argument("-o", "--output", default=None, help="where to write the profile (set profilePath in the config to use it)")
+    parser.add_argument("--hot-gas-share", type=float, default=DEFAULT_HOT_GAS_SHARE,
+                        help="share of the profiled gas that makes up the hot functions, for the printed report")
+    parser.add_argument("--solc", default=None, help="path to the solc binary")
+    args = parser.parse_args(argv)
+
+    Ast_generator.set_solc_binary(args.solc)
+    with open(args.input, "r", encoding="utf-8") as f:
+        code = f.read()
+    profile = record_profile(code, gas_harness.load_scenario(args.scenario))
+    if args.output:
+        save_profile(profile, args.output)
+    print(format_profile(profile, hot_functions(profile, args.hot_gas_share)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
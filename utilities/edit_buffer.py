@@ -0,0 +1,180 @@
+from bisect import bisect_left, bisect_right
+
+
+class EditConflictError(ValueError):
+    """Raised when two submitted edits touch overlapping spans"""
+
+
+class OffsetMap:
+    """
+    Maps positions of the text an EditBuffer was built on to positions in the
+    edited text. Positions inside a replaced span have no image and map to None,
+    unless the span's text was copied elsewhere by an edit that declared its origin.
+    """
+
+    def __init__(self, edits):
+        # edits: sorted (start, end, replacement_length, origin) over the original text
+        self._ends = []
+        self._shift_after = []          # cumulative shift once an edit ending here is passed
+        self._replaced_starts = []
+        self._replaced_ends = []
+        copies = []
+        shift = 0
+        for start, end, length, origin in edits:
+            if origin is not None:
+                # (origin start, origin end, where the copy starts in the edited text)
+                copies.append((origin, origin + length, start + shift))
+            shift += length - (end - start)
+            self._ends.append(end)
+            self._shift_after.append(shift)
+            if end > start:
+                self._replaced_starts.append(start)
+                self._replaced_ends.append(end)
+        self._is_insert = [edit[0] == edit[1] for edit in edits]
+        copies.sort()
+        self._copy_starts = [copy[0] for copy in copies]
+        self._copies = copies
+        self.total_shift = shift
+
+    def _inside_replacement(self, pos):
+        i = bisect_right(self._replaced_starts, pos) - 1
+        return i >= 0 and self._replaced_starts[i] < pos < self._replaced_ends[i]
+
+    def shift_at(self, pos, side="start"):
+        """Offset added to an original position (see map_position for side)"""
+        if side == "start":
+            # every edit ending at or before pos, including insertions made right at pos
+            i = bisect_right(self._ends, pos)
+        else:
+            # an exclusive end does not move for insertions made right at it
+            i = bisect_left(self._ends, pos)
+            while i < len(self._ends) and self._ends[i] == pos and not self._is_insert[i]:
+                i += 1
+        return self._shift_after[i - 1] if i > 0 else 0
+
+    def _copied_position(self, pos, side):
+        i = bisect_right(self._copy_starts, pos) - 1
+        while i >= 0:
+            origin_start, origin_end, new_start = self._copies[i]
+            if pos < origin_end or (side == "end" and pos == origin_end):
+                return new_start + (pos - origin_start)
+            i -= 1
+        return None
+
+    def map_position(self, pos, side="start"):
+        """
+        Translate an original position. side="start" treats pos as the first
+        character of a span, side="end" as an exclusive span end.
+        Returns None when pos falls strictly inside a replaced span whose text was not copied.
+        """
+        if self._inside_replacement(pos):
+            return self._copied_position(pos, side)
+        return pos + self.shift_at(pos, side)
+
+    def map_span(self, start, end):
+        """Translate [start, end); None if either boundary was rewritten"""
+        new_start = self.map_position(start, "start")
+        new_end = self.map_position(end, "end")
+        if new_start is None or new_end is None:
+            return None
+        return new_start, new_end
+
+    def then(self, other):
+        """Map through self and then through other"""
+        return ChainedOffsetMap([self, other])
+
+
+class ChainedOffsetMap:
+    """Composition of consecutive offset maps (first map applied first)"""
+
+    def __init__(self, maps):
+        self.maps = []
+        for offset_map in maps:
+            if isinstance(offset_map, ChainedOffsetMap):
+                self.maps.extend(offset_map.maps)
+            else:
+                self.maps.append(offset_map)
+
+    def map_position(self, pos, side="start"):
+        for offset_map in self.maps:
+            if pos is None:
+                return None
+            pos = offset_map.map_position(pos, side)
+        return pos
+
+    def map_span(self, start, end):
+        new_start = self.map_position(start, "start")
+        new_end = self.map_position(end, "end")
+        if new_start is None or new_end is None:
+            return None
+        return new_start, new_end
+
+    def then(self, other):
+        return ChainedOffsetMap([self, other])
+
+
+def compose_offset_maps(*maps):
+    """Chain maps left to right; None (an edit that could not be described) poisons the result"""
+    if any(offset_map is None for offset_map in maps):
+        return None
+    return ChainedOffsetMap(maps)
+
+
+class EditBuffer:
+    """
+    Collects (start, end, replacement) edits against one text and materializes
+    them in a single O(n + edits) join. All positions refer to the original
+    text, so passes never have to track the shift caused by earlier edits.
+    Insertions at the same position keep their submission order. An edit whose
+    replacement is a verbatim copy of original text can say so with origin, so
+    positions inside the copied text stay mappable even if the source is removed.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._edits = []
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._edits)
+
+    def replace(self, start: int, end: int, replacement: str, origin: int = None) -> None:
+        if not 0 <= start <= end <= len(self.text):
+            raise ValueError(f"Edit span [{start}, {end}) outside text of length {len(self.text)}")
+        if origin is not None and self.text[origin:origin + len(replacement)] != replacement:
+            raise ValueError(f"Replacement is not a copy of the text at origin {origin}")
+        self._edits.append((start, end, len(self._edits), replacement, origin))
+        self._sorted = None
+
+    def insert(self, pos: int, text: str, origin: int = None) -> None:
+        self.replace(pos, pos, text, origin)
+
+    def delete(self, start: int, end: int) -> None:
+        self.replace(start, end, "")
+
+    def _sorted_edits(self):
+        if self._sorted is not None:
+            return self._sorted
+        edits = sorted(self._edits)
+        last_end = -1
+        for start, end, seq, replacement, origin in edits:
+            # insertions may touch a neighbour's boundary, replaced characters may not be shared
+            if start < last_end:
+                raise EditConflictError(f"Edit [{start}, {end}) overlaps an earlier edit ending at {last_end}")
+            last_end = max(last_end, end)
+        self._sorted = edits
+        return edits
+
+    def apply(self) -> str:
+        pieces = []
+        cursor = 0
+        for start, end, seq, replacement, origin in self._sorted_edits():
+            pieces.append(self.text[cursor:start])
+            pieces.append(replacement)
+            cursor = end
+        pieces.append(self.text[cursor:])
+        return "".join(pieces)
+
+    def offset_map(self) -> OffsetMap:
+        return OffsetMap([(start, end, len(replacement), origin)
+                          for start, end, seq, replacement, origin in self._sorted_edits()])
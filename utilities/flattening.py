@@ -0,0 +1,372 @@
+import random
+
+from utilities.edit_buffer import EditBuffer
+from utilities.lexer import IDENTIFIER, tokenize
+from utilities.opaque_predicates import is_predicate_helper
+
+STATE_VARIABLE = "__cfState"
+DEFAULT_MAX_BLOCKS = 8
+# "tree" dispatches in ceil(log2(blocks)) comparisons, "chain" is the if / else-if chain kept for benchmarks
+DISPATCH_MODES = ("tree", "chain")
+
+# statements that own a body and may continue with else / catch / while
+_COMPOUND_KEYWORDS = {"if", "for", "while", "do", "unchecked", "assembly", "try"}
+# first words of statements that are never declarations
+_STATEMENT_KEYWORDS = _COMPOUND_KEYWORDS | {"return", "emit", "delete", "revert", "throw", "else", "break",
+                                            "continue", "new", "require", "assert", "_"}
+# a hoisted declaration would be an uninitialized pointer, which solc rejects
+_POINTER_LOCATIONS = {"storage", "calldata"}
+# words that only appear in the type of a declaration, whatever brackets the type holds
+_TYPE_WORDS = {"mapping", "function", "memory"} | _POINTER_LOCATIONS
+# a block whose last statement starts with one of these leaves the function and needs no transition
+_TERMINATORS = {"return", "revert"}
+
+
+def _block_count(items) -> int:
+    """An if item takes a condition block and one block per branch"""
+    return sum(1 if item[0] == "plain" else 2 + (item[3] is not None) for item in items)
+
+
+def _successor_setter(target: list, slot: int):
+    def follow(state: int):
+        target[slot] = state
+    return follow
+
+
+class _Unflattenable(Exception):
+    """The function uses a construct the flattener does not rewrite"""
+
+
+class ControlFlowFlattener:
+    """
+    Flattens the top level of a function body into basic blocks driven by a state variable.
+
+    Every top-level statement starts as its own block, "if (c) { ... } else { ... }"
+    becomes a condition block and one block per branch; branch bodies, loops and other
+    compound statements stay whole inside their block. Declarations are hoisted above
+    the loop (their initializer stays in its block) so later blocks still see them.
+    The blocks get a random permutation of 0..n-1 as state numbers and are dispatched by
+    a balanced tree of "<" comparisons. Adjacent plain blocks are merged until the count
+    fits max_blocks; a function that still has more blocks is left alone.
+    """
+
+    def __init__(self, max_blocks: int = DEFAULT_MAX_BLOCKS, dispatch: str = "tree", rng=random):
+        if dispatch not in DISPATCH_MODES:
+            raise ValueError(f"Unknown dispatch {dispatch!r}, expected one of {', '.join(DISPATCH_MODES)}")
+        self.max_blocks = max_blocks
+        self.dispatch = dispatch
+        self.rng = rng
+        self.flattened = []
+        self.skipped = {}
+
+    @staticmethod
+    def function_bodies(tokens):
+        """(name, "{" index, "}" index) of every named function with a body"""
+        code_indices = tokens.code_indices()
+        bodies = []
+        for k, i in enumerate(code_indices[:-1]):
+            if not tokens.is_identifier(i, "function") or tokens.kinds[code_indices[k + 1]] != IDENTIFIER:
+                continue
+            for m in range(k + 2, len(code_indices)):
+                j = code_indices[m]
+                if tokens.is_punct(j, ";"):
+                    break
+                if tokens.is_punct(j, "{"):
+                    if tokens.match[j] != -1:
+                        bodies.append((tokens.token_text(code_indices[k + 1]), j, tokens.match[j]))
+                    break
+        return bodies
+
+    def flatten(self, code: str, names=(), skip=(), allow=None) -> str:
+        """
+        Flatten the functions named in names (every function when empty), except those in skip
+        and the opaque predicate helpers, which every guarded if calls.
+        allow(snippet) may veto the dispatcher code added to a function, e.g. SizeBudget.allow.
+        """
+        tokens = tokenize(code)
+        edits = EditBuffer(code)
+        for name, open_brace, close_brace in self.function_bodies(tokens):
+            if (names and name not in names) or name in skip or is_predicate_helper(name):
+                continue
+            try:
+                items, hoisted = self._blocks(tokens, open_brace, close_brace)
+            except _Unflattenable as e:
+                self.skipped[name] = str(e)
+                continue
+            count = _block_count(items)
+            states = self.rng.sample(range(count), count)
+            # the size budget pays for the dispatcher only, the statements were there before
+            scaffold = [["plain", "", False] if item[0] == "plain" else
+                        ["if", "", "", "" if item[3] is not None else None, False, False] for item in items]
+            if allow is not None and not allow(self._emit(scaffold, hoisted, states)):
+                self.skipped[name] = "size budget"
+                continue
+            body = self._emit(items, hoisted, states)
+            edits.replace(tokens.ends[open_brace], tokens.starts[close_brace], body)
+            self.flattened.append(name)
+        return edits.apply()
+
+    #  Statements
+    @staticmethod
+    def _statements(tokens, code_indices):
+        """Split the code tokens of a body into top-level statements, as lists of token indices"""
+        statements = []
+        position = {i: k for k, i in enumerate(code_indices)}
+        k = 0
+        while k < len(code_indices):
+            start = k
+            first = tokens.token_text(code_indices[k])
+            saw_do_while = False
+            while True:
+                if k >= len(code_indices):
+                    raise _Unflattenable("unterminated statement")
+                i = code_indices[k]
+                if tokens.match[i] != -1 and tokens.token_text(i) in "([{":
+                    if tokens.match[i] not in position:
+                        raise _Unflattenable("unbalanced brackets")
+                    k = position[tokens.match[i]] + 1
+                    if tokens.token_text(i) != "{" or (first not in _COMPOUND_KEYWORDS and first != "{"):
+                        continue
+                    following = tokens.token_text(code_indices[k]) if k < len(code_indices) else ""
+                    if following in ("else", "catch") or (first == "do" and following == "while"):
+                        saw_do_while = saw_do_while or following == "while"
+                        continue
+                    break
+                k += 1
+                if tokens.is_punct(i, ";"):
+                    following = tokens.token_text(code_indices[k]) if k < len(code_indices) else ""
+                    if (first == "if" and following == "else") or (first == "do" and following == "while" and not saw_do_while):
+                        saw_do_while = saw_do_while or following == "while"
+                        continue
+                    break
+            statements.append(code_indices[start:k])
+        return statements
+
+    @staticmethod
+    def _if_else(tokens, statement):
+        """(condition end, then "{", else "{" or None) when statement is "if (c) { } [else { }]" """
+        if tokens.token_text(statement[0]) != "if" or len(statement) < 2 or not tokens.is_punct(statement[1], "("):
+            return None
+        close_paren = tokens.match[statement[1]]
+        rest = statement[statement.index(close_paren) + 1:]
+        if not rest or not tokens.is_punct(rest[0], "{"):
+            return None
+        then_close = rest.index(tokens.match[rest[0]])
+        tail = rest[then_close + 1:]
+        if not tail:
+            return close_paren, rest[0], None
+        if len(tail) >= 2 and tokens.is_identifier(tail[0], "else") and tokens.is_punct(tail[1], "{") \
+                and tail[-1] == tokens.match[tail[1]]:
+            return close_paren, rest[0], tail[1]
+        return None
+
+    @staticmethod
+    def _declaration(tokens, statement):
+        """
+        (hoisted declarations, names, assignment or None) for a local variable declaration
+        statement, None for any other statement
+        """
+        text = tokens.text
+        if tokens.token_text(statement[0]) in _STATEMENT_KEYWORDS:
+            return None
+        assign = next((n for n, i in enumerate(statement) if tokens.is_punct(i, "=")
+                       and not tokens.is_punct(statement[n - 1], "=") and tokens.token_text(statement[n - 1]) not in "!<>+-*/%&|^"
+                       and not (n + 1 < len(statement) and (tokens.is_punct(statement[n + 1], "=")
+                                                            or tokens.is_punct(statement[n + 1], ">")))), None)
+        target = statement[:assign] if assign is not None else statement[:-1]
+        initializer = text[tokens.starts[statement[assign]]:tokens.ends[statement[-1]]] if assign is not None else None
+
+        if tokens.is_punct(target[0], "(") and tokens.match[target[0]] == target[-1]:
+            # (uint a, , bool c) = f();
+            components, current = [], []
+            depth = 0
+            for i in target[1:-1]:
+                ch = tokens.token_text(i)
+                if ch == "," and depth == 0:
+                    components.append(current)
+                    current = []
+                    continue
+                depth += ch in "([" and tokens.kinds[i] != IDENTIFIER
+                depth -= ch in ")]" and tokens.kinds[i] != IDENTIFIER
+                current.append(i)
+            components.append(current)
+            if not any(len(component) >= 2 for component in components):
+                return None
+            hoisted, names, parts = [], [], []
+            for component in components:
+                if not component:
+                    parts.append("")
+                    continue
+                if len(component) < 2 or tokens.kinds[component[-1]] != IDENTIFIER:
+                    raise _Unflattenable("mixed tuple declaration")
+                names.append(tokens.token_text(component[-1]))
+                hoisted.append(component)
+                parts.append(names[-1])
+            return hoisted, names, f"({', '.join(parts)}) {initializer}"
+
+        if len(target) < 2 or tokens.kinds[target[-1]] != IDENTIFIER:
+            return None
+        name = tokens.token_text(target[-1])
+        if any(tokens.kinds[i] == IDENTIFIER and tokens.token_text(i) in _TYPE_WORDS for i in target[:-1]):
+            # mapping(...) storage m, function (uint) external f: the caller rejects pointer locations
+            return [target], [name], f"{name} {initializer}" if initializer is not None else None
+        before = target[-2]
+        if tokens.kinds[before] != IDENTIFIER and not tokens.is_punct(before, "]"):
+            return None
+        if any(tokens.kinds[i] not in (IDENTIFIER,) and tokens.token_text(i) not in ".[]" and not tokens.token_text(i).isdigit()
+               for i in target):
+            return None
+        return [target], [name], f"{name} {initializer}" if initializer is not None else None
+
+    @staticmethod
+    def _terminates(tokens, statements) -> bool:
+        """True when the last of statements is an unconditional return or revert"""
+        return bool(statements) and tokens.token_text(statements[-1][0]) in _TERMINATORS
+
+    #  Blocks
+    def _blocks(self, tokens, open_brace, close_brace):
+        """(items, hoisted declarations) of a function body, items being its blocks before state numbering"""
+        text = tokens.text
+        code_indices = [i for i in tokens.code_indices() if open_brace < i < close_brace]
+        if any(tokens.is_identifier(i, STATE_VARIABLE) for i in code_indices):
+            raise _Unflattenable("already flattened")
+
+        def span(first, last):
+            return text[tokens.starts[first]:tokens.ends[last]]
+
+        def body_terminates(open_):
+            inner = [i for i in code_indices if open_ < i < tokens.match[open_]]
+            return self._terminates(tokens, self._statements(tokens, inner))
+
+        # items: ["plain", text, terminates] or
+        # ["if", condition, then body, else body or None, then terminates, else terminates]
+        items = []
+        hoisted = []
+        declared = {}
+        statements = self._statements(tokens, code_indices)
+        for n, statement in enumerate(statements):
+            branches = self._if_else(tokens, statement)
+            if branches is not None:
+                close_paren, then_open, else_open = branches
+                # a branch's declarations stay scoped by the dispatcher's own braces
+                items.append(["if", span(statement[1], close_paren),
+                              text[tokens.ends[then_open]:tokens.starts[tokens.match[then_open]]],
+                              text[tokens.ends[else_open]:tokens.starts[tokens.match[else_open]]]
+                              if else_open is not None else None,
+                              body_terminates(then_open), else_open is not None and body_terminates(else_open)])
+                continue
+            declaration = self._declaration(tokens, statement)
+            if declaration is None:
+                items.append(["plain", span(statement[0], statement[-1]), self._terminates(tokens, [statement])])
+                continue
+            components, names, assignment = declaration
+            for component in components:
+                if any(tokens.token_text(i) in _POINTER_LOCATIONS for i in component):
+                    raise _Unflattenable("storage or calldata pointer declaration")
+                hoisted.append(span(component[0], component[-1]) + ";")
+            for name in names:
+                declared[name] = n
+            if assignment is not None:
+                items.append(["plain", assignment, False])
+
+        # hoisting must not capture a use of the same name before the declaration (or in its initializer)
+        for name, n in declared.items():
+            for statement in statements[:n + 1]:
+                uses = [k for k, i in enumerate(statement) if tokens.is_identifier(i, name)
+                        and not (k > 0 and tokens.is_punct(statement[k - 1], "."))]
+                if statement is statements[n]:
+                    uses = uses[1:] if uses else uses
+                if uses:
+                    raise _Unflattenable(f"{name} is used before its declaration")
+
+        self._merge(items)
+        count = _block_count(items)
+        if count < 2:
+            raise _Unflattenable("nothing to flatten")
+        if count > self.max_blocks:
+            raise _Unflattenable(f"{count} blocks over the cap of {self.max_blocks}")
+        return items, hoisted
+
+    def _merge(self, items):
+        """Merge random adjacent plain items until the block count fits the cap"""
+        while _block_count(items) > self.max_blocks:
+            pairs = [k for k in range(len(items) - 1) if items[k][0] == "plain" and items[k + 1][0] == "plain"]
+            if not pairs:
+                return
+            k = self.rng.choice(pairs)
+            items[k:k + 2] = [["plain", items[k][1] + "\n" + items[k + 1][1], items[k + 1][2]]]
+
+    def _emit(self, items, hoisted, states) -> str:
+        """Body text of the flattened function, states holding the state number of every block in order"""
+        exit_state = len(states)
+        allocate = iter(states)
+        # state -> [body, successor, terminates], successor is a state or [condition, then state, else state]
+        blocks = {}
+        entry = None
+        pending = []       # callbacks receiving the state of whatever follows
+        for item in items:
+            first = next(allocate)
+            entry = first if entry is None else entry
+            for follow in pending:
+                follow(first)
+            if item[0] == "plain":
+                blocks[first] = [item[1], None, item[2]]
+                pending = [_successor_setter(blocks[first], 1)]
+                continue
+            _, condition, then_body, else_body, then_terminates, else_terminates = item
+            then_state = next(allocate)
+            blocks[then_state] = [then_body, None, then_terminates]
+            pending = [_successor_setter(blocks[then_state], 1)]
+            if else_body is not None:
+                else_state = next(allocate)
+                blocks[else_state] = [else_body, None, else_terminates]
+                blocks[first] = ["", [condition, then_state, else_state], False]
+                pending.append(_successor_setter(blocks[else_state], 1))
+            else:
+                # an if without else falls through to whatever follows it
+                blocks[first] = ["", [condition, then_state, None], False]
+                pending.append(_successor_setter(blocks[first][1], 2))
+        for follow in pending:
+            follow(exit_state)
+
+        lines = [f"\n        {declaration}" for declaration in hoisted]
+        lines.append(f"\n        uint256 {STATE_VARIABLE} = {entry};")
+        lines.append(f"\n        while ({STATE_VARIABLE} != {exit_state}) {{\n")
+        if self.dispatch == "tree":
+            lines.append(self._tree(blocks, 0, len(states), "            "))
+        else:
+            lines.append(self._chain(blocks, len(states), "            "))
+        lines.append("        }\n    ")
+        return "".join(lines)
+
+    @staticmethod
+    def _block_text(block, indent: str) -> str:
+        body, successor, terminates = block
+        lines = [line for line in body.splitlines() if line.strip()]
+        # the first line was cut at the statement start, later ones keep their indentation relative to each other
+        margin = min((len(line) - len(line.lstrip()) for line in lines[1:]), default=0)
+        lines = [indent + (line.strip() if k == 0 else line[margin:].rstrip()) for k, line in enumerate(lines)]
+        if isinstance(successor, list):
+            condition, then_state, else_state = successor
+            lines.append(f"{indent}{STATE_VARIABLE} = {condition} ? {then_state} : {else_state};")
+        elif not terminates:
+            lines.append(f"{indent}{STATE_VARIABLE} = {successor};")
+        return "\n".join(lines) + "\n"
+
+    def _tree(self, by_state, low: int, high: int, indent: str) -> str:
+        if high - low == 1:
+            return self._block_text(by_state[low], indent)
+        middle = (low + high) // 2
+        return (f"{indent}if ({STATE_VARIABLE} < {middle}) {{\n"
+                f"{self._tree(by_state, low, middle, indent + '    ')}"
+                f"{indent}}} else {{\n"
+                f"{self._tree(by_state, middle, high, indent + '    ')}"
+                f"{indent}}}\n")
+
+    def _chain(self, by_state, count: int, indent: str) -> str:
+        parts = []
+        for state in range(count):
+            keyword = "if" if state == 0 else "} else if"
+            parts.append(f"{indent}{keyword} ({STATE_VARIABLE} == {state}) {{\n"
+                         f"{self._block_text(by_state[state], indent + '    ')}")
+        return "".join(parts) + f"{indent}}}\n"
@@ -0,0 +1,399 @@
+import argparse
+import json
+import os
+import sys
+
+import Ast_generator
+
+DEFAULT_GAS_LIMIT = 15_000_000
+# everything the harness needs from solc, requested through the (cached) standard-json path
+BYTECODE_OUTPUT_SELECTION = {"*": {"*": ["abi", "evm.bytecode.object", "evm.deployedBytecode.object", "evm.methodIdentifiers"]}}
+BENCHMARK_PRAGMA = "pragma solidity ^0.8.20;"
+CONSTANT_POOL_SIZES = (1, 4, 16, 64, 256)
+FLATTENING_BLOCK_COUNTS = (4, 8, 16, 32)
+# the rename map of an obfuscated file is kept next to it, "Token_obfu.sol" -> "Token_obfu.renames.json"
+RENAME_MAP_SUFFIX = ".renames.json"
+
+
+def _load_evm():
+    """Import the in-process EVM lazily, the rest of the obfuscator does not need it"""
+    try:
+        from eth_tester import EthereumTester, PyEVMBackend
+        from eth_tester.exceptions import TransactionFailed
+    except ImportError as e:
+        raise RuntimeError("The gas harness needs eth-tester with the py-evm backend: pip install \"eth-tester[py-evm]\"") from e
+    try:
+        from eth_abi import encode
+    except ImportError:
+        from eth_abi import encode_abi as encode
+    return EthereumTester, PyEVMBackend, TransactionFailed, encode
+
+
+def rename_map_path(obfuscated_path: str) -> str:
+    return os.path.splitext(obfuscated_path)[0] + RENAME_MAP_SUFFIX
+
+
+def save_rename_map(obfuscated_path: str, rename_map: dict):
+    with open(rename_map_path(obfuscated_path), "w", encoding="utf-8") as f:
+        json.dump(rename_map, f, indent=2, sort_keys=True)
+
+
+def load_rename_map(obfuscated_path: str):
+    """The rename map saved next to an obfuscated file, None when there is none"""
+    path = rename_map_path(obfuscated_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_scenario(path: str) -> dict:
+    """
+    A scenario is a JSON file:
+    {
+        "contract": "Counter",              (optional when the source has a single deployable contract)
+        "constructorArgs": [],
+        "deployValue": 0,
+        "calls": [
+            {"function": "inc", "args": [], "value": 0, "repeat": 3, "from": 0},
+            {"function": "transfer(address,uint256)", "args": ["account:1", 5]}
+        ]
+    }
+    "account:N" stands for the N-th test account.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compile_contracts(code: str) -> dict:
+    """Compile a full source (pragma included) to {contract name: abi, bytecode, runtime, methodIdentifiers}"""
+    output = Ast_generator.compile_standard_json(Ast_generator.build_standard_json_input(code, BYTECODE_OUTPUT_SELECTION))
+    contracts = {}
+    for name, data in output.get("contracts", {}).get(Ast_generator.SOURCE_NAME, {}).items():
+        evm = data.get("evm", {})
+        contracts[name] = {
+            "abi": data.get("abi", []),
+            "bytecode": evm.get("bytecode", {}).get("object", ""),
+            "runtime": evm.get("deployedBytecode", {}).get("object", ""),
+            "methodIdentifiers": evm.get("methodIdentifiers", {}),
+        }
+    return contracts
+
+
+def _abi_type(param: dict) -> str:
+    """Canonical type of an ABI parameter, tuples expanded"""
+    param_type = param["type"]
+    if param_type.startswith("tuple"):
+        return "(" + ",".join(_abi_type(c) for c in param.get("components", [])) + ")" + param_type[len("tuple"):]
+    return param_type
+
+
+def _signature(entry: dict) -> str:
+    return entry["name"] + "(" + ",".join(_abi_type(p) for p in entry.get("inputs", [])) + ")"
+
+
+def _shape(entry: dict) -> tuple:
+    """Everything about a function except its name, used to find it again after renaming"""
+    return (tuple(_abi_type(p) for p in entry.get("inputs", [])),
+            tuple(_abi_type(p) for p in entry.get("outputs", [])),
+            entry.get("stateMutability"))
+
+
+def _functions(contract: dict) -> list:
+    return [entry for entry in contract["abi"] if entry.get("type") == "function"]
+
+
+def _find_function(contract: dict, name: str):
+    """ABI entry by plain name (must not be overloaded) or by full signature"""
+    functions = _functions(contract)
+    if "(" in name:
+        matches = [f for f in functions if _signature(f) == name]
+    else:
+        matches = [f for f in functions if f["name"] == name]
+    if len(matches) > 1:
+        raise ValueError(f"Function {name} is overloaded, use its full signature in the scenario")
+    return matches[0] if matches else None
+
+
+def resolve_function(contract: dict, name: str, rename_map: dict = None, reference_contract: dict = None) -> dict:
+    """
+    Find the scenario function in a (possibly obfuscated) contract:
+    by name, then through the rename map, then as the only function with the same
+    parameter, return types and mutability as in the reference (original) contract
+    """
+    entry = _find_function(contract, name)
+    if entry is not None:
+        return entry
+
+    plain_name = name.split("(", 1)[0]
+    if rename_map and plain_name in rename_map:
+        renamed = rename_map[plain_name] + (name[len(plain_name):] if "(" in name else "")
+        entry = _find_function(contract, renamed)
+        if entry is not None:
+            return entry
+
+    if reference_contract is not None:
+        reference = _find_function(reference_contract, name)
+        if reference is not None:
+            candidates = [f for f in _functions(contract) if _shape(f) == _shape(reference)]
+            if len(candidates) == 1:
+                return candidates[0]
+
+    raise ValueError(f"Cannot find function {name} in the compiled contract")
+
+
+def resolve_contract(contracts: dict, name: str = None, rename_map: dict = None) -> str:
+    """Contract name by name, rename map, or as the only deployable contract"""
+    if name and name in contracts:
+        return name
+    if name and rename_map and rename_map.get(name) in contracts:
+        return rename_map[name]
+    deployable = [n for n, c in contracts.items() if c["bytecode"]]
+    if len(deployable) == 1:
+        return deployable[0]
+    raise ValueError(f"Cannot choose the contract to deploy among {sorted(deployable)}, set \"contract\" in the scenario")
+
+
+def _encode_arguments(encode, params: list, args: list, accounts: list) -> bytes:
+    def convert(param_type, value):
+        if isinstance(value, str) and value.startswith("account:"):
+            return accounts[int(value.split(":", 1)[1])]
+        if param_type.startswith("bytes") and isinstance(value, str):
+            return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+        return value
+
+    types = [_abi_type(p) for p in params]
+    if len(types) != len(args):
+        raise ValueError(f"Expected {len(types)} arguments, got {len(args)}")
+    return encode(types, [convert(t, a) for t, a in zip(types, args)])
+
+
+def measure(code: str, scenario: dict, rename_map: dict = None, reference: dict = None) -> dict:
+    """
+    Compile code, deploy it into a fresh in-process EVM and replay the scenario.
+    reference is the compiled original contract, used to find renamed functions.
+    Returns deploy gas, runtime/initcode size and per-function gas.
+    """
+    EthereumTester, PyEVMBackend, TransactionFailed, encode = _load_evm()
+
+    contracts = compile_contracts(code)
+    contract_name = resolve_contract(contracts, scenario.get("contract"), rename_map)
+    contract = contracts[contract_name]
+
+    tester = EthereumTester(PyEVMBackend())
+    accounts = tester.get_accounts()
+    gas_limit = scenario.get("gas", DEFAULT_GAS_LIMIT)
+
+    constructor = next((e for e in contract["abi"] if e.get("type") == "constructor"), {"inputs": []})
+    deploy_data = bytes.fromhex(contract["bytecode"]) + _encode_arguments(
+        encode, constructor["inputs"], scenario.get("constructorArgs", []), accounts)
+    tx_hash = tester.send_transaction({
+        "from": accounts[0],
+        "data": "0x" + deploy_data.hex(),
+        "gas": gas_limit,
+        "value": scenario.get("deployValue", 0),
+    })
+    receipt = tester.get_transaction_receipt(tx_hash)
+    address = receipt["contract_address"]
+
+    functions = {}
+    for call in scenario.get("calls", []):
+        entry = resolve_function(contract, call["function"], rename_map, reference)
+        selector = contract["methodIdentifiers"][_signature(entry)]
+        data = bytes.fromhex(selector) + _encode_arguments(encode, entry.get("inputs", []), call.get("args", []), accounts)
+        stats = functions.setdefault(call["function"], {"resolvedAs": entry["name"], "gas": [], "reverted": 0})
+
+        for _ in range(call.get("repeat", 1)):
+            try:
+                tx_hash = tester.send_transaction({
+                    "from": accounts[call.get("from", 0)],
+                    "to": address,
+                    "data": "0x" + data.hex(),
+                    "gas": gas_limit,
+                    "value": call.get("value", 0),
+                })
+                stats["gas"].append(tester.get_transaction_receipt(tx_hash)["gas_used"])
+            except TransactionFailed:
+                stats["reverted"] += 1
+
+    for stats in functions.values():
+        stats["avgGas"] = sum(stats["gas"]) / len(stats["gas"]) if stats["gas"] else None
+
+    return {
+        "contract": contract_name,
+        "deployGas": receipt["gas_used"],
+        "initcodeSize": len(contract["bytecode"]) // 2,
+        "runtimeSize": len(contract["runtime"]) // 2,
+        "functions": functions,
+    }
+
+
+def compare(original_code: str, obfuscated_code: str, scenario: dict, rename_map: dict = None) -> dict:
+    """Measure the original and the obfuscated source on the same scenario"""
+    before = measure(original_code, scenario)
+    reference = compile_contracts(original_code)[before["contract"]]
+    # the obfuscated side deploys the same contract, under its new name when it was renamed
+    after = measure(obfuscated_code, dict(scenario, contract=before["contract"]), rename_map, reference)
+    return {"before": before, "after": after}
+
+
+def _delta(before, after) -> str:
+    if before is None or after is None:
+        return f"{before} -> {after}"
+    change = after - before
+    percent = f" ({change / before * 100:+.1f}%)" if before else ""
+    return f"{before:.0f} -> {after:.0f}, {change:+.0f}{percent}"
+
+
+def format_gas_report(comparison: dict) -> str:
+    """Text report in the style of utilities.metrics.calculate_complexity"""
+    before, after = comparison["before"], comparison["after"]
+    lines = [
+        f"Contract: {before['contract']} -> {after['contract']}",
+        f"Deploy gas: {_delta(before['deployGas'], after['deployGas'])}",
+        f"Runtime bytecode size (bytes): {_delta(before['runtimeSize'], after['runtimeSize'])}",
+        f"Initcode size (bytes): {_delta(before['initcodeSize'], after['initcodeSize'])}",
+    ]
+    for name, stats in before["functions"].items():
+        after_stats = after["functions"].get(name, {})
+        line = f"Gas {name}: {_delta(stats['avgGas'], after_stats.get('avgGas'))}"
+        reverted = (stats["reverted"], after_stats.get("reverted", 0))
+        if any(reverted):
+            line += f" [reverted {reverted[0]} -> {reverted[1]}]"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _constant_pool_source(pool_size: int) -> str:
+    """Contract with pool_size distinct literals; lookup() returns the last one (the worst case of a chain)"""
+    values = [1000 + 7 * i for i in range(pool_size)]
+    assignments = "".join(f"        s = {value};\n" for value in values)
+    return (f"{BENCHMARK_PRAGMA}\ncontract PoolBenchmark {{\n"
+            f"    function pool() external pure returns (uint256 s) {{\n{assignments}    }}\n\n"
+            f"    function lookup() external pure returns (uint256) {{\n        return {values[-1]};\n    }}\n}}\n")
+
+
+def _hashed_chain_source(pool_size: int) -> str:
+    """The same contract with the former getDynamicValue(string, uint): one keccak comparison per pooled name"""
+    conditions = "".join(f'        if (arrayHash == keccak256(abi.encodePacked("dataArray_{i}"))) return {1000 + 7 * i};\n'
+                         for i in range(pool_size))
+    return (f"{BENCHMARK_PRAGMA}\ncontract PoolBenchmark {{\n"
+            f"    function lookup() external pure returns (uint256) {{\n"
+            f"        return getDynamicValue(\"dataArray_{pool_size - 1}\", 0);\n    }}\n\n"
+            f"    function getDynamicValue(string memory arrayName, uint index) private pure returns (uint) {{\n"
+            f"        bytes32 arrayHash = keccak256(abi.encodePacked(arrayName));\n{conditions}        return 0;\n    }}\n}}\n")
+
+
+def benchmark_constant_pool(pool_sizes=CONSTANT_POOL_SIZES) -> list:
+    """
+    Gas of one constant lookup against the number of pooled constants: a plain literal,
+    the packed constant pool written by constants_to_dynamic_arrays, and the former hashed if-chain
+    """
+    from dataflowObfuscation import dataflowObfuscation
+
+    scenario = {"contract": "PoolBenchmark", "calls": [{"function": "lookup"}]}
+    rows = []
+    for pool_size in pool_sizes:
+        source = _constant_pool_source(pool_size)
+        packed = dataflowObfuscation(source).constants_to_dynamic_arrays(source)
+        gas = {name: measure(code, scenario)["functions"]["lookup"]["avgGas"]
+               for name, code in (("plain", source), ("packed", packed), ("hashed", _hashed_chain_source(pool_size)))}
+        rows.append({"poolSize": pool_size, "plainGas": gas["plain"],
+                     "packedGas": gas["packed"], "packedOverhead": gas["packed"] - gas["plain"],
+                     "hashedGas": gas["hashed"], "hashedOverhead": gas["hashed"] - gas["plain"]})
+    return rows
+
+
+def format_constant_pool_benchmark(rows: list) -> str:
+    lines = [f"{'pool size':>9}{'plain':>10}  {'packed pool':<20}{'hashed chain'}"]
+    for row in rows:
+        packed = f"{row['packedGas']:.0f} ({row['packedOverhead']:+.0f})"
+        hashed = f"{row['hashedGas']:.0f} ({row['hashedOverhead']:+.0f})"
+        lines.append(f"{row['poolSize']:>9}{row['plainGas']:>10.0f}  {packed:<20}{hashed}")
+    return "\n".join(lines) + "\n"
+
+
+def _straight_line_source(block_count: int) -> str:
+    """Contract whose run() has block_count top-level statements, i.e. block_count blocks once flattened"""
+    statements = "".join(f"        s = s * {3 + i} + {i};\n" for i in range(block_count - 1))
+    return (f"{BENCHMARK_PRAGMA}\ncontract FlatteningBenchmark {{\n"
+            f"    function run(uint256 x) external pure returns (uint256 s) {{\n"
+            f"        s = x;\n{statements}    }}\n}}\n")
+
+
+def benchmark_flattening(block_counts=FLATTENING_BLOCK_COUNTS) -> list:
+    """
+    Gas of one call against the number of flattened blocks: the original function, the
+    balanced dispatch tree written by ControlFlowFlattener and an if / else-if chain.
+    Every block runs once, so the difference is the dispatch cost of block_count transitions.
+    """
+    import random
+    from utilities.flattening import ControlFlowFlattener
+
+    scenario = {"contract": "FlatteningBenchmark", "calls": [{"function": "run", "args": [7]}]}
+    rows = []
+    for block_count in block_counts:
+        source = _straight_line_source(block_count)
+        gas = {"original": measure(source, scenario)["functions"]["run"]["avgGas"]}
+        for dispatch in ("tree", "chain"):
+            flattener = ControlFlowFlattener(block_count, dispatch, random.Random(block_count))
+            gas[dispatch] = measure(flattener.flatten(source), scenario)["functions"]["run"]["avgGas"]
+        rows.append({"blocks": block_count, "originalGas": gas["original"],
+                     "treeGas": gas["tree"], "treeOverhead": gas["tree"] - gas["original"],
+                     "chainGas": gas["chain"], "chainOverhead": gas["chain"] - gas["original"]})
+    return rows
+
+
+def format_flattening_benchmark(rows: list) -> str:
+    lines = [f"{'blocks':>6}{'original':>10}  {'dispatch tree':<20}{'if chain'}"]
+    for row in rows:
+        tree = f"{row['treeGas']:.0f} ({row['treeOverhead']:+.0f})"
+        chain = f"{row['chainGas']:.0f} ({row['chainOverhead']:+.0f})"
+        lines.append(f"{row['blocks']:>6}{row['originalGas']:>10.0f}  {tree:<20}{chain}")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare gas and bytecode size of an original and an obfuscated contract")
+    parser.add_argument("original", nargs="?", help="original Solidity file")
+    parser.add_argument("obfuscated", nargs="?", help="obfuscated Solidity file")
+    parser.add_argument("scenario", nargs="?", help="scenario JSON file")
+    parser.add_argument("--rename-map", default=None,
+                        help=f"JSON rename map of the obfuscated file (default: <obfuscated>{RENAME_MAP_SUFFIX} if present)")
+    parser.add_argument("--json", action="store_true", help="print the raw measurements as JSON")
+    parser.add_argument("--solc", default=None, help="path to the solc binary")
+    parser.add_argument("--constant-pool-benchmark", action="store_true",
+                        help="instead of comparing files, measure the gas of one constant-pool lookup against the pool size")
+    parser.add_argument("--flattening-benchmark", action="store_true",
+                        help="instead of comparing files, measure the dispatch gas of flattened functions against their block count")
+    args = parser.parse_args(argv)
+
+    Ast_generator.set_solc_binary(args.solc)
+    if args.constant_pool_benchmark:
+        rows = benchmark_constant_pool()
+        print(json.dumps(rows, indent=2) if args.json else format_constant_pool_benchmark(rows))
+        return 0
+    if args.flattening_benchmark:
+        rows = benchmark_flattening()
+        print(json.dumps(rows, indent=2) if args.json else format_flattening_benchmark(rows))
+        return 0
+    if not (args.original and args.obfuscated and args.scenario):
+        parser.error("original, obfuscated and scenario are required")
+
+    with open(args.original, "r", encoding="utf-8") as f:
+        original_code = f.read()
+    with open(args.obfuscated, "r", encoding="utf-8") as f:
+        obfuscated_code = f.read()
+
+    if args.rename_map:
+        with open(args.rename_map, "r", encoding="utf-8") as f:
+            rename_map = json.load(f)
+    else:
+        rename_map = load_rename_map(args.obfuscated)
+    comparison = compare(original_code, obfuscated_code, load_scenario(args.scenario), rename_map)
+    print(json.dumps(comparison, indent=2) if args.json else format_gas_report(comparison))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Keccak-256 as used by Solidity (original Keccak padding, not NIST SHA3-256).
+# A C implementation is used when pycryptodome or eth-hash is installed, otherwise
+# the pure Python Keccak-f[1600] sponge below, which is slower but has no dependency.
+
+_MASK = (1 << 64) - 1
+_RATE = 136
+
+_ROUND_CONSTANTS = (
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+)
+
+# rotation offset of lane (x, y), indexed [x][y]
+_ROTATIONS = (
+    (0, 36, 3, 41, 18),
+    (1, 44, 10, 45, 2),
+    (62, 6, 43, 15, 61),
+    (28, 55, 25, 21, 56),
+    (27, 20, 39, 8, 14),
+)
+
+
+def _rotate(value: int, shift: int) -> int:
+    return ((value << shift) | (value >> (64 - shift))) & _MASK
+
+
+def _keccak_f(state: list) -> list:
+    """One Keccak-f[1600] permutation over 25 lanes, lane (x, y) at index x + 5 * y"""
+    for round_constant in _ROUND_CONSTANTS:
+        # theta
+        columns = [state[x] ^ state[x + 5] ^ state[x + 10] ^ state[x + 15] ^ state[x + 20] for x in range(5)]
+        parity = [columns[(x - 1) % 5] ^ _rotate(columns[(x + 1) % 5], 1) for x in range(5)]
+        state = [lane ^ parity[i % 5] for i, lane in enumerate(state)]
+        # rho and pi
+        moved = [0] * 25
+        for x in range(5):
+            for y in range(5):
+                moved[y + 5 * ((2 * x + 3 * y) % 5)] = _rotate(state[x + 5 * y], _ROTATIONS[x][y])
+        # chi
+        state = [moved[i] ^ (~moved[(i + 1) % 5 + i - i % 5] & moved[(i + 2) % 5 + i - i % 5]) for i in range(25)]
+        # iota
+        state[0] ^= round_constant
+    return state
+
+
+def _keccak256_python(data: bytes) -> bytes:
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b"\x00" * (-len(padded) % _RATE))
+    padded[-1] |= 0x80
+
+    state = [0] * 25
+    for offset in range(0, len(padded), _RATE):
+        block = padded[offset:offset + _RATE]
+        for i in range(_RATE // 8):
+            state[i] ^= int.from_bytes(block[8 * i:8 * i + 8], "little")
+        state = _keccak_f(state)
+    return b"".join(lane.to_bytes(8, "little") for lane in state[:4])
+
+
+try:
+    from Crypto.Hash import keccak as _crypto_keccak
+
+    def keccak256(data: bytes) -> bytes:
+        return _crypto_keccak.new(digest_bits=256, data=data).digest()
+except ImportError:
+    try:
+        from eth_hash.auto import keccak as keccak256
+    except ImportError:
+        keccak256 = _keccak256_python
@@ -0,0 +1,160 @@
+import re
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+# token kinds
+WHITESPACE = 0
+COMMENT = 1
+STRING = 2
+NUMBER = 3
+IDENTIFIER = 4
+PUNCT = 5
+KIND_NAMES = ("WHITESPACE", "COMMENT", "STRING", "NUMBER", "IDENTIFIER", "PUNCT")
+
+# one group per kind, in kind order, so match.lastindex - 1 is the kind
+_TOKEN_PATTERN = re.compile(r"""
+    (\s+)
+  | (//[^\r\n]* | /\*[\s\S]*?(?:\*/|\Z))
+  | ((?:hex|unicode)?(?:"(?:[^"\\\r\n]|\\.)*"? | '(?:[^'\\\r\n]|\\.)*'?))
+  | (0[xX][0-9a-fA-F_]* | (?:[0-9][0-9_]*(?:\.[0-9][0-9_]*)? | \.[0-9][0-9_]*)(?:[eE]-?[0-9][0-9_]*)?)
+  | ([A-Za-z_$][A-Za-z0-9_$]*)
+  | ([\s\S])
+""", re.VERBOSE)
+
+_BRACKETS = {"(": ")", "[": "]", "{": "}"}
+_CLOSERS = {close: open_ for open_, close in _BRACKETS.items()}
+
+
+class TokenStream:
+    """
+    Solidity source split into contiguous tokens (kind, start, end) by one linear scan.
+
+    Comments and string literals are single tokens, so brackets, keywords and
+    numbers inside them are never mistaken for code. match[i] holds the index of
+    the bracket token matching bracket token i (-1 if unmatched or not a bracket).
+    Instances come from a shared cache, treat them as read-only.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.kinds = array("b")
+        self.starts = array("l")
+        self.ends = array("l")
+        for m in _TOKEN_PATTERN.finditer(text):
+            self.kinds.append(m.lastindex - 1)
+            self.starts.append(m.start())
+            self.ends.append(m.end())
+        self.match = array("l", [-1]) * len(self.kinds)
+        self._match_brackets()
+        self._code_indices = None
+        self._brace_depths = None
+
+    def _match_brackets(self):
+        stacks = {open_: [] for open_ in _BRACKETS}
+        text = self.text
+        for i, kind in enumerate(self.kinds):
+            if kind != PUNCT:
+                continue
+            ch = text[self.starts[i]]
+            if ch in _BRACKETS:
+                stacks[ch].append(i)
+            elif ch in _CLOSERS:
+                stack = stacks[_CLOSERS[ch]]
+                if stack:
+                    j = stack.pop()
+                    self.match[i] = j
+                    self.match[j] = i
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def token_text(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def is_code(self, i: int) -> bool:
+        return self.kinds[i] > COMMENT
+
+    def is_punct(self, i: int, ch: str) -> bool:
+        return self.kinds[i] == PUNCT and self.text[self.starts[i]] == ch
+
+    def is_identifier(self, i: int, name: str) -> bool:
+        return self.kinds[i] == IDENTIFIER and self.text[self.starts[i]:self.ends[i]] == name
+
+    def index_at(self, pos: int) -> int:
+        """Index of the token containing character position pos"""
+        return bisect_right(self.starts, pos) - 1
+
+    def code_indices(self) -> list:
+        """Indices of every token that is not whitespace or a comment"""
+        if self._code_indices is None:
+            self._code_indices = [i for i, kind in enumerate(self.kinds) if kind > COMMENT]
+        return self._code_indices
+
+    def next_code(self, i: int) -> int:
+        """Index of the first code token after token i, or -1"""
+        for j in range(i + 1, len(self.kinds)):
+            if self.kinds[j] > COMMENT:
+                return j
+        return -1
+
+    def find_identifier(self, name: str, start_index: int = 0) -> int:
+        """Index of the first identifier token equal to name, or -1"""
+        for i in range(start_index, len(self.kinds)):
+            if self.kinds[i] == IDENTIFIER and self.token_text(i) == name:
+                return i
+        return -1
+
+    def find_punct(self, ch: str, start_index: int = 0) -> int:
+        for i in range(start_index, len(self.kinds)):
+            if self.kinds[i] == PUNCT and self.text[self.starts[i]] == ch:
+                return i
+        return -1
+
+    def matching_position(self, pos: int) -> int:
+        """Character position of the bracket matching the bracket at pos, or -1"""
+        i = self.index_at(pos)
+        if i < 0 or self.starts[i] != pos or self.match[i] == -1:
+            return -1
+        return self.starts[self.match[i]]
+
+    def brace_depths(self):
+        """Number of "{ }" blocks enclosing each token (a brace counts as outside its own block)"""
+        if self._brace_depths is None:
+            depths = array("l", [0]) * len(self.kinds)
+            depth = 0
+            text = self.text
+            for i, kind in enumerate(self.kinds):
+                if kind == PUNCT:
+                    ch = text[self.starts[i]]
+                    if ch == "}" and depth > 0:
+                        depth -= 1
+                    depths[i] = depth
+                    if ch == "{":
+                        depth += 1
+                else:
+                    depths[i] = depth
+            self._brace_depths = depths
+        return self._brace_depths
+
+    def top_level_blocks(self) -> list:
+        """(open index, close index) of every outermost matched "{ }" pair, e.g. contract bodies"""
+        blocks = []
+        i = self.find_punct("{")
+        while i != -1:
+            close = self.match[i]
+            if close == -1:
+                break
+            blocks.append((i, close))
+            i = self.find_punct("{", close + 1)
+        return blocks
+
+    def strip_comments(self) -> str:
+        """Source text with every comment removed (line breaks after // comments are kept)"""
+        return "".join(self.text[self.starts[i]:self.ends[i]] for i, kind in enumerate(self.kinds) if kind != COMMENT)
+
+
+@lru_cache(maxsize=16)
+def tokenize(text: str) -> TokenStream:
+    """Tokenize text once; passes that see the same text share the result"""
+    return TokenStream(text)
@@ -0,0 +1,9 @@
+def notify(observer, step: str, before: str, after: str) -> str:
+    """
+    Report a finished sub-pass to an optional observer(step, before, after).
+    The observer may return replacement text (e.g. before, to veto the step); None keeps after.
+    """
+    if observer is None:
+        return after
+    result = observer(step, before, after)
+    return after if result is None else result
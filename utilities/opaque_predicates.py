@@ -0,0 +1,261 @@
+import argparse
+import random
+import sys
+from bisect import bisect_right
+from string import Template
+
+import Ast_generator
+from utilities import gas_harness
+from utilities.lexer import IDENTIFIER
+
+# cost tiers, from cheapest to most expensive
+CHEAP = "cheap"
+MEDIUM = "medium"
+EXPENSIVE = "expensive"
+TIERS = (CHEAP, MEDIUM, EXPENSIVE)
+# not a tier: always the original opaqueTrue() keccak loop, so configurations without a tier keep it
+BASELINE = "baseline"
+BASELINE_PREDICATE = "keccakLoop"
+TIER_CHOICES = (BASELINE,) + TIERS
+DEFAULT_TIER = BASELINE
+# helpers the controlflow pass emits, called from every guarded if; seed helpers are named __<helper>Seed...
+HELPER_NAMES = ("opaqueTrue", "opaqueTruePure")
+# a predicate belongs to the cheapest tier whose limit is above its gas
+TIER_LIMITS = {CHEAP: 100, MEDIUM: 1000}
+
+# predicate families
+NUMBER_THEORY = "number-theory"
+BIT_TRICK = "bit-trick"
+ITERATED_HASH = "iterated-hash"
+
+PROBE_PRAGMA = "pragma solidity ^0.8.20;"
+
+
+def is_predicate_helper(name: str) -> bool:
+    """Whether a function name belongs to the opaque predicate helpers (passes with a runtime cost skip them)"""
+    return bool(name) and (name in HELPER_NAMES or any(name.startswith(f"__{helper}") for helper in HELPER_NAMES))
+
+
+def tier_for_gas(gas: int) -> str:
+    for tier in (CHEAP, MEDIUM):
+        if gas < TIER_LIMITS[tier]:
+            return tier
+    return EXPENSIVE
+
+
+class OpaquePredicate:
+    """
+    An always-true Solidity predicate, emitted as a private helper without parameters.
+
+    gas is an estimate of the execution gas of one internal call (solc 0.8, optimizer off)
+    from opcode counts, not a measurement; it decides the tier. measure_predicate_gas()
+    (this module's CLI) measures it with the gas harness and reports tier mismatches.
+    The body and declarations are templates: ${seedName} and ${seed} are filled in
+    with a fresh immutable name and a random odd value for immutable-seeded predicates.
+    Bodies must not contain "if": the pass that calls the helper rewrites every if.
+    """
+
+    def __init__(self, name: str, family: str, gas: int, mutability: str, body: str, declarations: str = ""):
+        self.name = name
+        self.family = family
+        self.gas = gas
+        self.mutability = mutability
+        self.body = body
+        self.declarations = declarations
+
+    @property
+    def tier(self) -> str:
+        return tier_for_gas(self.gas)
+
+    @property
+    def is_pure(self) -> bool:
+        return self.mutability == "pure"
+
+    @property
+    def precomputed(self) -> bool:
+        """Seed material is evaluated once at deploy time into immutables"""
+        return "immutable" in self.declarations
+
+    def render(self, function_name: str, rng=random) -> str:
+        """Declarations and helper function, ready to be inserted after a contract's "{" """
+        values = {"seedName": f"__{function_name}Seed", "seed": str(rng.getrandbits(64) | 1)}
+        text = ""
+        if self.declarations:
+            text += "\n" + Template(self.declarations).substitute(values) + "\n"
+        text += f"\n    function {function_name}() private {self.mutability} returns (bool) {{\n"
+        text += Template(self.body).substitute(values)
+        text += "    }\n"
+        return text
+
+
+# msg.data and msg.sig may be read in pure functions; immutables make a helper view.
+# Every predicate also holds for empty calldata, as seen from a constructor.
+PREDICATES = [
+    OpaquePredicate("consecutiveProductParity", NUMBER_THEORY, 45, "pure", """\
+        uint256 x = msg.data.length;
+        unchecked { return (x * (x + 1)) % 2 == 0; }
+"""),
+    OpaquePredicate("squareModFour", NUMBER_THEORY, 50, "pure", """\
+        uint256 x = uint256(uint32(msg.sig));
+        unchecked { return (x * x) % 4 < 2; }
+"""),
+    OpaquePredicate("lowestBitClear", BIT_TRICK, 55, "pure", """\
+        uint256 x = msg.data.length;
+        unchecked { return x == 0 || (x & (x - 1)) < x; }
+"""),
+    OpaquePredicate("orOneIsOdd", BIT_TRICK, 40, "pure", """\
+        uint256 x = uint256(uint32(msg.sig));
+        return ((x | 1) & 1) == 1;
+"""),
+    OpaquePredicate("immutableOddSquare", NUMBER_THEORY, 45, "view", """\
+        unchecked { return (${seedName} * ${seedName}) % 8 == 1; }
+""", declarations="    uint256 private immutable ${seedName} = ${seed};"),
+    OpaquePredicate("immutableCalldataParity", NUMBER_THEORY, 50, "view", """\
+        uint256 x = ${seedName} ^ msg.data.length;
+        unchecked { return (x * (x + 1)) % 2 == 0; }
+""", declarations="    uint256 private immutable ${seedName} = ${seed};"),
+    OpaquePredicate("immutableKeccakChain", NUMBER_THEORY, 45, "view", """\
+        unchecked { return (${seedName} * (${seedName} + 1)) % 2 == 0; }
+""", declarations="""\
+    uint256 private immutable ${seedName} = ${seedName}Chain();
+
+    function ${seedName}Chain() private pure returns (uint256 x) {
+        x = ${seed};
+        for (uint256 i = 0; i < 7; i++) {
+            x = uint256(keccak256(abi.encodePacked(x, i)));
+        }
+    }"""),
+    OpaquePredicate("noSevenSquareSolution", NUMBER_THEORY, 230, "pure", """\
+        uint256 h = uint256(keccak256(msg.data));
+        uint256 x = uint64(h);
+        uint256 y = uint64(h >> 64);
+        return 7 * x * x != y * y + 1;
+"""),
+    OpaquePredicate("fermatSeven", NUMBER_THEORY, 220, "pure", """\
+        uint256 x = uint256(keccak256(msg.data)) % 7;
+        return (x * x * x * x * x * x * x) % 7 == x;
+"""),
+    OpaquePredicate("threeConsecutiveProduct", NUMBER_THEORY, 200, "pure", """\
+        uint256 x = uint64(uint256(keccak256(msg.data)));
+        return (x * (x + 1) * (x + 2)) % 6 == 0;
+"""),
+    OpaquePredicate("keccakLoop", ITERATED_HASH, 1300, "pure", """\
+        uint256 x = 123456789;
+        for (uint256 i = 0; i < 7; i++) {
+            x = uint256(keccak256(abi.encodePacked(x, i)));
+        }
+        return ((x % 2 == 0) || (x % 2 == 1));
+"""),
+    OpaquePredicate("fermatMersenne", NUMBER_THEORY, 4500, "pure", """\
+        uint256 p = 2305843009213693951;
+        uint256 a = uint256(keccak256(msg.data)) % (p - 1) + 1;
+        uint256 r = 1;
+        for (uint256 e = p - 1; e > 0; e >>= 1) {
+            r = mulmod(r, (e & 1) == 1 ? a : 1, p);
+            a = mulmod(a, a, p);
+        }
+        return r == 1;
+"""),
+]
+
+
+def predicates_in_tier(tier: str, pure_only: bool = False) -> list:
+    if tier not in TIER_CHOICES:
+        raise ValueError(f"Unknown opaque predicate tier {tier!r}, expected one of {', '.join(TIER_CHOICES)}")
+    if tier == BASELINE:
+        return [p for p in PREDICATES if p.name == BASELINE_PREDICATE]
+    return [p for p in PREDICATES if p.tier == tier and (p.is_pure or not pure_only)]
+
+
+def choose_predicate(tier: str = DEFAULT_TIER, pure_only: bool = False, precomputed: bool = False,
+                     rng=random) -> OpaquePredicate:
+    """
+    Random predicate of the tier; with pure_only, one that can be called from pure code.
+    With precomputed, one whose seed is evaluated at deploy time, whatever the tier:
+    reading an immutable is always cheap.
+    """
+    if precomputed and not pure_only:
+        return rng.choice([p for p in PREDICATES if p.precomputed])
+    candidates = predicates_in_tier(tier, pure_only)
+    if not candidates:
+        # no pure predicate in this tier: fall back to the cheapest pure one
+        candidates = [min((p for p in PREDICATES if p.is_pure), key=lambda p: p.gas)]
+    return rng.choice(candidates)
+
+
+def pure_only_context(tokens):
+    """
+    Function telling whether a token index lies in a body that may only call pure helpers:
+    pure functions, modifiers (they may wrap pure functions) and constructors
+    (immutables cannot be read during contract creation)
+    """
+    code_indices = tokens.code_indices()
+    bodies = []
+    for k, i in enumerate(code_indices):
+        if tokens.kinds[i] != IDENTIFIER:
+            continue
+        word = tokens.token_text(i)
+        if word not in ("function", "modifier", "constructor"):
+            continue
+        pure_only = word != "function"
+        # the header runs up to the body's "{", or to ";" for a declaration without body
+        for m in range(k + 1, len(code_indices)):
+            j = code_indices[m]
+            if tokens.is_identifier(j, "pure"):
+                pure_only = True
+            elif tokens.is_punct(j, ";"):
+                break
+            elif tokens.is_punct(j, "{"):
+                if pure_only and tokens.match[j] != -1:
+                    bodies.append((j, tokens.match[j]))
+                break
+    opens = [open_ for open_, _ in bodies]
+
+    def contains(index: int) -> bool:
+        k = bisect_right(opens, index) - 1
+        return k >= 0 and index < bodies[k][1]
+
+    return contains
+
+
+def build_probe_contract(predicates: list) -> str:
+    """One contract calling every predicate from its own external function, plus an empty baseline"""
+    parts = [PROBE_PRAGMA, "\ncontract OpaqueProbe {\n"]
+    for i, predicate in enumerate(predicates):
+        parts.append(predicate.render(f"p{i}", random.Random(i)))
+    parts.append("\n    function baseline() external view returns (bool) {\n        return true;\n    }\n")
+    for i in range(len(predicates)):
+        parts.append(f"\n    function run{i}() external view returns (bool) {{\n        return p{i}();\n    }}\n")
+    parts.append("}\n")
+    return "".join(parts)
+
+
+def measure_predicate_gas(predicates: list = None) -> dict:
+    """Gas of one call of every predicate, as the difference to an empty external call"""
+    predicates = PREDICATES if predicates is None else predicates
+    scenario = {
+        "contract": "OpaqueProbe",
+        "calls": [{"function": "baseline"}] + [{"function": f"run{i}"} for i in range(len(predicates))],
+    }
+    measured = gas_harness.measure(build_probe_contract(predicates), scenario)["functions"]
+    baseline = measured["baseline"]["avgGas"]
+    return {p.name: measured[f"run{i}"]["avgGas"] - baseline for i, p in enumerate(predicates)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the gas of every opaque predicate against its recorded tier")
+    parser.add_argument("--solc", default=None, help="path to the solc binary")
+    args = parser.parse_args(argv)
+
+    Ast_generator.set_solc_binary(args.solc)
+    measured = measure_predicate_gas()
+    print(f"{'predicate':<26}{'family':<15}{'estimate':>10}{'measured':>10}  tier")
+    for predicate in PREDICATES:
+        gas = measured[predicate.name]
+        tier = predicate.tier if tier_for_gas(gas) == predicate.tier else f"{predicate.tier} -> {tier_for_gas(gas)}"
+        print(f"{predicate.name:<26}{predicate.family:<15}{predicate.gas:>10}{gas:>10.0f}  {tier}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
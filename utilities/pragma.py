@@ -0,0 +1,39 @@
+import re
+
+# one comparator and version of a version pragma, e.g. "^0.8.20", ">=0.8.24", "0.8.x"
+_CONSTRAINT_PATTERN = re.compile(r"(\^|~|>=|<=|>|<|=)?\s*v?(\d+)(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?")
+
+
+def _version(match) -> tuple:
+    return tuple(int(part) if part and part.isdigit() else 0 for part in match.group(2, 3, 4))
+
+
+def minimum_version(pragma_statement: str) -> tuple:
+    """
+    Lowest compiler version (major, minor, patch) admitted by a "pragma solidity ...;" statement,
+    (0, 0, 0) when the pragma is missing or has no lower bound
+    """
+    body = re.sub(r"^\s*pragma\s+solidity\b|;\s*$", "", pragma_statement or "").strip()
+    if not body:
+        return (0, 0, 0)
+
+    lowest = None
+    for alternative in body.split("||"):
+        # "0.8.0 - 0.8.20" is bounded below by its left side
+        alternative = alternative.split(" - ", 1)[0]
+        bound = (0, 0, 0)
+        for match in _CONSTRAINT_PATTERN.finditer(alternative):
+            comparator, version = match.group(1), _version(match)
+            if comparator in ("<", "<="):
+                continue
+            if comparator == ">":
+                version = version[:2] + (version[2] + 1,)
+            bound = max(bound, version)
+        lowest = bound if lowest is None else min(lowest, bound)
+    return lowest
+
+
+def parse_version(version: str) -> tuple:
+    """(major, minor, patch) of a compiler version such as "0.8.26" or "0.8.26+commit.8a97fa7a"""
+    match = re.match(r"\s*v?(\d+)\.(\d+)\.(\d+)", version or "")
+    return tuple(int(part) for part in match.groups()) if match else (0, 0, 0)
@@ -0,0 +1,53 @@
+from bisect import bisect_right
+
+
+class RangeIndex:
+    """
+    Sorted index over [start, end] spans that are nested or disjoint, as solc src
+    spans are. Answers "which span encloses this range" in O(log n) plus the
+    nesting depth, instead of scanning every span.
+    """
+
+    def __init__(self, items=()):
+        """items: iterable of (start, end, payload)"""
+        spans = sorted(items, key=lambda item: (item[0], -item[1]))
+        self.starts = [span[0] for span in spans]
+        self.ends = [span[1] for span in spans]
+        self.payloads = [span[2] for span in spans]
+        # parent[i] is the innermost span that strictly encloses span i
+        self.parent = []
+        stack = []
+        for i in range(len(spans)):
+            while stack and not (self.starts[stack[-1]] <= self.starts[i] and self.ends[i] <= self.ends[stack[-1]]):
+                stack.pop()
+            self.parent.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _innermost(self, start, end):
+        # the innermost enclosing span is the last span starting at or before start, or one of its ancestors
+        i = bisect_right(self.starts, start) - 1
+        while i >= 0:
+            if self.ends[i] >= end:
+                return i
+            i = self.parent[i]
+        return -1
+
+    def enclosing(self, start, end):
+        """Payload of the innermost span containing [start, end], or None"""
+        i = self._innermost(start, end)
+        return self.payloads[i] if i >= 0 else None
+
+    def contains(self, start, end):
+        return self._innermost(start, end) >= 0
+
+    def all_enclosing(self, start, end):
+        """Payloads of every span containing [start, end], innermost first"""
+        result = []
+        i = self._innermost(start, end)
+        while i >= 0:
+            result.append(self.payloads[i])
+            i = self.parent[i]
+        return result
@@ -0,0 +1,252 @@
+import re
+import string
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from utilities.keccak import keccak256
+from utilities.lexer import IDENTIFIER, tokenize
+
+# calldata gas of a zero and of a non-zero byte (EIP-2028)
+ZERO_BYTE_GAS = 4
+NONZERO_BYTE_GAS = 16
+DEFAULT_ZERO_BYTES = 1
+# mining runs in the calling process unless more workers are asked for (selectorMiningWorkers)
+DEFAULT_MINING_WORKERS = 1
+# nonces tried by one worker task, and by one name before giving up
+CHUNK_SIZE = 4096
+MAX_TRIES = 1 << 24
+
+_NONCE_ALPHABET = string.digits + string.ascii_letters
+_ELEMENTARY_TYPE = re.compile(r"u?int(\d*)|address|bool|string|bytes(\d*)|byte")
+_DATA_LOCATIONS = {"memory", "storage", "calldata", "payable", "indexed"}
+# contract level declarations that are not state variables
+_NOT_STATE_VARIABLES = {"function", "modifier", "event", "error", "struct", "enum", "using", "constructor",
+                        "fallback", "receive"}
+_STATE_VARIABLE_KEYWORDS = {"public", "private", "internal", "constant", "immutable", "override", "transient"}
+
+
+def _canonical_type(parameter: str):
+    """ABI type of one parameter declaration ("uint[] memory xs" -> "uint256[]"), None for user-defined types"""
+    words = [w for w in re.split(r"\s+", re.sub(r"\s*\[\s*", "[", re.sub(r"\s*\]", "]", parameter.strip()))) if w]
+    words = [w for w in words if w not in _DATA_LOCATIONS]
+    if not words:
+        return None
+    base, _, arrays = words[0].partition("[")
+    arrays = "[" + arrays if arrays else ""
+    match = _ELEMENTARY_TYPE.fullmatch(base)
+    if match is None:
+        return None
+    if base in ("uint", "int"):
+        base += "256"
+    elif base == "byte":
+        base = "bytes1"
+    return base + arrays
+
+
+def _function_declarations(code: str):
+    """(name, visibility or None, ABI parameter types or None) of every named function declaration"""
+    tokens = tokenize(code)
+    code_indices = tokens.code_indices()
+    for k, i in enumerate(code_indices[:-2]):
+        if not tokens.is_identifier(i, "function"):
+            continue
+        name_index, open_paren = code_indices[k + 1], code_indices[k + 2]
+        if tokens.kinds[name_index] != IDENTIFIER or not tokens.is_punct(open_paren, "("):
+            continue
+        close_paren = tokens.match[open_paren]
+        if close_paren == -1:
+            continue
+        visibility = None
+        for m in range(bisect_left(code_indices, close_paren) + 1, len(code_indices)):
+            j = code_indices[m]
+            if tokens.is_punct(j, "{") or tokens.is_punct(j, ";"):
+                break
+            if tokens.is_identifier(j, "public") or tokens.is_identifier(j, "external"):
+                visibility = tokens.token_text(j)
+
+        body = code[tokens.ends[open_paren]:tokens.starts[close_paren]]
+        parameters = [_canonical_type(p) for p in body.split(",")] if body.strip() else []
+        yield tokens.token_text(name_index), visibility, None if None in parameters else parameters
+
+
+def external_signatures(code: str) -> dict:
+    """
+    {function name: parameter type list} of every public / external function whose selector
+    can be mined: one signature per name (no overloads) and only elementary parameter types
+    """
+    signatures = {}
+    blocked = set()
+    for name, visibility, parameters in _function_declarations(code):
+        if visibility is None:
+            # an internal overload would still be renamed along with the external one
+            blocked.add(name)
+            continue
+        if parameters is None or signatures.get(name, parameters) != parameters:
+            blocked.add(name)
+        signatures[name] = parameters
+    return {name: parameters for name, parameters in signatures.items() if name not in blocked}
+
+
+def _getter_parameters(type_text: str):
+    """ABI parameter types of the getter of a public state variable of type type_text, None if unknown"""
+    parameters = []
+    type_text = type_text.strip()
+    while type_text.startswith("mapping"):
+        inner = type_text[type_text.index("(") + 1:type_text.rindex(")")]
+        key, _, type_text = re.split(r"(=\s*>)", inner, maxsplit=1)
+        # the key may be named, "mapping(address owner => uint256)"
+        parameters.append(_canonical_type(key.split()[0]) if key.split() else None)
+        type_text = type_text.strip()
+    parameters += ["uint256"] * type_text.count("[")
+    return None if None in parameters else parameters
+
+
+def public_signatures(code: str) -> list:
+    """
+    (name, parameter types) of every selector the source exposes: public / external functions of
+    every contract, interface and base contract in it, overloads included, and the getters of public
+    state variables. Declarations with user-defined parameter types cannot be hashed here and are left out.
+    """
+    signatures = [(name, parameters) for name, visibility, parameters in _function_declarations(code)
+                  if visibility is not None and parameters is not None]
+
+    tokens = tokenize(code)
+    code_indices = tokens.code_indices()
+    for open_, close in tokens.top_level_blocks():
+        statement = []
+        i = bisect_left(code_indices, open_ + 1)
+        while i < len(code_indices) and code_indices[i] < close:
+            j = code_indices[i]
+            if tokens.is_punct(j, "{") and tokens.match[j] != -1:
+                # function, modifier and struct bodies end their declaration
+                statement = []
+                i = bisect_left(code_indices, tokens.match[j] + 1)
+                continue
+            if not tokens.is_punct(j, ";"):
+                statement.append(j)
+                i += 1
+                continue
+            i += 1
+            declaration, statement = statement, []
+            words = [tokens.token_text(t) for t in declaration]
+            if not words or words[0] in _NOT_STATE_VARIABLES or "public" not in words:
+                continue
+            # the type runs up to the first keyword, the name is the last word before the initializer
+            type_end = next(k for k, word in enumerate(words) if word in _STATE_VARIABLE_KEYWORDS)
+            end = len(words)
+            depth = 0
+            for k, word in enumerate(words):
+                depth += (word == "(") - (word == ")")
+                if word == "=" and depth == 0 and words[k + 1:k + 2] != [">"]:
+                    end = k
+                    break
+            if type_end == 0 or end - 1 <= type_end:
+                continue
+            parameters = _getter_parameters(code[tokens.starts[declaration[0]]:tokens.ends[declaration[type_end - 1]]])
+            if parameters is not None:
+                signatures.append((words[end - 1], parameters))
+    return signatures
+
+
+def selector(name: str, parameters: list) -> int:
+    return int.from_bytes(keccak256(f"{name}({','.join(parameters)})".encode())[:4], "big")
+
+
+def leading_zero_bytes(value: int) -> int:
+    return next((i for i in range(4) if value >> (24 - 8 * i) & 0xFF), 4)
+
+
+def _nonce_text(nonce: int) -> str:
+    text = ""
+    while True:
+        nonce, digit = divmod(nonce, len(_NONCE_ALPHABET))
+        text = _NONCE_ALPHABET[digit] + text
+        if nonce == 0:
+            return text
+
+
+def _search(prefix: str, suffix: str, start: int, count: int, limit: int, taken: frozenset):
+    """First nonce in [start, start + count) whose selector is below limit and not taken, as (nonce, selector)"""
+    for nonce in range(start, start + count):
+        value = int.from_bytes(keccak256(f"{prefix}{_nonce_text(nonce)}{suffix}".encode())[:4], "big")
+        if value < limit and value not in taken:
+            return nonce, value
+    return None
+
+
+class SelectorMiner:
+    """
+    Mines function names whose selectors start with zero bytes (4 instead of 16 calldata gas
+    per byte) and ranks hot functions first in solc's dispatcher.
+
+    solc compares the selector against the external functions in ascending selector order
+    (within each partition of its split dispatcher), so a function is reached earlier the
+    smaller its selector is. Functions without a rank only need the zero bytes; ranked ones
+    are then mined from the coldest to the hottest, each below the previous selector.
+    Names are a random prefix followed by a nonce; the nonce space is searched in chunks,
+    in this process or, with workers > 1, by a process pool of that size.
+    A mined selector never equals one in reserved, the selectors the contract keeps.
+    """
+
+    def __init__(self, zero_bytes: int = DEFAULT_ZERO_BYTES, workers: int = DEFAULT_MINING_WORKERS,
+                 max_tries: int = MAX_TRIES, reserved=()):
+        self.zero_bytes = zero_bytes
+        self.workers = max(1, workers or DEFAULT_MINING_WORKERS)
+        self.max_tries = max_tries
+        self.reserved = frozenset(reserved)
+        # name -> (new name, selector)
+        self.mined = {}
+
+    def _mine(self, pool, prefix: str, parameters: list, limit: int):
+        suffix = f"({','.join(parameters)})"
+        taken = self.reserved.union(value for _, value in self.mined.values())
+        if pool is None:
+            for start in range(0, self.max_tries, CHUNK_SIZE):
+                found = _search(prefix, suffix, start, CHUNK_SIZE, limit, taken)
+                if found is not None:
+                    return prefix + _nonce_text(found[0]), found[1]
+            return None
+        batch = self.workers
+        for start in range(0, self.max_tries, CHUNK_SIZE * batch):
+            futures = [pool.submit(_search, prefix, suffix, start + CHUNK_SIZE * b, CHUNK_SIZE, limit, taken)
+                       for b in range(batch)]
+            # the lowest chunk with a hit wins, so the result does not depend on scheduling
+            for future in futures:
+                found = future.result()
+                if found is not None:
+                    nonce, value = found
+                    return prefix + _nonce_text(nonce), value
+        return None
+
+    def mine(self, signatures: dict, prefixes: dict, hot_order=()) -> dict:
+        """
+        {old name: new name} for the functions of signatures (see external_signatures).
+        prefixes gives the random name prefix of every function, hot_order lists function names
+        from the hottest down. A function whose target cannot be met within max_tries is left out.
+        """
+        zero_limit = 1 << (32 - 8 * self.zero_bytes)
+        ranked = [name for name in dict.fromkeys(hot_order) if name in signatures]
+        unranked = [name for name in signatures if name not in ranked]
+
+        with ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else nullcontext() as pool:
+            for name in unranked:
+                found = self._mine(pool, prefixes[name], signatures[name], zero_limit)
+                if found is not None:
+                    self.mined[name] = found
+            bound = min((value for _, value in self.mined.values()), default=zero_limit)
+            for name in reversed(ranked):
+                found = self._mine(pool, prefixes[name], signatures[name], min(bound, zero_limit))
+                if found is None:
+                    print(f"Selector mining: no selector below {bound:#010x} for {name} within {self.max_tries} tries")
+                    continue
+                self.mined[name] = found
+                bound = found[1]
+        return {name: new_name for name, (new_name, _) in self.mined.items()}
+
+    def summary(self) -> str:
+        zero_bytes = sum(leading_zero_bytes(value) for _, value in self.mined.values())
+        order = sorted(self.mined.items(), key=lambda item: item[1][1])
+        return (f"Selector mining: {len(self.mined)} functions, {zero_bytes} leading zero selector bytes, "
+                f"{(NONZERO_BYTE_GAS - ZERO_BYTE_GAS) * zero_bytes} calldata gas saved over one call of each; "
+                f"dispatch order {', '.join(f'{name} ({value:08x})' for name, (_, value) in order) or 'unchanged'}")
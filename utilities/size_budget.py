@@ -0,0 +1,121 @@
+from utilities import gas_harness
+from utilities.lexer import TokenStream, tokenize
+
+# EIP-170 maximum runtime code size
+EIP170_LIMIT = 24576
+# runtime bytes per code token before the first real compile calibrates it
+DEFAULT_BYTES_PER_TOKEN = 3.0
+# compile for real once the estimate passes this share of the limit
+CHECK_THRESHOLD = 0.85
+
+
+def code_weight(code: str, cached: bool = True) -> int:
+    """Number of code tokens (no whitespace / comments), the unit of the size estimate"""
+    tokens = tokenize(code) if cached else TokenStream(code)
+    return len(tokens.code_indices())
+
+
+class SizeBudget:
+    """
+    Keeps an obfuscation run under a maximum runtime bytecode size.
+
+    The size of a source is estimated as a linear function of its code token count,
+    anchored on the last real compile and calibrated from the marginal size change
+    between real compiles. Real compiles happen every compile_every steps and whenever
+    the estimate gets close to the limit. Passes ask allow(snippet) before each insertion
+    so they can thin out; a finished step that still ends up over the limit is vetoed
+    by the observer returned from observer().
+    """
+
+    def __init__(self, code: str, pragma_statement: str = "", max_runtime_size: int = EIP170_LIMIT,
+                 max_overhead_percent: float = None, compile_every: int = 3):
+        """code is the pragma-free source the pipeline starts from, as the observer sees it"""
+        self.pragma_statement = pragma_statement
+        self.limit = max_runtime_size
+        self.compile_every = compile_every
+        self.bytes_per_token = DEFAULT_BYTES_PER_TOKEN
+        self.compiles = 0
+        self.vetoed = []
+        self.denied_insertions = 0
+        self.steps_since_compile = 0
+        self.pending = 0.0
+
+        weight = code_weight(code)
+        self.original_size = self._compiled_size(code)
+        if self.original_size is not None:
+            self.bytes_per_token = self.original_size / weight if weight else DEFAULT_BYTES_PER_TOKEN
+            if max_overhead_percent:
+                self.limit = min(self.limit, int(self.original_size * (1 + max_overhead_percent / 100)))
+        self.anchor_size = self.original_size if self.original_size is not None else weight * self.bytes_per_token
+        self.anchor_weight = weight
+        self.current_estimate = self.anchor_size
+
+    def _compiled_size(self, code: str):
+        """Largest runtime size among the contracts of code, or None if it cannot be compiled"""
+        try:
+            contracts = gas_harness.compile_contracts(self.pragma_statement + code)
+        except Exception:
+            return None
+        self.compiles += 1
+        return max((len(c["runtime"]) // 2 for c in contracts.values()), default=0)
+
+    def _calibrate(self, code: str, size: int):
+        weight = code_weight(code)
+        if weight != self.anchor_weight:
+            marginal = (size - self.anchor_size) / (weight - self.anchor_weight)
+            if marginal > 0:
+                self.bytes_per_token = (self.bytes_per_token + marginal) / 2
+        self.anchor_size = size
+        self.anchor_weight = weight
+        self.steps_since_compile = 0
+
+    def estimate(self, code: str) -> float:
+        return self.anchor_size + self.bytes_per_token * (code_weight(code) - self.anchor_weight)
+
+    def allow(self, snippet: str) -> bool:
+        """Reserve room for inserting snippet in the current step; False means skip this insertion"""
+        cost = self.bytes_per_token * code_weight(snippet, cached=False)
+        if self.current_estimate + self.pending + cost > self.limit:
+            self.denied_insertions += 1
+            return False
+        self.pending += cost
+        return True
+
+    def release(self, snippet: str):
+        """Give back the room reserved by allow for a snippet that was not inserted after all"""
+        self.pending = max(0.0, self.pending - self.bytes_per_token * code_weight(snippet, cached=False))
+
+    def check_step(self, step: str, before: str, after: str):
+        """Accept after, or return before when the step would exceed the limit"""
+        self.pending = 0.0
+        self.steps_since_compile += 1
+        estimate = self.estimate(after)
+        if estimate > self.limit * CHECK_THRESHOLD or self.steps_since_compile >= self.compile_every:
+            size = self._compiled_size(after)
+            if size is not None:
+                self._calibrate(after, size)
+                estimate = size
+        if estimate > self.limit:
+            self.vetoed.append(step)
+            print(f"Size budget: skipped {step} (about {estimate:.0f} > {self.limit} bytes)")
+            return before
+        self.current_estimate = estimate
+        return None
+
+    def observer(self, downstream=None):
+        """Observer that enforces the budget and then forwards the kept result to downstream"""
+        def observe(step, before, after):
+            kept = self.check_step(step, before, after)
+            code = after if kept is None else kept
+            if downstream is not None:
+                forwarded = downstream(step, before, code)
+                if forwarded is not None:
+                    code = forwarded
+            return code
+        return observe
+
+    def summary(self) -> str:
+        original = f"{self.original_size} bytes" if self.original_size is not None else "unknown (not compiled)"
+        return (f"Size budget: limit {self.limit} bytes, original {original}, "
+                f"final estimate {self.current_estimate:.0f} bytes, {self.compiles} compiles, "
+                f"{self.denied_insertions} insertions thinned, vetoed steps: {', '.join(self.vetoed) or 'none'}")